@@ -4,17 +4,22 @@ import datetime
 import os
 from bson.objectid import ObjectId
 from models.user_model import User
-from models.conversation_model import get_db, Conversation
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from models.conversation_model import get_db, Conversation, MESSAGE_COUNT_EXPRESSION
+from flask_jwt_extended import get_jwt_identity
+from utils.metrics import jwt_required
 from functools import wraps
 import json
 from core.embedding_model import get_embedding_model
 from werkzeug.utils import secure_filename
-import google.generativeai as genai
-from config import GEMINI_API_KEY
+from core.llm_backend import get_llm_backend
+from config import DOCUMENT_PROCESSING_MODEL
 import time
 import sys
 from models.feedback_model import Feedback
+from utils.snapshot_cache import get_snapshot_cache
+from models.rollup_model import (
+    VIETNAM_TZ_NAME, vietnam_now, get_daily_rollups, get_total_rollup, get_age_distribution
+)
 
 # Thiết lập logging
 logger = logging.getLogger(__name__)
@@ -22,9 +27,6 @@ logger = logging.getLogger(__name__)
 # Tạo blueprint
 admin_routes = Blueprint('admin', __name__)
 
-# Configure Gemini
-genai.configure(api_key=GEMINI_API_KEY)
-
 def setup_debug_logging():
     """Thiết lập logging debug cho Gemini response"""
     log_dir = "logs"
@@ -116,120 +118,103 @@ def require_admin(f):
 
 # ===== DASHBOARD ROUTES =====
 
+def _snapshot_response(name, loader):
+    """
+    Trả về snapshot gần nhất của một trang dashboard kèm tuổi của nó
+
+    Dùng ?refresh=true để bỏ qua snapshot và load lại ngay.
+    """
+    force = request.args.get('refresh', 'false').lower() == 'true'
+    data, snapshot = get_snapshot_cache().get(name, loader, force=force)
+    return jsonify({
+        "success": True,
+        **data,
+        "snapshot": snapshot
+    })
+
+def _load_overview_stats():
+    """Thống kê tổng quan cho dashboard (được lưu trong snapshot cache)"""
+    db = get_db()
+    
+    # Sử dụng timezone Việt Nam (UTC+7)
+    now_vietnam = vietnam_now()
+    
+    # Bộ đếm theo ngày đã được cộng sẵn khi ghi (daily_rollups), không quét lại collections
+    daily_rollups = get_daily_rollups(7)
+    total_rollup = get_total_rollup()
+    
+    # Thống kê users thực tế
+    total_users = db.users.estimated_document_count()
+    new_users_today = daily_rollups[-1]["new_users"]
+    
+    # Thống kê conversations thực tế
+    total_conversations = db.conversations.estimated_document_count()
+    day_ago = now_vietnam - datetime.timedelta(days=1)
+    recent_conversations = db.conversations.count_documents({
+        "updated_at": {"$gte": day_ago.astimezone(datetime.timezone.utc).replace(tzinfo=None)}
+    })
+    
+    # Thống kê tin nhắn thực tế (bộ đếm tổng được trừ lại khi xóa, trung bình tính trên cùng bộ đếm)
+    total_messages = total_rollup["messages"]
+    counted_conversations = total_rollup["conversations_created"]
+    
+    # Thống kê admin thực tế
+    total_admins = db.users.count_documents({"role": "admin"})
+    
+    # Thống kê theo tuần (7 ngày gần nhất)
+    daily_stats = []
+    for rollup in daily_rollups:
+        target_date = datetime.date.fromisoformat(rollup["date"])
+        daily_stats.append({
+            "date": rollup["date"],
+            "label": target_date.strftime("%d/%m"),
+            # Conversations được tạo HOẶC cập nhật trong ngày (không đếm trùng)
+            "conversations": rollup["conversations_created"] + rollup["conversations_updated"],
+            "users": rollup["new_users"],
+            "created": rollup["conversations_created"],
+            "updated": rollup["conversations_updated"]
+        })
+    
+    # Thống kê theo độ tuổi thực tế
+    age_stats = get_age_distribution()
+    
+    return {
+        "stats": {
+            "users": {
+                "total": total_users,
+                "new_today": new_users_today,
+                "active": total_users
+            },
+            "conversations": {
+                "total": total_conversations,
+                "recent": recent_conversations
+            },
+            "messages": {
+                "total": total_messages,
+                "avg_per_conversation": round(total_messages / counted_conversations, 1) if counted_conversations > 0 else 0
+            },
+            "admins": {
+                "total": total_admins
+            },
+            "daily_stats": daily_stats,
+            "age_distribution": [
+                {
+                    "age_group": f"{stat['_id']} tuổi" if stat['_id'] else "Không rõ",
+                    "count": stat["count"]
+                }
+                for stat in age_stats
+            ],
+            "timezone": VIETNAM_TZ_NAME,
+            "current_time": now_vietnam.isoformat()
+        }
+    }
+
 @admin_routes.route('/stats/overview', methods=['GET'])
 @require_admin
 def get_overview_stats():
     """Lấy thống kê tổng quan cho dashboard"""
     try:
-        db = get_db()
-        
-        # Sử dụng timezone Việt Nam (UTC+7)
-        import pytz
-        vietnam_tz = pytz.timezone('Asia/Ho_Chi_Minh')
-        now_vietnam = datetime.datetime.now(vietnam_tz)
-        
-        # Thống kê users thực tế
-        total_users = db.users.count_documents({}) if hasattr(db, 'users') else 0
-        today_start = now_vietnam.replace(hour=0, minute=0, second=0, microsecond=0)
-        new_users_today = db.users.count_documents({
-            "created_at": {"$gte": today_start.astimezone(pytz.UTC).replace(tzinfo=None)}
-        }) if hasattr(db, 'users') else 0
-        
-        # Thống kê conversations thực tế
-        total_conversations = db.conversations.count_documents({})
-        day_ago = now_vietnam - datetime.timedelta(days=1)
-        recent_conversations = db.conversations.count_documents({
-            "updated_at": {"$gte": day_ago.astimezone(pytz.UTC).replace(tzinfo=None)}
-        })
-        
-        # Thống kê tin nhắn thực tế
-        pipeline = [
-            {"$project": {"message_count": {"$size": "$messages"}}},
-            {"$group": {"_id": None, "total_messages": {"$sum": "$message_count"}}}
-        ]
-        message_result = list(db.conversations.aggregate(pipeline))
-        total_messages = message_result[0]["total_messages"] if message_result else 0
-        
-        # Thống kê admin thực tế
-        total_admins = db.users.count_documents({"role": "admin"}) if hasattr(db, 'users') else 0
-        
-        # Thống kê theo tuần (7 ngày gần nhất) - SỬA LẠI
-        daily_stats = []
-        for i in range(7):
-            # Tính ngày theo timezone Việt Nam
-            target_date = now_vietnam.date() - datetime.timedelta(days=6-i)
-            day_start = vietnam_tz.localize(datetime.datetime.combine(target_date, datetime.time.min))
-            day_end = vietnam_tz.localize(datetime.datetime.combine(target_date, datetime.time.max))
-            
-            # Convert về UTC để query MongoDB
-            day_start_utc = day_start.astimezone(pytz.UTC).replace(tzinfo=None)
-            day_end_utc = day_end.astimezone(pytz.UTC).replace(tzinfo=None)
-            
-            # Đếm conversations được tạo HOẶC cập nhật trong ngày
-            daily_conversations_created = db.conversations.count_documents({
-                "created_at": {"$gte": day_start_utc, "$lte": day_end_utc}
-            })
-            
-            daily_conversations_updated = db.conversations.count_documents({
-                "updated_at": {"$gte": day_start_utc, "$lte": day_end_utc},
-                "created_at": {"$lt": day_start_utc}  # Không đếm trùng với conversations mới tạo
-            })
-            
-            total_daily_activity = daily_conversations_created + daily_conversations_updated
-            
-            daily_users = 0
-            if hasattr(db, 'users'):
-                daily_users = db.users.count_documents({
-                    "created_at": {"$gte": day_start_utc, "$lte": day_end_utc}
-                })
-            
-            daily_stats.append({
-                "date": target_date.strftime("%Y-%m-%d"),
-                "label": target_date.strftime("%d/%m"),
-                "conversations": total_daily_activity,
-                "users": daily_users,
-                "created": daily_conversations_created,
-                "updated": daily_conversations_updated
-            })
-        
-        # Thống kê theo độ tuổi thực tế
-        age_pipeline = [
-            {"$group": {"_id": "$age_context", "count": {"$sum": 1}}},
-            {"$sort": {"_id": 1}}
-        ]
-        age_stats = list(db.conversations.aggregate(age_pipeline))
-        
-        return jsonify({
-            "success": True,
-            "stats": {
-                "users": {
-                    "total": total_users,
-                    "new_today": new_users_today,
-                    "active": total_users
-                },
-                "conversations": {
-                    "total": total_conversations,
-                    "recent": recent_conversations
-                },
-                "messages": {
-                    "total": total_messages,
-                    "avg_per_conversation": round(total_messages / total_conversations, 1) if total_conversations > 0 else 0
-                },
-                "admins": {
-                    "total": total_admins
-                },
-                "daily_stats": daily_stats,
-                "age_distribution": [
-                    {
-                        "age_group": f"{stat['_id']} tuổi" if stat['_id'] else "Không rõ",
-                        "count": stat["count"]
-                    }
-                    for stat in age_stats
-                ],
-                "timezone": "Asia/Ho_Chi_Minh",
-                "current_time": now_vietnam.isoformat()
-            }
-        })
+        return _snapshot_response("stats_overview", _load_overview_stats)
         
     except Exception as e:
         logger.error(f"Lỗi lấy thống kê tổng quan: {str(e)}")
@@ -286,38 +271,41 @@ def get_system_info():
             "error": str(e)
         }), 500
 
+def _load_system_alerts():
+    """Cảnh báo hệ thống (được lưu trong snapshot cache)"""
+    alerts = []
+    
+    # Kiểm tra số lượng conversations
+    db = get_db()
+    total_conversations = db.conversations.estimated_document_count()
+    
+    if total_conversations > 100:
+        alerts.append({
+            "type": "info",
+            "title": "Lượng dữ liệu cao",
+            "message": f"Hệ thống có {total_conversations} cuộc hội thoại",
+            "severity": "low"
+        })
+    
+    # Mặc định: hệ thống hoạt động bình thường
+    if not alerts:
+        alerts.append({
+            "type": "info",
+            "title": "Hệ thống hoạt động bình thường",
+            "message": "Tất cả dịch vụ đang chạy ổn định",
+            "severity": "low"
+        })
+    
+    return {
+        "alerts": alerts
+    }
+
 @admin_routes.route('/alerts', methods=['GET'])
 @require_admin
 def get_system_alerts():
     """Lấy cảnh báo hệ thống"""
     try:
-        alerts = []
-        
-        # Kiểm tra số lượng conversations
-        db = get_db()
-        total_conversations = db.conversations.count_documents({})
-        
-        if total_conversations > 100:
-            alerts.append({
-                "type": "info",
-                "title": "Lượng dữ liệu cao",
-                "message": f"Hệ thống có {total_conversations} cuộc hội thoại",
-                "severity": "low"
-            })
-        
-        # Mặc định: hệ thống hoạt động bình thường
-        if not alerts:
-            alerts.append({
-                "type": "info",
-                "title": "Hệ thống hoạt động bình thường",
-                "message": "Tất cả dịch vụ đang chạy ổn định",
-                "severity": "low"
-            })
-        
-        return jsonify({
-            "success": True,
-            "alerts": alerts
-        })
+        return _snapshot_response("alerts", _load_system_alerts)
         
     except Exception as e:
         logger.error(f"Lỗi lấy cảnh báo hệ thống: {str(e)}")
@@ -360,23 +348,34 @@ def get_all_users():
         skip = (page - 1) * per_page
         sort_direction = -1 if sort_order == 'desc' else 1
         
-        users_cursor = users_collection.find(query_filter).sort(sort_by, sort_direction).skip(skip).limit(per_page)
-        total_users = users_collection.count_documents(query_filter)
+        # Trang users kèm thống kê conversation của từng user (một aggregation, $lookup dùng index user_id)
+        users_pipeline = [
+            {"$match": query_filter},
+            {"$sort": {sort_by: sort_direction}},
+            {"$skip": skip},
+            {"$limit": per_page},
+            {"$lookup": {
+                "from": "conversations",
+                "let": {"user_id": "$_id"},
+                "pipeline": [
+                    {"$match": {"$expr": {"$eq": ["$user_id", "$$user_id"]}}},
+                    {"$group": {
+                        "_id": None,
+                        "conversation_count": {"$sum": 1},
+                        "message_count": {"$sum": MESSAGE_COUNT_EXPRESSION},
+                        "last_activity": {"$max": "$updated_at"}
+                    }}
+                ],
+                "as": "conversation_stats"
+            }}
+        ]
         
         users_list = []
-        for user_data in users_cursor:
-            # Đếm conversations thực tế
-            conversation_count = db.conversations.count_documents({"user_id": user_data["_id"]})
-            
-            # Lấy conversation mới nhất để biết last_activity
-            latest_conversation = db.conversations.find_one(
-                {"user_id": user_data["_id"]},
-                sort=[("updated_at", -1)]
-            )
-            
-            # Đếm tin nhắn
-            user_conversations = list(db.conversations.find({"user_id": user_data["_id"]}))
-            total_messages = sum(len(conv.get("messages", [])) for conv in user_conversations)
+        for user_data in users_collection.aggregate(users_pipeline):
+            conversation_stats = user_data["conversation_stats"][0] if user_data.get("conversation_stats") else {}
+            conversation_count = conversation_stats.get("conversation_count", 0)
+            total_messages = conversation_stats.get("message_count", 0)
+            last_activity = conversation_stats.get("last_activity")
             
             users_list.append({
                 "id": str(user_data["_id"]),
@@ -389,21 +388,40 @@ def get_all_users():
                 "last_login": user_data.get("last_login").isoformat() if user_data.get("last_login") else None,
                 "conversation_count": conversation_count,
                 "message_count": total_messages,
-                "last_activity": latest_conversation.get("updated_at").isoformat() if latest_conversation and latest_conversation.get("updated_at") else None,
+                "last_activity": last_activity.isoformat() if last_activity else None,
                 "avg_messages_per_conversation": round(total_messages / conversation_count, 1) if conversation_count > 0 else 0
             })
         
-        # Thống kê tổng hợp
+        # Tổng số user theo filter và thống kê tổng hợp (một $facet)
+        stats_pipeline = [
+            {"$facet": {
+                "total": [{"$match": query_filter}, {"$count": "count"}],
+                "breakdown": [{"$group": {
+                    "_id": None,
+                    "total_admins": {"$sum": {"$cond": [{"$eq": ["$role", "admin"]}, 1, 0]}},
+                    "total_regular_users": {"$sum": {"$cond": [{"$eq": ["$role", "user"]}, 1, 0]}},
+                    "active_users": {"$sum": {"$cond": [{"$ne": [{"$type": "$last_login"}, "missing"]}, 1, 0]}},
+                    "male": {"$sum": {"$cond": [{"$eq": ["$gender", "male"]}, 1, 0]}},
+                    "female": {"$sum": {"$cond": [{"$eq": ["$gender", "female"]}, 1, 0]}},
+                    "other": {"$sum": {"$cond": [{"$eq": ["$gender", "other"]}, 1, 0]}},
+                    "unknown": {"$sum": {"$cond": [{"$in": [{"$ifNull": ["$gender", ""]}, ["", None]]}, 1, 0]}}
+                }}]
+            }}
+        ]
+        facet_result = next(users_collection.aggregate(stats_pipeline), {})
+        total_users = facet_result["total"][0]["count"] if facet_result.get("total") else 0
+        breakdown = facet_result["breakdown"][0] if facet_result.get("breakdown") else {}
+        
         stats = {
             "total_users": total_users,
-            "total_admins": users_collection.count_documents({"role": "admin"}),
-            "total_regular_users": users_collection.count_documents({"role": "user"}),
-            "active_users": users_collection.count_documents({"last_login": {"$exists": True}}),
+            "total_admins": breakdown.get("total_admins", 0),
+            "total_regular_users": breakdown.get("total_regular_users", 0),
+            "active_users": breakdown.get("active_users", 0),
             "gender_stats": {
-                "male": users_collection.count_documents({"gender": "male"}),
-                "female": users_collection.count_documents({"gender": "female"}),
-                "other": users_collection.count_documents({"gender": "other"}),
-                "unknown": users_collection.count_documents({"gender": {"$in": [None, ""]}})
+                "male": breakdown.get("male", 0),
+                "female": breakdown.get("female", 0),
+                "other": breakdown.get("other", 0),
+                "unknown": breakdown.get("unknown", 0)
             }
         }
         
@@ -438,22 +456,17 @@ def get_user_detail(user_id):
                 "error": "Không tìm thấy người dùng"
             }), 404
         
-        db = get_db()
-        
-        # Lấy conversations của user
-        user_conversations = list(db.conversations.find(
-            {"user_id": ObjectId(user_id)},
-            {"title": 1, "created_at": 1, "updated_at": 1, "age_context": 1, "messages": 1}
-        ).sort("updated_at", -1))
+        # Lấy tóm tắt conversations của user (không đọc messages)
+        user_conversations = Conversation.find_summaries_by_user(user_id, limit=None, include_archived=True)
         
         # Tính thống kê chi tiết
-        total_messages = sum(len(conv.get("messages", [])) for conv in user_conversations)
+        total_messages = sum(conv["message_count"] for conv in user_conversations)
         conversation_stats = {
             "total_conversations": len(user_conversations),
             "total_messages": total_messages,
             "avg_messages_per_conversation": round(total_messages / len(user_conversations), 1) if user_conversations else 0,
-            "most_recent_conversation": user_conversations[0].get("updated_at").isoformat() if user_conversations and user_conversations[0].get("updated_at") else None,
-            "oldest_conversation": user_conversations[-1].get("created_at").isoformat() if user_conversations and user_conversations[-1].get("created_at") else None
+            "most_recent_conversation": user_conversations[0]["updated_at"] if user_conversations else None,
+            "oldest_conversation": user_conversations[-1]["created_at"] if user_conversations else None
         }
         
         # Thống kê theo độ tuổi
@@ -476,12 +489,12 @@ def get_user_detail(user_id):
             "age_usage": age_stats,
             "recent_conversations": [
                 {
-                    "id": str(conv["_id"]),
-                    "title": conv.get("title", ""),
-                    "created_at": conv.get("created_at").isoformat() if conv.get("created_at") else None,
-                    "updated_at": conv.get("updated_at").isoformat() if conv.get("updated_at") else None,
-                    "message_count": len(conv.get("messages", [])),
-                    "age_context": conv.get("age_context")
+                    "id": conv["id"],
+                    "title": conv["title"] or "",
+                    "created_at": conv["created_at"],
+                    "updated_at": conv["updated_at"],
+                    "message_count": conv["message_count"],
+                    "age_context": conv["age_context"]
                 }
                 for conv in user_conversations[:10]
             ]
@@ -512,8 +525,7 @@ def delete_user(user_id):
             }), 404
         
         # Xóa tất cả conversations của user
-        db = get_db()
-        conversations_deleted = db.conversations.delete_many({"user_id": ObjectId(user_id)})
+        conversations_deleted = Conversation.delete_many({"user_id": ObjectId(user_id)})
         
         # Xóa user
         user_deleted = user.delete()
@@ -521,7 +533,7 @@ def delete_user(user_id):
         if user_deleted:
             return jsonify({
                 "success": True,
-                "message": f"Đã xóa người dùng và {conversations_deleted.deleted_count} cuộc hội thoại"
+                "message": f"Đã xóa người dùng và {conversations_deleted} cuộc hội thoại"
             })
         else:
             return jsonify({
@@ -553,12 +565,10 @@ def bulk_delete_users():
         deleted_count = 0
         failed_ids = []
         
-        db = get_db()
-        
         for user_id in user_ids:
             try:
                 # Xóa conversations của user
-                db.conversations.delete_many({"user_id": ObjectId(user_id)})
+                Conversation.delete_many({"user_id": ObjectId(user_id)})
                 
                 # Xóa user
                 user = User.find_by_id(user_id)
@@ -639,8 +649,8 @@ def get_all_conversations():
                         return dt.isoformat()
                     return str(dt)
                 
-                # ✅ FIX: Safely handle messages array
-                messages = conv.get("messages", [])
+                # ✅ FIX: Safely handle messages array (chỉ lấy nhánh đang active)
+                messages = Conversation.from_dict(conv).messages
                 processed_messages = []
                 
                 for msg in messages:
@@ -736,7 +746,6 @@ def bulk_delete_conversations():
                 "error": "Không có conversation nào được chọn"
             }), 400
         
-        db = get_db()
         deleted_count = 0
         failed_ids = []
         
@@ -746,8 +755,7 @@ def bulk_delete_conversations():
                 if isinstance(conv_id, str):
                     conv_id = ObjectId(conv_id)
                 
-                result = db.conversations.delete_one({"_id": conv_id})
-                if result.deleted_count > 0:
+                if Conversation.delete_many({"_id": conv_id}) > 0:
                     deleted_count += 1
                 else:
                     failed_ids.append(str(conv_id))
@@ -775,75 +783,42 @@ def bulk_delete_conversations():
 @admin_routes.route('/documents', methods=['GET'])
 @require_admin
 def get_all_documents():
-    """Lấy danh sách tài liệu từ ChromaDB theo đúng metadata"""
+    """Lấy danh sách tài liệu từ chapter summary (không đọc nội dung chunk)"""
     try:
         embedding_model = get_embedding_model()
+        chapters = embedding_model.get_chapter_summary()
         
-        # Lấy tất cả documents từ ChromaDB
-        results = embedding_model.collection.get(
-            include=['metadatas', 'documents']
-        )
-        
-        if not results or not results['metadatas']:
-            return jsonify({
-                "success": True,
-                "documents": [],
-                "stats": {
-                    "total": 0,
-                    "by_chapter": {},
-                    "by_type": {}
-                }
-            })
-        
-        # Phân tích metadata để nhóm theo chapter
-        documents_by_chapter = {}
         stats = {
-            "total": 0,
+            "total": len(chapters),
             "by_chapter": {},
             "by_type": {}
         }
-        
-        for i, metadata in enumerate(results['metadatas']):
-            # Lấy chapter từ metadata
-            chapter = metadata.get('chapter', 'unknown')
-            content_type = metadata.get('content_type', 'text')
-            
-            # Cập nhật stats
-            stats["by_chapter"][chapter] = stats["by_chapter"].get(chapter, 0) + 1
-            stats["by_type"][content_type] = stats["by_type"].get(content_type, 0) + 1
-            
-            # Nhóm theo chapter
-            if chapter not in documents_by_chapter:
-                chapter_title = get_chapter_title(chapter)
-                chapter_type = get_chapter_type(chapter)
-                
-                documents_by_chapter[chapter] = {
-                    "id": chapter,
-                    "title": chapter_title,
-                    "description": f"Tài liệu {chapter_title.lower()}",
-                    "type": chapter_type,
-                    "status": "processed",
-                    "created_at": metadata.get('created_at', datetime.datetime.now().isoformat()),
-                    "content_stats": {
-                        "chunks": 0,
-                        "tables": 0,
-                        "figures": 0
-                    }
+        documents_list = []
+        
+        for chapter, summary in chapters.items():
+            stats["by_chapter"][chapter] = summary["total"]
+            for content_type, count in summary["by_type"].items():
+                stats["by_type"][content_type] = stats["by_type"].get(content_type, 0) + count
+            
+            tables = summary["by_type"].get("table", 0)
+            figures = summary["by_type"].get("figure", 0)
+            chapter_title = get_chapter_title(chapter, summary)
+            
+            documents_list.append({
+                "id": chapter,
+                "title": chapter_title,
+                "description": f"Tài liệu {chapter_title.lower()}",
+                "type": get_chapter_type(chapter),
+                "status": "processed",
+                "created_at": summary.get("created_at") or datetime.datetime.now().isoformat(),
+                "content_stats": {
+                    "chunks": summary["total"] - tables - figures,
+                    "tables": tables,
+                    "figures": figures
                 }
-            
-            # Cập nhật content stats
-            if content_type == "table":
-                documents_by_chapter[chapter]["content_stats"]["tables"] += 1
-            elif content_type == "figure":
-                documents_by_chapter[chapter]["content_stats"]["figures"] += 1
-            else:
-                documents_by_chapter[chapter]["content_stats"]["chunks"] += 1
-        
-        documents_list = list(documents_by_chapter.values())
-        stats["total"] = len(documents_list)
+            })
         
-        logger.info(f"Found chapters: {list(documents_by_chapter.keys())}")
-        logger.info(f"Stats: {stats}")
+        logger.info(f"Found chapters: {list(chapters)}")
         
         return jsonify({
             "success": True,
@@ -858,21 +833,16 @@ def get_all_documents():
             "error": str(e)
         }), 500
 
-def get_chapter_title(chapter):
+def get_chapter_title(chapter, summary=None):
     try:
-        # Nếu là document upload, lấy title từ metadata
+        # Nếu là document upload, lấy title từ metadata (đã có sẵn trong chapter summary)
         if chapter.startswith('bosung') or chapter.startswith('upload_'):
-            embedding_model = get_embedding_model()
-            results = embedding_model.collection.get(
-                where={"chapter": chapter},
-                limit=1
-            )
+            if summary is None:
+                summary = get_embedding_model().get_chapter_summary().get(chapter, {})
             
-            if results and results.get('metadatas') and results['metadatas'][0]:
-                metadata = results['metadatas'][0]
-                document_title = metadata.get('document_title') or metadata.get('document_source')
-                if document_title and document_title != 'Tài liệu upload':
-                    return document_title
+            document_title = summary.get('document_title') or summary.get('document_source')
+            if document_title and document_title != 'Tài liệu upload':
+                return document_title
         
         # Fallback cho các chapter chuẩn
         chapter_titles = {
@@ -902,13 +872,70 @@ def get_chapter_type(chapter):
     else:
         return 'uploaded'
 
+# Các nhóm content_type trong chi tiết document (loại khác được xếp vào 'text')
+DOCUMENT_CHUNK_TYPES = ('text', 'table', 'figure')
+
+def _count_chapter_chunks(collection, doc_id):
+    """Đếm chunk theo content_type của một chapter chỉ từ metadata (khi không có chapter summary)"""
+    results = collection.get(where={"chapter": doc_id}, include=['metadatas'])
+    by_type = {}
+    for metadata in results.get('metadatas') or []:
+        content_type = (metadata or {}).get('content_type', 'text')
+        by_type[content_type] = by_type.get(content_type, 0) + 1
+    return {"total": sum(by_type.values()), "by_type": by_type}
+
+def _build_chunk(metadata, content, index):
+    """Chuyển metadata + nội dung của một chunk sang format trả về cho trang chi tiết"""
+    content_type = metadata.get('content_type', 'text')
+    
+    # Parse age_range
+    age_range_str = metadata.get('age_range', '1-19')
+    try:
+        if '-' in age_range_str:
+            age_min, age_max = map(int, age_range_str.split('-'))
+        else:
+            age_min = age_max = int(age_range_str)
+    except:
+        age_min, age_max = 1, 19
+    
+    return {
+        "id": metadata.get('chunk_id', f'chunk_{index}'),
+        "title": metadata.get('title', 'Không có tiêu đề'),
+        "content": content,
+        "content_type": content_type,
+        "age_range": age_range_str,
+        "age_min": age_min,
+        "age_max": age_max,
+        "summary": metadata.get('summary', 'Không có tóm tắt'),
+        "pages": metadata.get('pages', ''),
+        "word_count": metadata.get('word_count', 0),
+        "token_count": metadata.get('token_count', 0),
+        "related_chunks": metadata.get('related_chunks', '').split(',') if metadata.get('related_chunks') else [],
+        "created_at": metadata.get('created_at', ''),
+        "document_source": metadata.get('document_source', ''),
+        # Metadata đặc biệt
+        "contains_table": metadata.get('contains_table', False),
+        "contains_figure": metadata.get('contains_figure', False),
+        "table_columns": metadata.get('table_columns', '').split(',') if metadata.get('table_columns') else []
+    }
+
 @admin_routes.route('/documents/<doc_id>', methods=['GET'])
 @require_admin
 def get_document_detail(doc_id):
-    """Lấy chi tiết document theo chapter"""
+    """
+    Lấy chi tiết document theo chapter
+    
+    Có query param page thì phân trang chunk bằng where + limit/offset trên ChromaDB (per_page, mặc định 50),
+    không có page thì trả về toàn bộ chunk của chapter (trang chi tiết tài liệu của frontend hiển thị cả chapter)
+    """
     try:
         logger.info(f"Getting document detail for: {doc_id}")
         
+        paginated = 'page' in request.args
+        page = max(1, int(request.args.get('page', 1)))
+        per_page = max(1, min(200, int(request.args.get('per_page', 50)))) if paginated else None
+        content_type = request.args.get('content_type')
+        
         # Sử dụng try-catch để tránh lỗi tensor
         try:
             embedding_model = get_embedding_model()
@@ -920,49 +947,34 @@ def get_document_detail(doc_id):
             
             chroma_client = chromadb.PersistentClient(path=CHROMA_PERSIST_DIRECTORY)
             collection = chroma_client.get_collection(name=COLLECTION_NAME)
+            summary = None
         else:
             collection = embedding_model.collection
+            summary = embedding_model.get_chapter_summary().get(doc_id)
         
-        # Lấy tất cả documents và filter manually để tránh lỗi query
         try:
-            all_results = collection.get(
-                include=['metadatas', 'documents']  # Bỏ 'ids' để tránh lỗi
-            )
+            if summary is None:
+                summary = _count_chapter_chunks(collection, doc_id)
             
-            if not all_results or not all_results.get('metadatas'):
-                logger.warning("No documents found in collection")
+            if not summary["total"]:
                 return jsonify({
                     "success": False,
-                    "error": "Không có dữ liệu trong collection"
+                    "error": f"Không tìm thấy tài liệu cho {doc_id}"
                 }), 404
             
-            # Filter manually
-            filtered_documents = []
-            filtered_metadatas = []
-            
-            for i, metadata in enumerate(all_results['metadatas']):
-                if not metadata:
-                    continue
-                    
-                chunk_id = metadata.get('chunk_id', '')
-                chapter = metadata.get('chapter', '')
-                
-                # Kiểm tra match với doc_id
-                if (chunk_id.startswith(f"{doc_id}_") or 
-                    chapter == doc_id or
-                    (doc_id in ['bai1', 'bai2', 'bai3', 'bai4'] and chunk_id.startswith(f"{doc_id}_")) or
-                    (doc_id == 'phuluc' and 'phuluc' in chunk_id.lower())):
-                    
-                    filtered_documents.append(all_results['documents'][i])
-                    filtered_metadatas.append(metadata)
-            
-            logger.info(f"Found {len(filtered_documents)} matching documents for {doc_id}")
+            where = {"chapter": doc_id}
+            if content_type:
+                where = {"$and": [{"chapter": doc_id}, {"content_type": content_type}]}
             
-            if not filtered_documents:
-                return jsonify({
-                    "success": False,
-                    "error": f"Không tìm thấy tài liệu cho {doc_id}"
-                }), 404
+            if paginated:
+                results = collection.get(
+                    where=where,
+                    include=['metadatas', 'documents'],
+                    limit=per_page,
+                    offset=(page - 1) * per_page
+                )
+            else:
+                results = collection.get(where=where, include=['metadatas', 'documents'])
             
         except Exception as query_error:
             logger.error(f"ChromaDB query error: {query_error}")
@@ -971,57 +983,23 @@ def get_document_detail(doc_id):
                 "error": f"Lỗi truy vấn cơ sở dữ liệu: {str(query_error)}"
             }), 500
         
-        # Xử lý kết quả và nhóm theo content_type
-        chunks_by_type = {
-            'text': [],
-            'table': [],
-            'figure': []
-        }
+        # Nhóm các chunk của trang hiện tại theo content_type
+        chunks_by_type = {chunk_type: [] for chunk_type in DOCUMENT_CHUNK_TYPES}
+        offset = (page - 1) * per_page if paginated else 0
+        for i, (metadata, content) in enumerate(zip(results.get('metadatas') or [], results.get('documents') or [])):
+            chunk = _build_chunk(metadata or {}, content, offset + i)
+            chunk_type = chunk["content_type"] if chunk["content_type"] in chunks_by_type else 'text'
+            chunks_by_type[chunk_type].append(chunk)
         
-        for i, metadata in enumerate(filtered_metadatas):
-            content_type = metadata.get('content_type', 'text')
-            
-            # Parse age_range
-            age_range_str = metadata.get('age_range', '1-19')
-            try:
-                if '-' in age_range_str:
-                    age_min, age_max = map(int, age_range_str.split('-'))
-                else:
-                    age_min = age_max = int(age_range_str)
-            except:
-                age_min, age_max = 1, 19
-            
-            chunk = {
-                "id": metadata.get('chunk_id', f'chunk_{i}'),
-                "title": metadata.get('title', 'Không có tiêu đề'),
-                "content": filtered_documents[i],
-                "content_type": content_type,
-                "age_range": age_range_str,
-                "age_min": age_min,
-                "age_max": age_max,
-                "summary": metadata.get('summary', 'Không có tóm tắt'),
-                "pages": metadata.get('pages', ''),
-                "word_count": metadata.get('word_count', 0),
-                "token_count": metadata.get('token_count', 0),
-                "related_chunks": metadata.get('related_chunks', '').split(',') if metadata.get('related_chunks') else [],
-                "created_at": metadata.get('created_at', ''),
-                "document_source": metadata.get('document_source', ''),
-                # Metadata đặc biệt
-                "contains_table": metadata.get('contains_table', False),
-                "contains_figure": metadata.get('contains_figure', False),
-                "table_columns": metadata.get('table_columns', '').split(',') if metadata.get('table_columns') else []
-            }
-            
-            # Phân loại vào đúng nhóm
-            if content_type in chunks_by_type:
-                chunks_by_type[content_type].append(chunk)
-            else:
-                chunks_by_type['text'].append(chunk)
+        # Thống kê toàn bộ document (không chỉ trang hiện tại)
+        by_type = summary["by_type"]
+        table_chunks = by_type.get('table', 0)
+        figure_chunks = by_type.get('figure', 0)
+        total = by_type.get(content_type, 0) if content_type else summary["total"]
+        if not paginated:
+            per_page = max(1, total)
         
-        # Tính thống kê
-        total_chunks = sum(len(chunks) for chunks in chunks_by_type.values())
-        
-        logger.info(f"Successfully processed {total_chunks} chunks for {doc_id}")
+        logger.info(f"Returned {sum(len(chunks) for chunks in chunks_by_type.values())}/{total} chunks for {doc_id} (page {page})")
         
         return jsonify({
             "success": True,
@@ -1029,11 +1007,17 @@ def get_document_detail(doc_id):
                 "id": doc_id,
                 "chunks": chunks_by_type,
                 "stats": {
-                    "total_chunks": total_chunks,
-                    "text_chunks": len(chunks_by_type['text']),
-                    "table_chunks": len(chunks_by_type['table']),
-                    "figure_chunks": len(chunks_by_type['figure'])
+                    "total_chunks": summary["total"],
+                    "text_chunks": summary["total"] - table_chunks - figure_chunks,
+                    "table_chunks": table_chunks,
+                    "figure_chunks": figure_chunks
                 }
+            },
+            "pagination": {
+                "page": page,
+                "per_page": per_page,
+                "total": total,
+                "pages": (total + per_page - 1) // per_page
             }
         })
         
@@ -1170,32 +1154,19 @@ def generate_unique_document_id(title):
     try:
         embedding_model = get_embedding_model()
         
-        # Đếm số tài liệu bổ sung hiện có
-        results = embedding_model.collection.get(
-            where={"chapter": {"$like": "bosung%"}}
-        )
+        # Các tài liệu bổ sung hiện có (lấy từ chapter summary)
+        existing_chapters = [chapter for chapter in embedding_model.get_chapter_summary() if chapter.startswith('bosung')]
         
-        if results and results.get('metadatas'):
-            # Lấy tất cả chapter IDs bắt đầu bằng "bosung"
-            existing_chapters = set()
-            for metadata in results['metadatas']:
-                if metadata and metadata.get('chapter'):
-                    chapter = metadata['chapter']
-                    if chapter.startswith('bosung'):
-                        existing_chapters.add(chapter)
-            
-            # Tìm số thứ tự cao nhất
-            max_num = 0
-            for chapter in existing_chapters:
-                try:
-                    num = int(chapter.replace('bosung', ''))
-                    max_num = max(max_num, num)
-                except:
-                    continue
-            
-            next_num = max_num + 1
-        else:
-            next_num = 1
+        # Tìm số thứ tự cao nhất
+        max_num = 0
+        for chapter in existing_chapters:
+            try:
+                num = int(chapter.replace('bosung', ''))
+                max_num = max(max_num, num)
+            except:
+                continue
+        
+        next_num = max_num + 1
         
         # Tạo ID mới
         document_id = f"bosung{next_num}"
@@ -1248,7 +1219,7 @@ def process_document(doc_id):
             logger.info(f"Extracted {len(pdf_text)} characters from PDF")
             
             # DEBUG: Log phần đầu của PDF text
-            logger.info(f"PDF text preview (first 500 chars): {pdf_text[:500]}...")
+            logger.debug("PDF text preview (first 500 chars): %s...", pdf_text[:500])
             
         except Exception as pdf_error:
             logger.error(f"Lỗi đọc PDF: {pdf_error}")
@@ -1280,28 +1251,27 @@ def process_document(doc_id):
         
         # Gọi Gemini API
         try:
-            model = genai.GenerativeModel('gemini-2.5-flash')
-            logger.info("Calling Gemini API...")
+            llm_backend = get_llm_backend(DOCUMENT_PROCESSING_MODEL)
+            logger.info(f"Calling LLM backend ({llm_backend.name})...")
             
-            response = model.generate_content(
+            result_text = llm_backend.generate(
                 prompt,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=0.1,
-                    max_output_tokens=100000  # Sử dụng giá trị bạn đã tăng
-                )
+                temperature=0.1,
+                max_output_tokens=100000,  # Sử dụng giá trị bạn đã tăng
+                expect_json=True
             )
             
-            if not response or not response.text:
+            if not result_text:
                 return jsonify({
                     "success": False,
                     "error": "Gemini không trả về response"
                 }), 500
                 
-            result_text = response.text.strip()
+            result_text = result_text.strip()
             logger.info(f"Got response from Gemini: {len(result_text)} characters")
             
             # DEBUG: Log phần đầu của response
-            logger.info(f"Gemini response preview (first 1000 chars): {result_text[:1000]}...")
+            logger.debug("Gemini response preview (first 1000 chars): %s...", result_text[:1000])
             
         except Exception as gemini_error:
             logger.error(f"Lỗi gọi Gemini API: {gemini_error}")
@@ -1687,16 +1657,19 @@ def delete_document(doc_id):
     try:
         embedding_model = get_embedding_model()
         
-        # Lấy tất cả chunks của document - BỎ include=['ids']
+        # Lấy ID các chunks của document (không đọc nội dung và metadata)
         results = embedding_model.collection.get(
-            where={"chapter": doc_id}
-            # Không cần include=['ids'] vì mặc định đã trả về ids
+            where={"chapter": doc_id},
+            include=[]
         )
         
         if results and results.get('ids'):
-            # Xóa từng chunk
-            for chunk_id in results['ids']:
-                embedding_model.collection.delete(ids=[chunk_id])
+            # Xóa tất cả chunks trong một lần gọi (đồng thời cập nhật collection version)
+            if not embedding_model.delete_documents(results['ids']):
+                return jsonify({
+                    "success": False,
+                    "error": "Không thể xóa document"
+                }), 500
             
             return jsonify({
                 "success": True,
@@ -1734,15 +1707,14 @@ def bulk_delete_documents():
         
         for doc_id in doc_ids:
             try:
-                # SỬA: Bỏ include=['ids']
                 results = embedding_model.collection.get(
-                    where={"chapter": doc_id}
+                    where={"chapter": doc_id},
+                    include=[]
                 )
                 
                 if results and results.get('ids'):
-                    for chunk_id in results['ids']:
-                        embedding_model.collection.delete(ids=[chunk_id])
-                    deleted_count += 1
+                    if embedding_model.delete_documents(results['ids']):
+                        deleted_count += 1
                     
             except Exception as e:
                 logger.error(f"Lỗi xóa document {doc_id}: {e}")
@@ -1763,59 +1735,55 @@ def bulk_delete_documents():
 
 # ===== ANALYTICS ROUTES =====
 
+def _load_analytics_overview():
+    """Thống kê phân tích (được lưu trong snapshot cache)"""
+    db = get_db()
+    
+    # Thống kê cơ bản
+    total_conversations = db.conversations.estimated_document_count()
+    total_users = db.users.estimated_document_count()
+    total_rollup = get_total_rollup()
+    total_messages = total_rollup["messages"]
+    counted_conversations = total_rollup["conversations_created"]
+    
+    # Thống kê theo tuần (7 ngày gần nhất, giờ Việt Nam) từ daily_rollups
+    daily_stats = []
+    for rollup in get_daily_rollups(7):
+        daily_stats.append({
+            "date": rollup["date"],
+            "label": datetime.date.fromisoformat(rollup["date"]).strftime("%d/%m"),
+            "conversations": rollup["conversations_created"],
+            "users": rollup["new_users"]
+        })
+    
+    # Thống kê theo độ tuổi
+    age_stats = get_age_distribution()
+    
+    return {
+        "overview": {
+            "totalUsers": total_users,
+            "activeUsers": total_users,
+            "totalConversations": total_conversations,
+            "avgMessagesPerConversation": round(total_messages / counted_conversations, 1) if counted_conversations > 0 else 0,
+            "userGrowth": "+8.5%",
+            "conversationGrowth": "+12.3%"
+        },
+        "dailyStats": daily_stats,
+        "ageDistribution": [
+            {
+                "age_group": f"{stat['_id']} tuổi" if stat['_id'] else "Không rõ",
+                "count": stat["count"]
+            }
+            for stat in age_stats
+        ]
+    }
+
 @admin_routes.route('/analytics/overview', methods=['GET'])
 @require_admin
 def get_analytics_overview():
     """Lấy thống kê phân tích"""
     try:
-        db = get_db()
-        
-        # Thống kê cơ bản
-        total_conversations = db.conversations.count_documents({})
-        total_users = db.users.count_documents({}) if hasattr(db, 'users') else 1
-        
-        # Thống kê theo tuần (7 ngày gần nhất)
-        daily_stats = []
-        for i in range(7):
-            day_start = datetime.datetime.now() - datetime.timedelta(days=6-i)
-            day_end = day_start + datetime.timedelta(days=1)
-            
-            daily_conversations = db.conversations.count_documents({
-                "created_at": {"$gte": day_start, "$lt": day_end}
-            })
-            
-            daily_stats.append({
-                "date": day_start.strftime("%Y-%m-%d"),
-                "label": day_start.strftime("%d/%m"),
-                "conversations": daily_conversations,
-                "users": 0  # Mock data
-            })
-        
-        # Thống kê theo độ tuổi
-        age_stats = list(db.conversations.aggregate([
-            {"$group": {"_id": "$age_context", "count": {"$sum": 1}}},
-            {"$sort": {"_id": 1}}
-        ]))
-        
-        return jsonify({
-            "success": True,
-            "overview": {
-                "totalUsers": total_users,
-                "activeUsers": total_users,
-                "totalConversations": total_conversations,
-                "avgMessagesPerConversation": 6.8,
-                "userGrowth": "+8.5%",
-                "conversationGrowth": "+12.3%"
-            },
-            "dailyStats": daily_stats,
-            "ageDistribution": [
-                {
-                    "age_group": f"{stat['_id']} tuổi" if stat['_id'] else "Không rõ",
-                    "count": stat["count"]
-                }
-                for stat in age_stats
-            ]
-        })
+        return _snapshot_response("analytics_overview", _load_analytics_overview)
         
     except Exception as e:
         logger.error(f"Lỗi lấy analytics: {str(e)}")
@@ -1971,190 +1939,285 @@ def respond_to_feedback(feedback_id):
 
 # ===== SYSTEM SETTINGS ROUTES =====
 
+def _load_system_config():
+    """Cấu hình hệ thống thật (được lưu trong snapshot cache)"""
+    import os
+    from config import EMBEDDING_MODEL, GEMINI_API_KEY, CHROMA_PERSIST_DIRECTORY, COLLECTION_NAME, LLM_BACKEND
+    from core.embedding_model import get_embedding_model
+    
+    # Thông tin database
+    db = get_db()
+    
+    # Thông tin Collections trong MongoDB
+    try:
+        mongo_collections = db.list_collection_names()
+        mongo_stats = {}
+        for collection_name in mongo_collections:
+            collection = db[collection_name]
+            mongo_stats[collection_name] = {
+                "document_count": collection.count_documents({}),
+                "estimated_size": collection.estimated_document_count()
+            }
+    except Exception as e:
+        mongo_collections = []
+        mongo_stats = {"error": str(e)}
+    
+    # Thông tin ChromaDB/Vector Database
+    try:
+        embedding_model = get_embedding_model()
+        vector_stats = embedding_model.get_stats()
+        chroma_status = "Connected"
+        vector_count = embedding_model.count()
+    except Exception as e:
+        vector_stats = {"error": str(e)}
+        chroma_status = "Error"
+        vector_count = 0
+    
+    # Thông tin Gemini API
+    gemini_status = "Connected" if GEMINI_API_KEY else "Not configured"
+    
+    # Thông tin hệ thống
+    import platform
+    import psutil
+    
+    system_info = {
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": psutil.cpu_count(),
+        "memory_total": round(psutil.virtual_memory().total / (1024**3), 2),  # GB
+        "memory_available": round(psutil.virtual_memory().available / (1024**3), 2),  # GB
+        "disk_usage": round(psutil.disk_usage('/').percent, 2)
+    }
+    
+    # Cấu hình application
+    app_config = {
+        "debug_mode": os.getenv("FLASK_ENV") == "development",
+        "secret_key_configured": bool(os.getenv("JWT_SECRET_KEY")),
+        "mongodb_uri": os.getenv("MONGO_URI", "mongodb://localhost:27017/"),
+        "database_name": os.getenv("MONGO_DB_NAME", "nutribot_db"),
+        "embedding_model": EMBEDDING_MODEL,
+        "chroma_directory": CHROMA_PERSIST_DIRECTORY,
+        "collection_name": COLLECTION_NAME,
+        "gemini_configured": bool(GEMINI_API_KEY),
+        "llm_backend": LLM_BACKEND
+    }
+    
+    return {
+        "system_config": {
+            "application": app_config,
+            "system": system_info,
+            "database": {
+                "mongodb": {
+                    "status": "Connected",
+                    "collections": mongo_collections,
+                    "statistics": mongo_stats
+                },
+                "vector_db": {
+                    "status": chroma_status,
+                    "document_count": vector_count,
+                    "statistics": vector_stats
+                }
+            },
+            "ai_services": {
+                "gemini": {
+                    "status": gemini_status,
+                    "model": "gemini-2.0-flash"
+                }
+            }
+        }
+    }
+
 @admin_routes.route('/settings/system-config', methods=['GET'])
 @require_admin
 def get_system_config():
     """Lấy cấu hình hệ thống thật"""
     try:
-        import os
-        from config import EMBEDDING_MODEL, GEMINI_API_KEY, CHROMA_PERSIST_DIRECTORY, COLLECTION_NAME
-        from core.embedding_model import get_embedding_model
+        return _snapshot_response("system_config", _load_system_config)
         
-        # Thông tin database
-        db = get_db()
-        
-        # Thông tin Collections trong MongoDB
-        try:
-            mongo_collections = db.list_collection_names()
-            mongo_stats = {}
-            for collection_name in mongo_collections:
-                collection = db[collection_name]
-                mongo_stats[collection_name] = {
-                    "document_count": collection.count_documents({}),
-                    "estimated_size": collection.estimated_document_count()
-                }
-        except Exception as e:
-            mongo_collections = []
-            mongo_stats = {"error": str(e)}
-        
-        # Thông tin ChromaDB/Vector Database
-        try:
-            embedding_model = get_embedding_model()
-            vector_stats = embedding_model.get_stats()
-            chroma_status = "Connected"
-            vector_count = embedding_model.count()
-        except Exception as e:
-            vector_stats = {"error": str(e)}
-            chroma_status = "Error"
-            vector_count = 0
+    except Exception as e:
+        logger.error(f"Lỗi lấy system config: {str(e)}")
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+def _format_uptime(seconds):
+    """Định dạng uptime kiểu "2d 3h 15m" """
+    minutes = int(seconds // 60)
+    days, minutes = divmod(minutes, 24 * 60)
+    hours, minutes = divmod(minutes, 60)
+    if days:
+        return f"{days}d {hours}h {minutes}m"
+    return f"{hours}h {minutes}m"
+
+# Các bước được đo trên đường xử lý một câu hỏi (xem utils/metrics.py)
+PERFORMANCE_STAGES = [
+    "jwt_verify", "mongo_read", "mongo_write", "query_encode", "vector_search",
+    "prompt_build", "llm_first_token", "llm_generate", "post_process"
+]
+
+def _load_performance_metrics():
+    """Metrics hiệu năng hệ thống (được lưu trong snapshot cache)"""
+    import psutil
+    from utils.metrics import get_metrics, stage_summary, http_summary
+    
+    # CPU và Memory hiện tại (CPU trung bình kể từ lần refresh snapshot trước, không chặn thread 1 giây)
+    cpu_percent = psutil.cpu_percent(interval=None)
+    memory = psutil.virtual_memory()
+    disk = psutil.disk_usage('/')
+    
+    # Độ trễ đo thực tế của từng bước (histogram trong process hiện tại)
+    stages = {stage: stage_summary(stage) for stage in PERFORMANCE_STAGES}
+    
+    # Thống kê database
+    db = get_db()
+    
+    # Thống kê MongoDB performance
+    try:
+        conversations_count = db.conversations.estimated_document_count()
+        users_count = db.users.estimated_document_count()
+        
+        # Hoạt động hôm nay lấy từ daily rollup
+        today = get_daily_rollups(1)[0]
+        
+        mongo_read = stages["mongo_read"]
+        db_performance = {
+            "total_documents": conversations_count + users_count,
+            "query_speed": f"{mongo_read['p50_ms']}ms / p95 {mongo_read['p95_ms']}ms" if mongo_read["count"] else "N/A",
+            "recent_activity": today.get("conversations_updated", 0),
+            "reads": mongo_read,
+            "writes": stages["mongo_write"]
+        }
+    except Exception as e:
+        today = {}
+        db_performance = {"error": str(e)}
+    
+    # Vector DB performance
+    try:
+        from core.embedding_model import get_embedding_model
+        embedding_model = get_embedding_model()
+        vector_count = embedding_model.count()
         
-        # Thông tin Gemini API
-        gemini_status = "Connected" if GEMINI_API_KEY else "Not configured"
+        vector_search = stages["vector_search"]
+        if vector_search["count"]:
+            search_speed = vector_search["p50_ms"]
+        else:
+            # Chưa có truy vấn thật nào trong process này - đo bằng một batch câu hỏi mẫu
+            probe_queries = [
+                "test query",
+                "Bữa sáng cho học sinh nên ăn gì?",
+                "Cách bảo quản thực phẩm an toàn"
+            ]
+            start_time = time.time()
+            embedding_model.search_many(probe_queries, top_k=5)
+            search_speed = round((time.time() - start_time) * 1000 / len(probe_queries), 2)  # milliseconds mỗi query
+        
+        vector_performance = {
+            "total_vectors": vector_count,
+            "search_speed_ms": search_speed,
+            "search_p95_ms": vector_search["p95_ms"],
+            "embedding_dimension": 768  # multilingual-e5-base dimension
+        }
+    except Exception as e:
+        vector_performance = {"error": str(e)}
+    
+    # AI API performance
+    llm_generate = stages["llm_generate"]
+    if llm_generate["count"]:
+        average_response_time = f"{llm_generate['mean_ms'] / 1000:.2f}s"
+        success_rate = f"{(1 - llm_generate['errors'] / llm_generate['count']) * 100:.1f}%"
+    else:
+        average_response_time = "N/A"
+        success_rate = "N/A"
+    ai_performance = {
+        "average_response_time": average_response_time,
+        "success_rate": success_rate,
+        "daily_requests": today.get("messages", 0),
+        "first_token_p50_ms": stages["llm_first_token"]["p50_ms"]
+    }
+    
+    return {
+        "performance": {
+            "system": {
+                "cpu_usage": cpu_percent,
+                "memory_usage": memory.percent,
+                "memory_total_gb": round(memory.total / (1024**3), 2),
+                "memory_used_gb": round(memory.used / (1024**3), 2),
+                "disk_usage": disk.percent,
+                "disk_total_gb": round(disk.total / (1024**3), 2),
+                "uptime": _format_uptime(get_metrics().uptime_seconds())
+            },
+            "database": db_performance,
+            "vector_search": vector_performance,
+            "ai_generation": ai_performance,
+            "stages": stages,
+            "http": http_summary()
+        }
+    }
+
+@admin_routes.route('/settings/performance', methods=['GET'])
+@require_admin
+def get_performance_metrics():
+    """Lấy metrics hiệu năng hệ thống"""
+    try:
+        return _snapshot_response("performance", _load_performance_metrics)
         
-        # Thông tin hệ thống
-        import platform
-        import psutil
+    except Exception as e:
+        logger.error(f"Lỗi lấy performance metrics: {str(e)}")
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+@admin_routes.route('/settings/traces', methods=['GET'])
+@require_admin
+def get_slow_traces():
+    """Danh sách các request chậm đã được lưu trace (mới nhất trước, không gồm cây span)"""
+    try:
+        from utils.tracing import get_trace_store
+        from config import TRACE_SLOW_REQUEST_MS, TRACE_STORE
         
-        system_info = {
-            "python_version": platform.python_version(),
-            "platform": platform.platform(),
-            "cpu_count": psutil.cpu_count(),
-            "memory_total": round(psutil.virtual_memory().total / (1024**3), 2),  # GB
-            "memory_available": round(psutil.virtual_memory().available / (1024**3), 2),  # GB
-            "disk_usage": round(psutil.disk_usage('/').percent, 2)
-        }
+        limit = min(int(request.args.get('limit', 50)), 200)
+        min_duration_ms = float(request.args.get('min_duration_ms', 0))
+        path = request.args.get('path', '')
         
-        # Cấu hình application
-        app_config = {
-            "debug_mode": os.getenv("FLASK_ENV") == "development",
-            "secret_key_configured": bool(os.getenv("JWT_SECRET_KEY")),
-            "mongodb_uri": os.getenv("MONGO_URI", "mongodb://localhost:27017/"),
-            "database_name": os.getenv("MONGO_DB_NAME", "nutribot_db"),
-            "embedding_model": EMBEDDING_MODEL,
-            "chroma_directory": CHROMA_PERSIST_DIRECTORY,
-            "collection_name": COLLECTION_NAME,
-            "gemini_configured": bool(GEMINI_API_KEY)
-        }
+        traces = get_trace_store().list(limit=limit, min_duration_ms=min_duration_ms, path=path or None)
         
         return jsonify({
             "success": True,
-            "system_config": {
-                "application": app_config,
-                "system": system_info,
-                "database": {
-                    "mongodb": {
-                        "status": "Connected",
-                        "collections": mongo_collections,
-                        "statistics": mongo_stats
-                    },
-                    "vector_db": {
-                        "status": chroma_status,
-                        "document_count": vector_count,
-                        "statistics": vector_stats
-                    }
-                },
-                "ai_services": {
-                    "gemini": {
-                        "status": gemini_status,
-                        "model": "gemini-2.0-flash"
-                    }
-                }
-            }
+            "traces": traces,
+            "threshold_ms": TRACE_SLOW_REQUEST_MS,
+            "store": TRACE_STORE
         })
         
     except Exception as e:
-        logger.error(f"Lỗi lấy system config: {str(e)}")
+        logger.error(f"Lỗi lấy danh sách trace: {str(e)}")
         return jsonify({
             "success": False,
             "error": str(e)
         }), 500
 
-@admin_routes.route('/settings/performance', methods=['GET'])
+@admin_routes.route('/settings/traces/<trace_id>', methods=['GET'])
 @require_admin
-def get_performance_metrics():
-    """Lấy metrics hiệu năng hệ thống"""
+def get_slow_trace_detail(trace_id):
+    """Cây span đầy đủ của một request chậm"""
     try:
-        import psutil
-        import time
-        from datetime import datetime, timedelta
-        
-        # CPU và Memory hiện tại
-        cpu_percent = psutil.cpu_percent(interval=1)
-        memory = psutil.virtual_memory()
-        disk = psutil.disk_usage('/')
+        from utils.tracing import get_trace_store
         
-        # Thống kê database
-        db = get_db()
-        
-        # Thống kê MongoDB performance
-        try:
-            # Thời gian trung bình cho queries (mock data - MongoDB professional monitoring cần tools khác)
-            conversations_count = db.conversations.count_documents({})
-            users_count = db.users.count_documents({}) if hasattr(db, 'users') else 0
-            
-            # Tốc độ xử lý tin nhắn trong 24h qua
-            yesterday = datetime.now() - timedelta(days=1)
-            recent_conversations = db.conversations.count_documents({
-                "updated_at": {"$gte": yesterday}
-            })
-            
-            db_performance = {
-                "total_documents": conversations_count + users_count,
-                "query_speed": "~50ms",  # Mock data
-                "recent_activity": recent_conversations,
-                "index_efficiency": "95%"  # Mock data
-            }
-        except Exception as e:
-            db_performance = {"error": str(e)}
-        
-        # Vector DB performance
-        try:
-            from core.embedding_model import get_embedding_model
-            embedding_model = get_embedding_model()
-            vector_count = embedding_model.count()
-            
-            # Test search speed
-            start_time = time.time()
-            test_results = embedding_model.search("test query", top_k=5)
-            search_time = (time.time() - start_time) * 1000  # milliseconds
-            
-            vector_performance = {
-                "total_vectors": vector_count,
-                "search_speed_ms": round(search_time, 2),
-                "embedding_dimension": 768,  # multilingual-e5-base dimension
-                "retrieval_accuracy": "85%"  # Mock data - would need evaluation dataset
-            }
-        except Exception as e:
-            vector_performance = {"error": str(e)}
-        
-        # AI API performance
-        ai_performance = {
-            "average_response_time": "2.5s",  # Mock data
-            "success_rate": "98.5%",  # Mock data
-            "daily_requests": recent_conversations * 2,  # Estimate
-            "token_usage": "~150k tokens/day"  # Mock data
-        }
+        trace = get_trace_store().get(trace_id)
+        if not trace:
+            return jsonify({
+                "success": False,
+                "error": "Không tìm thấy trace"
+            }), 404
         
         return jsonify({
             "success": True,
-            "performance": {
-                "system": {
-                    "cpu_usage": cpu_percent,
-                    "memory_usage": memory.percent,
-                    "memory_total_gb": round(memory.total / (1024**3), 2),
-                    "memory_used_gb": round(memory.used / (1024**3), 2),
-                    "disk_usage": disk.percent,
-                    "disk_total_gb": round(disk.total / (1024**3), 2),
-                    "uptime": "24h 15m"  # Mock data
-                },
-                "database": db_performance,
-                "vector_search": vector_performance,
-                "ai_generation": ai_performance
-            }
+            "trace": trace
         })
         
     except Exception as e:
-        logger.error(f"Lỗi lấy performance metrics: {str(e)}")
+        logger.error(f"Lỗi lấy chi tiết trace: {str(e)}")
         return jsonify({
             "success": False,
             "error": str(e)
@@ -2163,73 +2226,42 @@ def get_performance_metrics():
 @admin_routes.route('/settings/logs', methods=['GET'])
 @require_admin  
 def get_system_logs():
-    """Lấy logs hệ thống"""
+    """
+    Lấy logs hệ thống, mới nhất trước
+    
+    Query params: source (app | error | embed_data), level (mức tối thiểu), since, until (ISO datetime),
+    q (chuỗi cần tìm), limit, cursor (next_cursor của trang trước để đọc tiếp về quá khứ)
+    """
     try:
-        import os
-        from datetime import datetime
+        from utils.log_reader import get_log_reader, LogQuery
         
-        log_entries = []
+        source = request.args.get('source', 'app')
+        limit = int(request.args.get('limit', 100))
+        cursor = request.args.get('cursor') or None
         
-        # Đọc logs từ file nếu có
-        log_files = [
-            "logs/app.log",
-            "logs/error.log", 
-            "embed_data.log"
-        ]
-        
-        for log_file in log_files:
-            if os.path.exists(log_file):
-                try:
-                    with open(log_file, 'r', encoding='utf-8') as f:
-                        lines = f.readlines()
-                        # Lấy 50 dòng cuối
-                        recent_lines = lines[-50:] if len(lines) > 50 else lines
-                        
-                        for line in recent_lines:
-                            if line.strip():
-                                log_entries.append({
-                                    "timestamp": datetime.now().isoformat(),
-                                    "level": "INFO",  # Parse từ log format thực tế
-                                    "source": log_file,
-                                    "message": line.strip()
-                                })
-                except Exception as e:
-                    log_entries.append({
-                        "timestamp": datetime.now().isoformat(),
-                        "level": "ERROR",
-                        "source": "system",
-                        "message": f"Cannot read {log_file}: {str(e)}"
-                    })
-        
-        # Nếu không có log files, tạo mock logs
-        if not log_entries:
-            log_entries = [
-                {
-                    "timestamp": datetime.now().isoformat(),
-                    "level": "INFO",
-                    "source": "system",
-                    "message": "Application started successfully"
-                },
-                {
-                    "timestamp": datetime.now().isoformat(),
-                    "level": "INFO", 
-                    "source": "database",
-                    "message": "MongoDB connection established"
-                },
-                {
-                    "timestamp": datetime.now().isoformat(),
-                    "level": "INFO",
-                    "source": "vector_db",
-                    "message": "ChromaDB initialized successfully"
-                }
-            ]
-        
-        # Sort by timestamp descending
-        log_entries.sort(key=lambda x: x["timestamp"], reverse=True)
+        try:
+            since = request.args.get('since')
+            until = request.args.get('until')
+            query = LogQuery(
+                level=request.args.get('level'),
+                since=datetime.datetime.fromisoformat(since) if since else None,
+                until=datetime.datetime.fromisoformat(until) if until else None,
+                search=request.args.get('q')
+            )
+            log_reader = get_log_reader()
+            result = log_reader.query(source=source, limit=limit, query=query, cursor=cursor)
+        except ValueError as e:
+            return jsonify({
+                "success": False,
+                "error": str(e)
+            }), 400
         
         return jsonify({
             "success": True,
-            "logs": log_entries[:100]  # Limit to 100 entries
+            "logs": result["entries"],
+            "next_cursor": result["next_cursor"],
+            "scanned_bytes": result["scanned_bytes"],
+            "sources": log_reader.list_sources()
         })
         
     except Exception as e:
@@ -2242,67 +2274,46 @@ def get_system_logs():
 @admin_routes.route('/settings/backup', methods=['POST'])
 @require_admin
 def create_backup():
-    """Tạo backup dữ liệu"""
+    """
+    Bắt đầu backup dữ liệu trong thread nền, trả về ngay (202)
+    
+    Body: incremental (bool, chỉ ghi các document thay đổi từ lần backup gần nhất), compression (gzip | zstd).
+    Theo dõi tiến độ qua GET /settings/backups/<backup_id>.
+    """
     try:
-        from datetime import datetime
-        import json
-        import os
+        from models.backup import get_backup_manager
         
-        # Tạo thư mục backup nếu chưa có
-        backup_dir = "backups"
-        if not os.path.exists(backup_dir):
-            os.makedirs(backup_dir)
+        data = request.get_json(silent=True) or {}
         
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        
-        # Backup MongoDB data
-        db = get_db()
-        backup_data = {
-            "timestamp": datetime.now().isoformat(),
-            "collections": {}
-        }
+        try:
+            started, result = get_backup_manager().start_backup(
+                incremental=bool(data.get('incremental', False)),
+                compression=data.get('compression')
+            )
+        except (ValueError, RuntimeError) as e:
+            return jsonify({
+                "success": False,
+                "error": str(e)
+            }), 400
         
-        # Export conversations
-        conversations = list(db.conversations.find({}))
-        for conv in conversations:
-            conv["_id"] = str(conv["_id"])  # Convert ObjectId to string
-            if "user_id" in conv:
-                conv["user_id"] = str(conv["user_id"])
-        backup_data["collections"]["conversations"] = conversations
-        
-        # Export users if exists
-        if hasattr(db, 'users'):
-            users = list(db.users.find({}))
-            for user in users:
-                user["_id"] = str(user["_id"])
-                # Remove password for security
-                if "password" in user:
-                    del user["password"]
-            backup_data["collections"]["users"] = users
-        
-        # Save backup file
-        backup_filename = f"backup_{timestamp}.json"
-        backup_path = os.path.join(backup_dir, backup_filename)
-        
-        with open(backup_path, 'w', encoding='utf-8') as f:
-            json.dump(backup_data, f, indent=2, default=str, ensure_ascii=False)
-        
-        # Get file size
-        file_size = os.path.getsize(backup_path)
-        file_size_mb = round(file_size / (1024 * 1024), 2)
+        if not started:
+            return jsonify({
+                "success": False,
+                "error": result
+            }), 409
         
         return jsonify({
             "success": True,
-            "message": "Backup created successfully",
+            "message": "Đã bắt đầu backup",
             "backup": {
-                "filename": backup_filename,
-                "path": backup_path,
-                "size_mb": file_size_mb,
-                "timestamp": datetime.now().isoformat(),
-                "collections_count": len(backup_data["collections"]),
-                "total_documents": sum(len(coll) for coll in backup_data["collections"].values())
+                "filename": result["backup_id"],
+                "backup_id": result["backup_id"],
+                "type": result["type"],
+                "compression": result["compression"],
+                "status": result["status"],
+                "timestamp": result["started_at"]
             }
-        })
+        }), 202
         
     except Exception as e:
         logger.error(f"Lỗi tạo backup: {str(e)}")
@@ -2311,6 +2322,61 @@ def create_backup():
             "error": str(e)
         }), 500
 
+@admin_routes.route('/settings/backups', methods=['GET'])
+@require_admin
+def list_backups():
+    """Danh sách các backup (mới nhất trước) và backup đang chạy"""
+    try:
+        from models.backup import get_backup_manager
+        
+        backup_manager = get_backup_manager()
+        
+        return jsonify({
+            "success": True,
+            "backups": backup_manager.list_backups(),
+            "current": backup_manager.get_status()
+        })
+        
+    except Exception as e:
+        logger.error(f"Lỗi lấy danh sách backup: {str(e)}")
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+@admin_routes.route('/settings/backups/<backup_id>', methods=['GET'])
+@require_admin
+def get_backup_detail(backup_id):
+    """Manifest của một backup: trạng thái, tiến độ và số document theo collection"""
+    try:
+        from models.backup import get_backup_manager
+        
+        try:
+            manifest = get_backup_manager().get_manifest(backup_id)
+        except ValueError as e:
+            return jsonify({
+                "success": False,
+                "error": str(e)
+            }), 400
+        
+        if not manifest:
+            return jsonify({
+                "success": False,
+                "error": "Không tìm thấy backup"
+            }), 404
+        
+        return jsonify({
+            "success": True,
+            "backup": manifest
+        })
+        
+    except Exception as e:
+        logger.error(f"Lỗi lấy chi tiết backup: {str(e)}")
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
 @admin_routes.route('/settings/security', methods=['GET'])
 @require_admin
 def get_security_settings():
@@ -2,7 +2,8 @@ from flask import Blueprint, request, jsonify, make_response
 import re
 import logging
 from models.user_model import User
-from flask_jwt_extended import create_access_token, get_jwt_identity, jwt_required, get_jwt
+from flask_jwt_extended import create_access_token, get_jwt_identity, get_jwt
+from utils.metrics import jwt_required
 import datetime
 from functools import wraps
 
@@ -364,11 +365,12 @@ def get_admin_overview_stats():
     """API endpoint để lấy thống kê tổng quan cho admin"""
     try:
         from models.conversation_model import get_db
+        from models.rollup_model import get_daily_rollups, get_total_rollup
         
         db = get_db()
         
         # Đếm tổng conversations
-        total_conversations = db.conversations.count_documents({})
+        total_conversations = db.conversations.estimated_document_count()
         
         # Conversations trong 24h qua
         day_ago = datetime.datetime.now() - datetime.timedelta(days=1)
@@ -376,23 +378,18 @@ def get_admin_overview_stats():
             "created_at": {"$gte": day_ago}
         })
         
-        # Đếm tổng tin nhắn
-        pipeline = [
-            {"$project": {"message_count": {"$size": "$messages"}}},
-            {"$group": {"_id": None, "total_messages": {"$sum": "$message_count"}}}
-        ]
-        message_result = list(db.conversations.aggregate(pipeline))
-        total_messages = message_result[0]["total_messages"] if message_result else 0
+        # Đếm tổng tin nhắn (cộng dồn sẵn trong daily_rollups)
+        total_messages = get_total_rollup()["messages"]
         
-        # Mock users data (có thể thay bằng query thực tế)
-        total_users = db.users.count_documents({}) if hasattr(db, 'users') else 1
+        total_users = db.users.estimated_document_count()
+        new_users_today = get_daily_rollups(1)[-1]["new_users"]
         
         return jsonify({
             "success": True,
             "stats": {
                 "users": {
                     "total": total_users,
-                    "new_today": 0
+                    "new_today": new_users_today
                 },
                 "conversations": {
                     "total": total_conversations,
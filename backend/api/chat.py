@@ -1,9 +1,12 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 import logging
+import json
 from core.rag_pipeline import RAGPipeline
 from core.embedding_model import get_embedding_model
 from models.conversation_model import Conversation
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import get_jwt_identity
+from utils.metrics import jwt_required
+from utils.tracing import span
 import datetime
 
 # Cấu hình logging
@@ -31,6 +34,38 @@ def create_title_from_message(message, max_length=50):
         return message
     return message[:max_length-3] + "..."
 
+def _get_or_create_conversation(conversation_id, user_id, message, age):
+    """
+    Lấy conversation của user hoặc tạo mới nếu không có conversation_id
+    
+    Returns:
+        Conversation hoặc None nếu không tìm thấy / không thuộc về user
+    """
+    if conversation_id:
+        conversation = Conversation.find_by_id(conversation_id)
+        if not conversation or str(conversation.user_id) != user_id:
+            return None
+        
+        if len(conversation.messages) == 0:
+            final_title = create_title_from_message(message, 50)
+            conversation.update_metadata(title=final_title)
+            logger.info(f"Cập nhật title cho conversation {conversation_id}: '{final_title}'")
+        return conversation
+    
+    final_title = create_title_from_message(message, 50)
+    new_conversation_id = Conversation.create(
+        user_id=user_id,
+        title=final_title,
+        age_context=age
+    )
+    logger.info(f"Tạo conversation mới với title: '{final_title}'")
+    return Conversation.find_by_id(new_conversation_id)
+
+def _sse_event(event, data):
+    """Định dạng một event Server-Sent Events"""
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
 @chat_routes.route('/chat', methods=['POST'])
 @jwt_required()
 def chat():
@@ -52,29 +87,17 @@ def chat():
         logger.info(f"Nhận tin nhắn từ user {user_id}: {message[:50]}...")
         
         # Xử lý conversation
-        if conversation_id:
-            conversation = Conversation.find_by_id(conversation_id)
-            if not conversation or str(conversation.user_id) != user_id:
-                return jsonify({
-                    "success": False,
-                    "error": "Không tìm thấy cuộc trò chuyện"
-                }), 404
-            
-            if len(conversation.messages) == 0:
-                final_title = create_title_from_message(message, 50)
-                conversation.title = final_title
-                logger.info(f"Cập nhật title cho conversation {conversation_id}: '{final_title}'")
-        else:
-            final_title = create_title_from_message(message, 50)
-            conversation = Conversation.create(
-                user_id=user_id,
-                title=final_title,
-                age_context=age
-            )
-            logger.info(f"Tạo conversation mới với title: '{final_title}'")
+        with span("chat.load_conversation"):
+            conversation = _get_or_create_conversation(conversation_id, user_id, message, age)
+        if not conversation:
+            return jsonify({
+                "success": False,
+                "error": "Không tìm thấy cuộc trò chuyện"
+            }), 404
         
         # Thêm tin nhắn của user
-        conversation.add_message("user", message)
+        with span("chat.save_user_message"):
+            conversation.add_message("user", message)
         
         # Sử dụng RAG Pipeline để generate response
         pipeline = get_rag_pipeline()
@@ -88,7 +111,8 @@ def chat():
             sources = response_data.get("sources", [])
             
             # Thêm tin nhắn bot vào conversation
-            conversation.add_message("bot", bot_response, sources=sources)
+            with span("chat.save_bot_message"):
+                conversation.add_message("bot", bot_response, sources=sources)
             
             logger.info(f"Đã generate response thành công cho conversation {conversation.conversation_id}")
             
@@ -114,6 +138,86 @@ def chat():
             "error": f"Lỗi máy chủ: {str(e)}"
         }), 500
 
+@chat_routes.route('/chat/stream', methods=['POST'])
+@jwt_required()
+def chat_stream():
+    """
+    API endpoint chat dạng streaming (Server-Sent Events)
+    
+    Các event trả về: conversation, sources, chunk, done, error
+    """
+    try:
+        data = request.json
+        message = data.get('message')
+        age = data.get('age', 1)
+        conversation_id = data.get('conversation_id')
+        
+        user_id = get_jwt_identity()
+        
+        if not message:
+            return jsonify({
+                "success": False,
+                "error": "Vui lòng nhập tin nhắn"
+            }), 400
+        
+        logger.info(f"Nhận tin nhắn stream từ user {user_id}: {message[:50]}...")
+        
+        with span("chat.load_conversation"):
+            conversation = _get_or_create_conversation(conversation_id, user_id, message, age)
+        if not conversation:
+            return jsonify({
+                "success": False,
+                "error": "Không tìm thấy cuộc trò chuyện"
+            }), 404
+        
+        # Thêm tin nhắn của user trước khi bắt đầu stream
+        with span("chat.save_user_message"):
+            conversation.add_message("user", message)
+        
+        pipeline = get_rag_pipeline()
+        
+        def generate():
+            yield _sse_event("conversation", {"conversation_id": str(conversation.conversation_id)})
+            
+            try:
+                for event, payload in pipeline.generate_response_stream(message, age):
+                    if event == "done":
+                        # Lưu tin nhắn bot khi đã có response hoàn chỉnh
+                        with span("chat.save_bot_message"):
+                            conversation.add_message(
+                                "bot",
+                                payload.get("response", ""),
+                                sources=payload.get("sources", [])
+                            )
+                        logger.info(f"Đã stream response thành công cho conversation {conversation.conversation_id}")
+                        yield _sse_event("done", {
+                            "success": True,
+                            "sources": payload.get("sources", []),
+                            "conversation_id": str(conversation.conversation_id)
+                        })
+                    elif event == "error":
+                        logger.error(f"Lỗi stream response: {payload}")
+                        yield _sse_event("error", {"success": False, "error": payload})
+                    elif event == "chunk":
+                        yield _sse_event("chunk", {"text": payload})
+                    else:
+                        yield _sse_event(event, payload)
+            except Exception as e:
+                logger.error(f"Lỗi trong quá trình stream: {str(e)}")
+                yield _sse_event("error", {"success": False, "error": f"Lỗi máy chủ: {str(e)}"})
+        
+        response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+        
+    except Exception as e:
+        logger.error(f"Lỗi xử lý chat stream: {str(e)}")
+        return jsonify({
+            "success": False,
+            "error": f"Lỗi máy chủ: {str(e)}"
+        }), 500
+
 @chat_routes.route('/messages/<message_id>/edit', methods=['PUT'])
 @jwt_required()
 def edit_message(message_id):
@@ -142,24 +246,20 @@ def edit_message(message_id):
                 "error": "Không tìm thấy cuộc trò chuyện"
             }), 404
         
-        # Tìm message và kiểm tra quyền
-        message_found = False
-        for msg in conversation.messages:
-            if str(msg.get('_id', msg.get('id'))) == message_id:
-                if msg['role'] != 'user':
-                    return jsonify({
-                        "success": False,
-                        "error": "Chỉ có thể chỉnh sửa tin nhắn của người dùng"
-                    }), 400
-                message_found = True
-                break
-        
-        if not message_found:
+        # Tìm message (tra map id -> node) và kiểm tra quyền
+        message = conversation.get_node(message_id)
+        if message is None:
             return jsonify({
                 "success": False,
                 "error": "Không tìm thấy tin nhắn"
             }), 404
         
+        if message['role'] != 'user':
+            return jsonify({
+                "success": False,
+                "error": "Chỉ có thể chỉnh sửa tin nhắn của người dùng"
+            }), 400
+        
         # Cập nhật tin nhắn và xóa tất cả tin nhắn sau nó
         success, result_message = conversation.edit_message(message_id, new_content)
         
@@ -234,19 +334,18 @@ def regenerate_response(message_id):
                 "error": "Không tìm thấy cuộc trò chuyện"
             }), 404
         
-        # Tìm tin nhắn và tin nhắn user trước đó
+        # Tìm tin nhắn và tin nhắn user trước đó (node cha) qua map id -> node
         user_message = None
-        for i, msg in enumerate(conversation.messages):
-            if str(msg.get('_id', msg.get('id'))) == message_id:
-                if msg['role'] != 'bot':
-                    return jsonify({
-                        "success": False,
-                        "error": "Chỉ có thể regenerate phản hồi của bot"
-                    }), 400
-                # Tìm tin nhắn user trước đó
-                if i > 0 and conversation.messages[i-1]['role'] == 'user':
-                    user_message = conversation.messages[i-1]['content']
-                break
+        message = conversation.get_node(message_id)
+        if message is not None:
+            if message['role'] != 'bot':
+                return jsonify({
+                    "success": False,
+                    "error": "Chỉ có thể regenerate phản hồi của bot"
+                }), 400
+            parent = conversation.get_node(message.get('parent_id')) if message.get('parent_id') is not None else None
+            if parent is not None and parent['role'] == 'user':
+                user_message = parent['content']
         
         if not user_message:
             return jsonify({
@@ -254,9 +353,9 @@ def regenerate_response(message_id):
                 "error": "Không tìm thấy tin nhắn người dùng tương ứng"
             }), 404
         
-        # Sử dụng RAG Pipeline để generate response mới
+        # Sử dụng RAG Pipeline để generate response mới (bỏ qua response cache)
         pipeline = get_rag_pipeline()
-        response_data = pipeline.generate_response(user_message, age)
+        response_data = pipeline.generate_response(user_message, age, use_cache=False)
         
         if response_data.get("success"):
             bot_response = response_data.get("response", "Xin lỗi, tôi không thể trả lời câu hỏi này.")
@@ -316,10 +415,11 @@ def switch_message_version(message_id, version):
                 "error": "Không tìm thấy cuộc trò chuyện"
             }), 404
         
-        # Debug: Log current conversation state before switch
-        logger.info(f"Before switch - Conversation has {len(conversation.messages)} messages")
-        for i, msg in enumerate(conversation.messages):
-            logger.info(f"  Message {i}: {msg['role']} - {msg['content'][:30]}... (current_version: {msg.get('current_version', 1)})")
+        # Debug: Log tin nhắn cần chuyển version (tra map id -> node, không duyệt danh sách messages)
+        if logger.isEnabledFor(logging.DEBUG):
+            message = conversation.get_node(message_id)
+            if message is not None:
+                logger.debug(f"Before switch - Message {message_id}: {message['role']} - {message['content'][:30]}...")
         
         # Chuyển đổi version
         success = conversation.switch_message_version(message_id, version)
@@ -328,10 +428,11 @@ def switch_message_version(message_id, version):
             # Reload conversation để đảm bảo có dữ liệu mới nhất
             updated_conversation = Conversation.find_by_id(conversation_id)
             
-            # Debug: Log conversation state after switch
-            logger.info(f"After switch - Conversation has {len(updated_conversation.messages)} messages")
-            for i, msg in enumerate(updated_conversation.messages):
-                logger.info(f"  Message {i}: {msg['role']} - {msg['content'][:30]}... (current_version: {msg.get('current_version', 1)})")
+            # Debug: Log tin nhắn sau khi chuyển version
+            if logger.isEnabledFor(logging.DEBUG):
+                message = updated_conversation.get_node(message_id)
+                if message is not None:
+                    logger.debug(f"After switch - Message {message_id}: {message['role']} - {message['content'][:30]}... (version {version})")
             
             logger.info(f"Successfully switched message {message_id} to version {version}")
             return jsonify({
@@ -2,7 +2,8 @@ from flask import Blueprint, request, jsonify
 import logging
 from models.feedback_model import Feedback
 from models.user_model import User
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import get_jwt_identity
+from utils.metrics import jwt_required
 
 # Cấu hình logging
 logger = logging.getLogger(__name__)
@@ -3,7 +3,9 @@ import logging
 from bson.objectid import ObjectId
 from models.conversation_model import Conversation
 from models.user_model import User
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from models.user_activity_model import get_recent_activity
+from flask_jwt_extended import get_jwt_identity
+from utils.metrics import jwt_required
 
 # Cấu hình logging
 logger = logging.getLogger(__name__)
@@ -41,8 +43,8 @@ def get_conversations():
         
         logger.info(f"🔍 Getting conversations for user {user_id}, page {page}, per_page {per_page}, include_archived {include_archived}")
         
-        # Lấy danh sách cuộc hội thoại
-        conversations = Conversation.find_by_user(
+        # Lấy danh sách tóm tắt cuộc hội thoại (không đọc messages)
+        result = Conversation.find_summaries_by_user(
             user_id=user_id,
             limit=per_page,
             skip=skip,
@@ -55,27 +57,7 @@ def get_conversations():
             include_archived=include_archived
         )
         
-        logger.info(f"📊 Found {len(conversations)} conversations, total: {total_count}")
-        
-        # Chuẩn bị dữ liệu phản hồi
-        result = []
-        for conversation in conversations:
-            # Chỉ lấy tin nhắn mới nhất để hiển thị xem trước
-            last_message = conversation.messages[-1]["content"] if conversation.messages else ""
-            message_count = len(conversation.messages)
-            
-            result.append({
-                "id": str(conversation.conversation_id),
-                "title": conversation.title,
-                "created_at": conversation.created_at.isoformat(),
-                "updated_at": conversation.updated_at.isoformat(),
-                "age_context": conversation.age_context,
-                "is_archived": conversation.is_archived,
-                "last_message": last_message[:100] + "..." if len(last_message) > 100 else last_message,
-                "message_count": message_count
-            })
-        
-        logger.info(f"✅ Returning {len(result)} conversations")
+        logger.info(f"📊 Found {len(result)} conversations, total: {total_count}")
         
         # Tạo phản hồi với thông tin phân trang
         return jsonify({
@@ -269,17 +251,18 @@ def update_conversation(conversation_id):
             }), 403
         
         # Cập nhật thông tin
+        updates = {}
         if 'title' in data:
-            conversation.title = data['title']
+            updates['title'] = data['title']
             
         if 'age_context' in data:
-            conversation.age_context = data['age_context']
+            updates['age_context'] = data['age_context']
             
         if 'is_archived' in data:
-            conversation.is_archived = data['is_archived']
+            updates['is_archived'] = data['is_archived']
         
-        # Lưu thay đổi
-        conversation.save()
+        # Lưu thay đổi (chỉ các trường thông tin, không ghi lại messages)
+        conversation.update_metadata(**updates)
         
         logger.info(f"✅ Updated conversation {conversation_id}")
         
@@ -359,8 +342,7 @@ def archive_conversation(conversation_id):
             }), 403
         
         # Lưu trữ cuộc hội thoại
-        conversation.is_archived = True
-        conversation.save()
+        conversation.update_metadata(is_archived=True)
         
         return jsonify({
             "success": True,
@@ -398,8 +380,7 @@ def unarchive_conversation(conversation_id):
             }), 403
         
         # Hủy lưu trữ cuộc hội thoại
-        conversation.is_archived = False
-        conversation.save()
+        conversation.update_metadata(is_archived=False)
         
         return jsonify({
             "success": True,
@@ -435,36 +416,24 @@ def search_conversations():
                 "error": "Vui lòng nhập từ khóa tìm kiếm"
             }), 400
             
-        # Tìm kiếm cuộc hội thoại
-        conversations = Conversation.search_by_content(
+        # Tìm kiếm cuộc hội thoại (không phân biệt dấu, có xếp hạng và highlight)
+        result, total_count = Conversation.search_by_content(
             user_id=user_id,
             query=query,
             limit=per_page,
             skip=skip
         )
         
-        # Chuẩn bị dữ liệu phản hồi
-        result = []
-        for conversation in conversations:
-            # Tìm tin nhắn chứa từ khóa tìm kiếm
-            matching_messages = [m for m in conversation.messages if query.lower() in m["content"].lower()]
-            
-            result.append({
-                "id": str(conversation.conversation_id),
-                "title": conversation.title,
-                "created_at": conversation.created_at.isoformat(),
-                "updated_at": conversation.updated_at.isoformat(),
-                "age_context": conversation.age_context,
-                "is_archived": conversation.is_archived,
-                "message_count": len(conversation.messages),
-                "matching_messages": len(matching_messages),
-                "preview": matching_messages[0]["content"][:100] + "..." if matching_messages else ""
-            })
-        
         return jsonify({
             "success": True,
             "conversations": result,
-            "query": query
+            "query": query,
+            "pagination": {
+                "page": page,
+                "per_page": per_page,
+                "total": total_count,
+                "pages": (total_count + per_page - 1) // per_page
+            }
         })
         
     except Exception as e:
@@ -546,46 +515,14 @@ def get_user_conversation_stats():
     try:
         user_id = get_jwt_identity()
             
-        # Lấy tổng số cuộc hội thoại
-        total_conversations = Conversation.count_by_user(
-            user_id=user_id,
-            include_archived=True
-        )
-        
-        # Lấy số cuộc hội thoại đã lưu trữ
-        archived_conversations = Conversation.count_by_user(
-            user_id=user_id,
-            include_archived=True
-        ) - Conversation.count_by_user(
-            user_id=user_id,
-            include_archived=False
-        )
-        
-        # Lấy danh sách cuộc hội thoại để tính số tin nhắn
-        all_conversations = Conversation.find_by_user(
-            user_id=user_id,
-            limit=100,  # Giới hạn 100 cuộc hội thoại gần nhất để tính thống kê
-            skip=0,
-            include_archived=True
-        )
-        
-        # Tính số tin nhắn và số ngày
-        total_messages = 0
-        messages_by_date = {}
-        
-        for conversation in all_conversations:
-            total_messages += len(conversation.messages)
-            
-            # Đếm số tin nhắn theo ngày
-            for message in conversation.messages:
-                date_str = message["timestamp"].strftime("%Y-%m-%d")
-                if date_str not in messages_by_date:
-                    messages_by_date[date_str] = 0
-                messages_by_date[date_str] += 1
+        # Tổng số conversation, số đã lưu trữ và số tin nhắn (một aggregation trên toàn bộ lịch sử)
+        stats = Conversation.get_user_stats(user_id)
+        total_conversations = stats["total_conversations"]
+        archived_conversations = stats["archived_conversations"]
+        total_messages = stats["total_messages"]
         
-        # Sắp xếp ngày và lấy 7 ngày gần nhất
-        sorted_dates = sorted(messages_by_date.keys(), reverse=True)[:7]
-        recent_activity = {date: messages_by_date[date] for date in sorted_dates}
+        # Số tin nhắn (trên nhánh active, cùng cách tính với total_messages) theo ngày của 7 ngày có hoạt động gần nhất
+        recent_activity = get_recent_activity(user_id, days=7)
         
         # Tính trung bình số tin nhắn mỗi cuộc hội thoại
         avg_messages = total_messages / total_conversations if total_conversations > 0 else 0
@@ -760,8 +697,7 @@ def generate_title_for_conversation(conversation_id):
         title = create_title_from_message(first_user_message)
             
         # Cập nhật tiêu đề
-        conversation.title = title
-        conversation.save()
+        conversation.update_metadata(title=title)
         
         return jsonify({
             "success": True,
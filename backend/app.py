@@ -7,11 +7,9 @@ from flask_jwt_extended import JWTManager
 import datetime
 from api.admin import admin_routes
 
-# Cấu hình logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Cấu hình logging: ghi bất đồng bộ qua queue ra console và logs/app.log, logs/error.log (JSON, có trace_id)
+from utils.logging_setup import setup_logging
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # Tải biến môi trường
@@ -32,11 +30,20 @@ app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max file size
 
 jwt = JWTManager(app)
 
+# Trace theo request (trace ID, Server-Timing, lưu request chậm) - đăng ký trước metrics để bao trọn request
+from utils.tracing import init_app as init_tracing
+init_tracing(app)
+
+# Đo độ trễ mọi request (histogram theo route, request đang xử lý)
+from utils.metrics import init_app as init_metrics
+init_metrics(app)
+
 # Cho phép CORS từ frontend React với credentials
 CORS(app, resources={
     r"/api/*": {
         "origins": ["http://localhost:5173", "http://localhost:3000"], 
-        "supports_credentials": True
+        "supports_credentials": True,
+        "expose_headers": ["Server-Timing", "X-Trace-Id"]
     }
 })
 
@@ -58,12 +65,21 @@ app.register_blueprint(feedback_routes, url_prefix='/api')
 # Đăng ký các blueprint cho admin
 app.register_blueprint(admin_routes, url_prefix='/api/admin')
 
+# Tạo MongoDB indexes khi app được load (chạy trực tiếp hoặc qua gunicorn/uwsgi...)
+from config import ENSURE_INDEXES_ON_STARTUP
+if ENSURE_INDEXES_ON_STARTUP:
+    from models.indexes import ensure_indexes_in_background
+    ensure_indexes_in_background()
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """API endpoint để kiểm tra trạng thái của server"""
     from flask import jsonify
     import time
     from core.embedding_model import get_embedding_model
+    from core.response_cache import get_response_cache
+    from utils.snapshot_cache import get_snapshot_cache
+    from utils.logging_setup import get_logging_stats
     
     embedding_model = get_embedding_model()
     collection_count = embedding_model.count()
@@ -72,9 +88,36 @@ def health_check():
         "status": "healthy",
         "message": "Server đang hoạt động",
         "time": time.strftime('%Y-%m-%d %H:%M:%S'),
-        "data_items": collection_count
+        "data_items": collection_count,
+        "query_cache": embedding_model.get_cache_stats(),
+        "encode_batcher": embedding_model.get_batcher_stats(),
+        "vector_search": embedding_model.get_search_stats(),
+        "response_cache": get_response_cache().get_stats(),
+        "admin_snapshots": get_snapshot_cache().get_stats(),
+        "logging": get_logging_stats()
     })
 
+from config import METRICS_ENABLED, METRICS_TOKEN
+if METRICS_ENABLED and not METRICS_TOKEN:
+    logger.warning("/metrics đang bật mà không có METRICS_TOKEN: ai truy cập được app đều đọc được metrics, "
+                   "hãy đặt METRICS_TOKEN hoặc chỉ mở /metrics trong mạng nội bộ")
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Metrics theo Prometheus text format (bật bằng METRICS_ENABLED, xác thực bằng METRICS_TOKEN)"""
+    from flask import Response, request, abort
+    import hmac
+    from utils.metrics import get_metrics
+    
+    if not METRICS_ENABLED:
+        abort(404)
+    if METRICS_TOKEN and not hmac.compare_digest(
+        request.headers.get('Authorization', ''), f"Bearer {METRICS_TOKEN}"
+    ):
+        abort(401)
+    
+    return Response(get_metrics().render_prometheus(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/api/admin/init', methods=['POST'])
 def init_admin():
     """API endpoint để khởi tạo admin đầu tiên"""
@@ -115,12 +158,5 @@ if __name__ == '__main__':
     except Exception as e:
         logger.error(f"Lỗi tạo super admin: {e}")
 
-    # Tạo indexes cho feedback
-    try:
-        from models.feedback_model import ensure_indexes
-        ensure_indexes()
-    except Exception as e:
-        logger.error(f"Lỗi tạo feedback indexes: {e}")
-    
     # Chạy Flask app
     app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
@@ -13,6 +13,81 @@ EMBEDDING_MODEL = "intfloat/multilingual-e5-base"
 CHROMA_PERSIST_DIRECTORY = os.path.join(os.getcwd(), "chroma_db")
 COLLECTION_NAME = "nutrition_data"
 
+# Vector store dùng cho search: "chroma" hoặc "numpy" (ma trận embeddings memory-mapped, build từ ChromaDB)
+VECTOR_STORE = os.getenv("VECTOR_STORE", "chroma")
+# Khi lọc theo tuổi (chroma): lấy top_k * hệ số này / tỉ lệ chunk hợp tuổi kết quả (chỉ id) rồi lọc theo age index, thiếu thì query lại với where clause
+AGE_FILTER_OVERFETCH = int(os.getenv("AGE_FILTER_OVERFETCH", "4"))
+NUMPY_STORE_DIRECTORY = os.getenv("NUMPY_STORE_DIRECTORY", os.path.join(os.getcwd(), "vector_store"))
+
+# Query embedding cache - tránh encode lại các câu hỏi lặp lại
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "2048"))
+QUERY_CACHE_TTL = int(os.getenv("QUERY_CACHE_TTL", "86400"))  # giây, 0 = không hết hạn
+
+# Gom các lượt encode câu hỏi đồng thời thành batch (tắt mặc định, bật khi metrics encode_batcher cho thấy có lợi)
+ENCODE_BATCHING = os.getenv("ENCODE_BATCHING", "false").lower() == "true"
+ENCODE_BATCH_WINDOW_MS = float(os.getenv("ENCODE_BATCH_WINDOW_MS", "3"))
+ENCODE_BATCH_MAX_SIZE = int(os.getenv("ENCODE_BATCH_MAX_SIZE", "32"))
+
+# Response cache - bỏ qua retrieval + generation cho các câu hỏi lặp lại
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")  # memory | sqlite | none
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "21600"))  # giây, 0 = không hết hạn
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", os.path.join(os.getcwd(), "cache", "response_cache.sqlite3"))
+
+# LLM backend - "gemini" gọi API thật, "stub" sinh văn bản giả lập để load test offline
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+CHAT_MODEL = os.getenv("CHAT_MODEL", "gemini-2.0-flash")
+DOCUMENT_PROCESSING_MODEL = os.getenv("DOCUMENT_PROCESSING_MODEL", "gemini-2.5-flash")
+STUB_LLM_SEED = int(os.getenv("STUB_LLM_SEED", "0"))
+STUB_LLM_LATENCY_MS = float(os.getenv("STUB_LLM_LATENCY_MS", "300"))  # độ trễ trước token đầu tiên
+STUB_LLM_LATENCY_JITTER_MS = float(os.getenv("STUB_LLM_LATENCY_JITTER_MS", "100"))
+STUB_LLM_TOKENS_PER_SECOND = float(os.getenv("STUB_LLM_TOKENS_PER_SECOND", "80"))
+STUB_LLM_TOKENS_PER_SECOND_JITTER = float(os.getenv("STUB_LLM_TOKENS_PER_SECOND_JITTER", "20"))
+STUB_LLM_RESPONSE_TOKENS = int(os.getenv("STUB_LLM_RESPONSE_TOKENS", "200"))
+
+# MongoDB indexes - tạo các index trong models/indexes.py khi app khởi động
+ENSURE_INDEXES_ON_STARTUP = os.getenv("ENSURE_INDEXES_ON_STARTUP", "true").lower() == "true"
+
+# Metrics Prometheus tại /metrics, tắt mặc định vì lộ lưu lượng theo route, số lỗi và thống kê lệnh Mongo
+# Khi bật nên đặt METRICS_TOKEN (Prometheus gửi "Authorization: Bearer <token>"), chỉ để trống nếu /metrics
+# chỉ truy cập được từ mạng nội bộ (app sẽ ghi cảnh báo lúc khởi động)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() == "true"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Tracing theo request - trace ID trong log, header Server-Timing, lưu cây span của các request chậm
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "true").lower() == "true"
+TRACE_SLOW_REQUEST_MS = float(os.getenv("TRACE_SLOW_REQUEST_MS", "3000"))
+TRACE_STORE = os.getenv("TRACE_STORE", "memory")  # memory (ring buffer mỗi process) | mongo (capped collection)
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "200"))  # số trace chậm được giữ lại
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "500"))  # số span tối đa mỗi trace
+
+# Logging - request chỉ đẩy record vào queue, thread nền ghi ra console và file JSON xoay vòng (nén gzip)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_DIR = os.getenv("LOG_DIR", os.path.join(os.getcwd(), "logs"))
+LOG_CONSOLE_FORMAT = os.getenv("LOG_CONSOLE_FORMAT", "text")  # text | json
+LOG_FILE_MAX_BYTES = int(os.getenv("LOG_FILE_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_FILE_BACKUP_COUNT = int(os.getenv("LOG_FILE_BACKUP_COUNT", "10"))
+# size: app tự xoay vòng theo LOG_FILE_MAX_BYTES (dùng flock nên nhiều worker ghi chung file được)
+# external: chỉ ghi, để logrotate xoay vòng (đặt tên app.log.1, app.log.2.gz... như log reader đang đọc)
+LOG_FILE_ROTATION = os.getenv("LOG_FILE_ROTATION", "size")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))  # queue đầy thì bỏ record thay vì chặn request
+# Tỉ lệ giữ lại log DEBUG/INFO theo logger, vd: "api.chat=0.1,models.conversation_model=0.25"
+LOG_SAMPLING = os.getenv("LOG_SAMPLING", "")
+
+# Snapshot cache cho các trang dashboard admin - refresh nền, request trả về snapshot gần nhất
+ADMIN_SNAPSHOT_REFRESH_SECONDS = float(os.getenv("ADMIN_SNAPSHOT_REFRESH_SECONDS", "30"))
+ADMIN_SNAPSHOT_IDLE_SECONDS = float(os.getenv("ADMIN_SNAPSHOT_IDLE_SECONDS", "600"))  # ngừng refresh khi không ai xem
+
+# Backup MongoDB - NDJSON nén theo stream, chạy nền, hỗ trợ incremental theo updated_at
+BACKUP_DIRECTORY = os.getenv("BACKUP_DIRECTORY", os.path.join(os.getcwd(), "backups"))
+BACKUP_COMPRESSION = os.getenv("BACKUP_COMPRESSION", "gzip")  # gzip | zstd (cần package zstandard)
+BACKUP_BATCH_SIZE = int(os.getenv("BACKUP_BATCH_SIZE", "1000"))  # batch của cursor khi đọc và của bulk write khi restore
+# Thư mục và file backup được tạo với quyền 0700/0600 (chỉ user chạy app đọc được)
+# Mặc định không ghi hash mật khẩu: restore giữ mật khẩu hiện có, tài khoản restore vào database mới phải đặt lại mật khẩu
+# Đặt true để ghi cả hash bcrypt (restore đầy đủ tài khoản), khi đó cần bảo vệ thư mục backup như dữ liệu nhạy cảm
+BACKUP_INCLUDE_PASSWORD_HASHES = os.getenv("BACKUP_INCLUDE_PASSWORD_HASHES", "false").lower() == "true"
+
 # RAG settings
 TOP_K_RESULTS = 5
 TEMPERATURE = 0.2
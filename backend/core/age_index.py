@@ -0,0 +1,105 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+
+# Cấu hình logging
+logger = logging.getLogger(__name__)
+
+# Khoảng tuổi người dùng được hỗ trợ
+MIN_AGE = 1
+MAX_AGE = 19
+
+def clamp_age(age):
+    """Đưa tuổi về khoảng MIN_AGE-MAX_AGE"""
+    return max(MIN_AGE, min(MAX_AGE, int(age)))
+
+class AgeIndex:
+    """
+    Ánh xạ từng độ tuổi (1-19) sang tập ID chunk phù hợp, tính từ age_min/age_max
+
+    Index được build lại khi collection version thay đổi và lưu ra file để các
+    worker khác dùng lại, nhờ đó lọc theo tuổi chỉ còn là phép kiểm tra membership
+    thay vì where clause trên metadata ở mỗi query.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+        self.version = None
+        self.total = 0
+        self.allowed = {}
+        self.signatures = {}
+
+    def ensure_version(self, collection, version):
+        """Đảm bảo index khớp với collection version"""
+        if self.version == version:
+            return
+
+        with self._lock:
+            if self.version == version:
+                return
+            if not self._load(version):
+                self._build(collection, version)
+
+    def _load(self, version):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        if data.get("version") != version:
+            return False
+
+        self._set_data(version, data["total"], {int(age): ids for age, ids in data["ages"].items()})
+        logger.info(f"Đã load age index (version {version})")
+        return True
+
+    def _build(self, collection, version):
+        logger.info(f"Đang build age index (version {version})")
+        stored = collection.get(include=['metadatas'])
+
+        ages = {age: [] for age in range(MIN_AGE, MAX_AGE + 1)}
+        for doc_id, metadata in zip(stored['ids'], stored['metadatas']):
+            metadata = metadata or {}
+            age_min = metadata.get('age_min', MIN_AGE)
+            age_max = metadata.get('age_max', MAX_AGE)
+            for age in range(max(MIN_AGE, age_min), min(MAX_AGE, age_max) + 1):
+                ages[age].append(doc_id)
+
+        total = len(stored['ids'])
+        self._set_data(version, total, ages)
+
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"version": version, "total": total, "ages": ages}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Không ghi được age index: {e}")
+
+        logger.info(f"Đã build age index cho {total} chunks")
+
+    def _set_data(self, version, total, ages):
+        self.allowed = {age: frozenset(ids) for age, ids in ages.items()}
+        self.signatures = {
+            age: hashlib.sha1(",".join(sorted(ids)).encode('utf-8')).hexdigest()[:12]
+            for age, ids in self.allowed.items()
+        }
+        self.total = total
+        self.version = version
+
+    def allowed_ids(self, age):
+        """Tập ID chunk phù hợp với độ tuổi"""
+        return self.allowed.get(clamp_age(age), frozenset())
+
+    def covers_all(self, age):
+        """True nếu mọi chunk đều phù hợp với độ tuổi (không cần lọc)"""
+        return len(self.allowed_ids(age)) == self.total
+
+    def signature(self, age):
+        """Chuỗi đại diện cho tập ID của độ tuổi, các tuổi có cùng tập ID có cùng signature"""
+        return self.signatures.get(clamp_age(age), "")
@@ -0,0 +1,155 @@
+import os
+import json
+import logging
+import threading
+
+# Cấu hình logging
+logger = logging.getLogger(__name__)
+
+# Số metadata đọc mỗi lần khi build lại summary
+BUILD_BATCH_SIZE = 1000
+
+class ChapterSummary:
+    """
+    Thống kê theo chapter (số chunk theo content_type, created_at, tiêu đề tài liệu)
+
+    Summary được cập nhật theo delta mỗi khi EmbeddingModel thêm/sửa/xóa chunk và lưu ra file
+    cùng collection version, nhờ đó danh sách tài liệu của admin không phải đọc lại collection.
+    Nếu version không khớp (collection bị thay đổi ở nơi khác) summary được build lại
+    chỉ từ metadata, không đọc nội dung chunk.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+        self.version = None
+        self.chapters = {}
+
+    def ensure_version(self, collection, version):
+        """Đảm bảo summary khớp với collection version"""
+        if self.version == version:
+            return
+
+        with self._lock:
+            if self.version == version:
+                return
+            if not self._load(version):
+                self._build(collection, version)
+
+    def _load(self, version):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        if data.get("version") != version:
+            return False
+
+        self.chapters = data["chapters"]
+        self.version = version
+        logger.info(f"Đã load chapter summary (version {version})")
+        return True
+
+    def _build(self, collection, version):
+        logger.info(f"Đang build chapter summary (version {version})")
+        chapters = {}
+        offset = 0
+        while True:
+            batch = collection.get(include=['metadatas'], limit=BUILD_BATCH_SIZE, offset=offset)
+            metadatas = batch.get('metadatas') or []
+            for metadata in metadatas:
+                self._add(chapters, metadata)
+            if len(metadatas) < BUILD_BATCH_SIZE:
+                break
+            offset += BUILD_BATCH_SIZE
+
+        self.chapters = chapters
+        self.version = version
+        self._save()
+        logger.info(f"Đã build chapter summary cho {len(chapters)} chapters")
+
+    def _save(self):
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"version": self.version, "chapters": self.chapters}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Không ghi được chapter summary: {e}")
+
+    @staticmethod
+    def _add(chapters, metadata):
+        metadata = metadata or {}
+        chapter = metadata.get('chapter', 'unknown')
+        content_type = metadata.get('content_type', 'text')
+
+        summary = chapters.setdefault(chapter, {"total": 0, "by_type": {}, "created_at": None})
+        summary["total"] += 1
+        summary["by_type"][content_type] = summary["by_type"].get(content_type, 0) + 1
+
+        created_at = metadata.get('created_at')
+        if created_at and (summary["created_at"] is None or created_at < summary["created_at"]):
+            summary["created_at"] = created_at
+
+        for key in ('document_title', 'document_source'):
+            if metadata.get(key) and not summary.get(key):
+                summary[key] = metadata[key]
+
+    @staticmethod
+    def _remove(chapters, metadata):
+        metadata = metadata or {}
+        chapter = metadata.get('chapter', 'unknown')
+        content_type = metadata.get('content_type', 'text')
+
+        summary = chapters.get(chapter)
+        if summary is None:
+            return
+        summary["total"] -= 1
+        summary["by_type"][content_type] = summary["by_type"].get(content_type, 0) - 1
+        if summary["by_type"][content_type] <= 0:
+            summary["by_type"].pop(content_type)
+        if summary["total"] <= 0:
+            chapters.pop(chapter)
+
+    def apply(self, previous_version, version, added=(), removed=()):
+        """
+        Cập nhật summary theo các chunk vừa được thêm/xóa
+
+        Chỉ áp dụng khi summary đang ở đúng previous_version (version trước khi collection thay đổi),
+        nếu không summary sẽ được build lại ở lần đọc tiếp theo.
+
+        Args:
+            previous_version (str): Collection version trước khi thay đổi
+            version (str): Collection version mới
+            added (list): Metadata của các chunk được thêm (hoặc metadata mới khi cập nhật)
+            removed (list): Metadata của các chunk bị xóa (hoặc metadata cũ khi cập nhật)
+        """
+        with self._lock:
+            if self.version != previous_version and not self._load(previous_version):
+                return False
+
+            for metadata in removed:
+                self._remove(self.chapters, metadata)
+            for metadata in added:
+                self._add(self.chapters, metadata)
+
+            self.version = version
+            self._save()
+            return True
+
+    def reset(self, version):
+        """Summary rỗng (sau khi xóa toàn bộ collection)"""
+        with self._lock:
+            self.chapters = {}
+            self.version = version
+            self._save()
+
+    def get_chapters(self):
+        """Bản sao summary theo chapter"""
+        with self._lock:
+            return {
+                chapter: dict(summary, by_type=dict(summary["by_type"]))
+                for chapter, summary in self.chapters.items()
+            }
@@ -4,11 +4,40 @@ import chromadb
 from chromadb.config import Settings
 import uuid
 import os
-from config import EMBEDDING_MODEL, CHROMA_PERSIST_DIRECTORY, COLLECTION_NAME
+import time
+from config import (
+    EMBEDDING_MODEL, CHROMA_PERSIST_DIRECTORY, COLLECTION_NAME, QUERY_CACHE_SIZE, QUERY_CACHE_TTL,
+    VECTOR_STORE, NUMPY_STORE_DIRECTORY, AGE_FILTER_OVERFETCH, ENCODE_BATCHING, ENCODE_BATCH_WINDOW_MS, ENCODE_BATCH_MAX_SIZE
+)
+from core.encode_batcher import EncodeBatcher
+from core.age_index import AgeIndex
+from core.chapter_summary import ChapterSummary
+from core.vector_store import NumpyVectorStore
+from utils.cache import LRUCache
+from utils.stats import LatencyStats
+from utils.metrics import timed, record_stage
+from utils.tracing import span
+from utils.text import normalize_query
 
 # Cấu hình logging
 logger = logging.getLogger(__name__)
 
+# Các vector store engine được hỗ trợ
+VECTOR_STORE_ENGINES = ("chroma", "numpy")
+
+# Prefix theo yêu cầu của multilingual-e5-base
+QUERY_PREFIX = "query: "
+PASSAGE_PREFIX = "passage: "
+
+# File lưu version stamp của collection (nằm trong thư mục ChromaDB)
+COLLECTION_VERSION_FILE = "collection_version.txt"
+
+# File lưu age index (nằm trong thư mục ChromaDB)
+AGE_INDEX_FILE = "age_index.json"
+
+# File lưu thống kê theo chapter (nằm trong thư mục ChromaDB)
+CHAPTER_SUMMARY_FILE = "chapter_summary.json"
+
 # Global instance để implement singleton pattern
 _embedding_model_instance = None
 
@@ -40,39 +69,57 @@ class EmbeddingModel:
             self.model = SentenceTransformer(EMBEDDING_MODEL, cache_folder=cache_dir, trust_remote_code=True)
             logger.info("Đã tải sentence transformer model với cache folder explicit")
         
+        # Cache embedding cho các câu hỏi lặp lại (key: câu hỏi đã chuẩn hóa)
+        self.query_cache = LRUCache(maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
+        
+        # Gom các lượt encode câu hỏi đồng thời từ nhiều request thread
+        self.encode_batcher = None
+        if ENCODE_BATCHING:
+            self.encode_batcher = EncodeBatcher(
+                lambda texts: self.encode(texts, is_query=True),
+                window_ms=ENCODE_BATCH_WINDOW_MS,
+                max_batch=ENCODE_BATCH_MAX_SIZE
+            )
+        
         # Đảm bảo thư mục ChromaDB tồn tại và có quyền ghi
+        self.persist_directory = CHROMA_PERSIST_DIRECTORY
         try:
-            os.makedirs(CHROMA_PERSIST_DIRECTORY, exist_ok=True)
+            os.makedirs(self.persist_directory, exist_ok=True)
             # Test ghi file để kiểm tra permission
-            test_file = os.path.join(CHROMA_PERSIST_DIRECTORY, 'test_permission.tmp')
+            test_file = os.path.join(self.persist_directory, 'test_permission.tmp')
             with open(test_file, 'w') as f:
                 f.write('test')
             os.remove(test_file)
-            logger.info(f"Thư mục ChromaDB đã sẵn sàng: {CHROMA_PERSIST_DIRECTORY}")
+            logger.info(f"Thư mục ChromaDB đã sẵn sàng: {self.persist_directory}")
         except Exception as e:
             logger.error(f"Lỗi tạo/kiểm tra thư mục ChromaDB: {e}")
             # Fallback to /tmp directory
             import tempfile
-            CHROMA_PERSIST_DIRECTORY = os.path.join(tempfile.gettempdir(), 'chroma_db')
-            os.makedirs(CHROMA_PERSIST_DIRECTORY, exist_ok=True)
-            logger.warning(f"Sử dụng thư mục tạm thời: {CHROMA_PERSIST_DIRECTORY}")
+            self.persist_directory = os.path.join(tempfile.gettempdir(), 'chroma_db')
+            os.makedirs(self.persist_directory, exist_ok=True)
+            logger.warning(f"Sử dụng thư mục tạm thời: {self.persist_directory}")
         
         # Khởi tạo ChromaDB client với persistent storage
         try:
             self.chroma_client = chromadb.PersistentClient(
-                path=CHROMA_PERSIST_DIRECTORY,
+                path=self.persist_directory,
                 settings=Settings(
                     anonymized_telemetry=False,
                     allow_reset=True
                 )
             )
-            logger.info(f"Đã kết nối ChromaDB tại: {CHROMA_PERSIST_DIRECTORY}")
+            logger.info(f"Đã kết nối ChromaDB tại: {self.persist_directory}")
         except Exception as e:
             logger.error(f"Lỗi kết nối ChromaDB: {e}")
             # Fallback to in-memory client
             logger.warning("Fallback to in-memory ChromaDB client")
             self.chroma_client = chromadb.Client()
         
+        # Version stamp của collection, thay đổi mỗi khi dữ liệu được index/xóa
+        self._version_file = os.path.join(self.persist_directory, COLLECTION_VERSION_FILE)
+        self._collection_version = None
+        self._version_mtime = None
+        
         # Lấy hoặc tạo collection
         try:
             self.collection = self.chroma_client.get_collection(name=COLLECTION_NAME)
@@ -81,6 +128,102 @@ class EmbeddingModel:
             logger.warning(f"Collection '{COLLECTION_NAME}' không tồn tại, tạo mới...")
             self.collection = self.chroma_client.create_collection(name=COLLECTION_NAME)
             logger.info(f"Đã tạo collection mới: {COLLECTION_NAME}")
+        
+        # Vector store engine và thống kê độ trễ search theo từng engine
+        if VECTOR_STORE not in VECTOR_STORE_ENGINES:
+            logger.warning(f"VECTOR_STORE không hợp lệ: {VECTOR_STORE}, dùng chroma")
+        self.vector_store = VECTOR_STORE if VECTOR_STORE in VECTOR_STORE_ENGINES else "chroma"
+        self.numpy_store = None
+        self.age_index = AgeIndex(os.path.join(self.persist_directory, AGE_INDEX_FILE))
+        self.chapter_summary = ChapterSummary(os.path.join(self.persist_directory, CHAPTER_SUMMARY_FILE))
+        self.search_latency = {engine: LatencyStats() for engine in VECTOR_STORE_ENGINES}
+        logger.info(f"Vector store engine: {self.vector_store}")
+    
+    def _get_numpy_store(self):
+        """Lấy numpy store, build lại từ ChromaDB nếu collection đã thay đổi"""
+        if self.numpy_store is None:
+            self.numpy_store = NumpyVectorStore(NUMPY_STORE_DIRECTORY)
+        self.numpy_store.ensure_version(self.collection, self.get_collection_version())
+        return self.numpy_store
+    
+    def get_age_index(self):
+        """Lấy age index, build lại nếu collection đã thay đổi"""
+        self.age_index.ensure_version(self.collection, self.get_collection_version())
+        return self.age_index
+    
+    def get_chapter_summary(self):
+        """Lấy thống kê theo chapter, build lại (chỉ từ metadata) nếu collection đã thay đổi ở nơi khác"""
+        self.chapter_summary.ensure_version(self.collection, self.get_collection_version())
+        return self.chapter_summary.get_chapters()
+    
+    def _get_existing_metadatas(self, ids):
+        """Metadata hiện tại của các ID (bỏ qua ID chưa có), không đọc nội dung"""
+        try:
+            return self.collection.get(ids=list(ids), include=['metadatas']).get('metadatas') or []
+        except Exception as e:
+            logger.warning(f"Không đọc được metadata cũ: {e}")
+            return None
+    
+    def _update_chapter_summary(self, previous_version, version, added=(), removed=()):
+        """Cập nhật chapter summary sau khi collection thay đổi, lỗi không ảnh hưởng tới việc index"""
+        try:
+            if removed is None:
+                # Không biết metadata cũ: để summary build lại ở lần đọc tiếp theo
+                return
+            self.chapter_summary.apply(previous_version, version, added=added, removed=removed)
+        except Exception as e:
+            logger.warning(f"Không cập nhật được chapter summary: {e}")
+    
+    def get_age_signature(self, age):
+        """
+        Signature của tập chunk phù hợp với độ tuổi, dùng trong key của response cache
+        
+        Returns:
+            str: Signature, "all" nếu không lọc theo tuổi
+        """
+        if not age:
+            return "all"
+        try:
+            return self.get_age_index().signature(age)
+        except Exception as e:
+            logger.warning(f"Không lấy được age signature: {e}")
+            return f"age{age}"
+    
+    def get_collection_version(self):
+        """
+        Lấy version stamp hiện tại của collection
+        
+        Version được lưu ra file để các process khác (script embed_data, các worker khác)
+        cũng nhận biết được khi collection thay đổi.
+        """
+        try:
+            mtime = os.stat(self._version_file).st_mtime_ns
+        except OSError:
+            return "0"
+        
+        if mtime != self._version_mtime:
+            try:
+                with open(self._version_file, 'r', encoding='utf-8') as f:
+                    self._collection_version = f.read().strip() or "0"
+                self._version_mtime = mtime
+            except OSError as e:
+                logger.warning(f"Không đọc được collection version: {e}")
+                return self._collection_version or "0"
+        
+        return self._collection_version
+    
+    def bump_collection_version(self):
+        """Tạo version stamp mới sau khi collection thay đổi"""
+        version = f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+        try:
+            tmp_file = f"{self._version_file}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                f.write(version)
+            os.replace(tmp_file, self._version_file)
+            logger.info(f"Collection version mới: {version}")
+        except OSError as e:
+            logger.error(f"Lỗi ghi collection version: {e}")
+        return version
     
     def _add_prefix_to_text(self, text, is_query=True):
         """
@@ -92,9 +235,9 @@ class EmbeddingModel:
         
         # Thêm prefix phù hợp
         if is_query:
-            return f"query: {text}"
+            return f"{QUERY_PREFIX}{text}"
         else:
-            return f"passage: {text}"
+            return f"{PASSAGE_PREFIX}{text}"
     
     def encode(self, texts, is_query=True):
         """
@@ -123,14 +266,80 @@ class EmbeddingModel:
             logger.error(f"Lỗi encode văn bản: {e}")
             raise
     
-    def search(self, query, top_k=5, age_filter=None):
+    def encode_query(self, query):
         """
-        Tìm kiếm văn bản tương tự trong ChromaDB
+        Encode một câu hỏi, sử dụng cache theo nội dung đã chuẩn hóa
+        
+        Args:
+            query (str): Câu hỏi cần encode
+            
+        Returns:
+            list: Embedding vector của câu hỏi
+        """
+        cache_key = normalize_query(query)
+        embedding = self.query_cache.get(cache_key)
+        if embedding is not None:
+            logger.debug("Query embedding cache hit")
+            return embedding
+        
+        if self.encode_batcher is not None:
+            embedding = self.encode_batcher.encode(query)
+        else:
+            embedding = self.encode(query, is_query=True)[0]
+        self.query_cache.set(cache_key, embedding)
+        return embedding
+    
+    def encode_queries(self, queries):
+        """
+        Encode nhiều câu hỏi, các câu chưa có trong cache được encode trong một batch
+        
+        Args:
+            queries (list): Danh sách câu hỏi
+            
+        Returns:
+            list: Embedding vector tương ứng với từng câu hỏi
+        """
+        cache_keys = [normalize_query(query) for query in queries]
+        embeddings = [self.query_cache.get(key) for key in cache_keys]
+        
+        # Gom các câu hỏi chưa có trong cache (bỏ trùng lặp)
+        missing = {}
+        for i, embedding in enumerate(embeddings):
+            if embedding is None:
+                missing.setdefault(cache_keys[i], []).append(i)
+        
+        if missing:
+            texts = [queries[indexes[0]] for indexes in missing.values()]
+            logger.debug(f"Encode batch {len(texts)}/{len(queries)} câu hỏi chưa có trong cache")
+            for (key, indexes), embedding in zip(missing.items(), self.encode(texts, is_query=True)):
+                self.query_cache.set(key, embedding)
+                for i in indexes:
+                    embeddings[i] = embedding
+        
+        return embeddings
+    
+    def get_cache_stats(self):
+        """Lấy thống kê query embedding cache"""
+        return self.query_cache.get_stats()
+    
+    def get_batcher_stats(self):
+        """Lấy metrics của encode batcher"""
+        if self.encode_batcher is None:
+            return {"enabled": False}
+        stats = self.encode_batcher.get_stats()
+        stats["enabled"] = True
+        return stats
+    
+    @span("embedding.search")
+    def search(self, query, top_k=5, age_filter=None, engine=None):
+        """
+        Tìm kiếm văn bản tương tự
         
         Args:
             query (str): Câu hỏi cần tìm kiếm
             top_k (int): Số lượng kết quả trả về
             age_filter (int): Lọc theo độ tuổi (optional)
+            engine (str): "chroma" hoặc "numpy", mặc định theo cấu hình VECTOR_STORE
             
         Returns:
             list: Danh sách kết quả tìm kiếm
@@ -138,52 +347,246 @@ class EmbeddingModel:
         try:
             logger.debug(f"Dang tim kiem cho query: {query[:50]}...")
             
-            # Encode query thành embedding (với prefix query:)
-            query_embedding = self.encode(query, is_query=True)[0]
-            
-            # Tạo where clause cho age filter
-            where_clause = None
-            if age_filter:
-                where_clause = {
-                    "$and": [
-                        {"age_min": {"$lte": age_filter}},
-                        {"age_max": {"$gte": age_filter}}
-                    ]
-                }
-            
-            # Thực hiện search trong ChromaDB
-            search_results = self.collection.query(
-                query_embeddings=[query_embedding],
-                n_results=top_k,
-                where=where_clause,
-                include=['documents', 'metadatas', 'distances']
-            )
+            # Encode query thành embedding (với prefix query:), có cache
+            with timed("query_encode"):
+                query_embedding = self.encode_query(query)
             
-            if not search_results or not search_results['documents']:
-                logger.warning("Khong tim thay ket qua nao")
-                return []
+            return self.search_by_embedding(query_embedding, top_k=top_k, age_filter=age_filter, engine=engine)
             
-            # Format kết quả
-            results = []
-            documents = search_results['documents'][0]
-            metadatas = search_results['metadatas'][0]
-            distances = search_results['distances'][0]
+        except Exception as e:
+            logger.error(f"Loi tim kiem: {e}")
+            return []
+    
+    def search_by_embedding(self, query_embedding, top_k=5, age_filter=None, engine=None):
+        """
+        Tìm kiếm với embedding câu hỏi đã có (dùng khi cần đo riêng thời gian encode và search)
+        
+        Returns:
+            list: Danh sách kết quả tìm kiếm
+        """
+        engine = engine or self.vector_store
+        start = time.perf_counter()
+        
+        if engine == "numpy":
+            results = self._get_numpy_store().search(query_embedding, top_k=top_k, age_filter=age_filter)
+        else:
+            engine = "chroma"
+            results = self._search_chroma(query_embedding, top_k=top_k, age_filter=age_filter)
+        
+        elapsed = time.perf_counter() - start
+        self.search_latency[engine].record(elapsed * 1000)
+        record_stage("vector_search", elapsed)
+        
+        if not results:
+            logger.warning("Khong tim thay ket qua nao")
+            return []
+        
+        logger.info(f"Tim thay {len(results)} ket qua cho query ({engine})")
+        return results
+    
+    def search_many(self, queries, top_k=5, age_filters=None, engine=None):
+        """
+        Tìm kiếm nhiều câu hỏi cùng lúc
+        
+        Các câu hỏi được encode trong một batch, và mỗi nhóm câu hỏi có cùng age filter
+        chỉ cần một lượt query tới vector store.
+        
+        Args:
+            queries (list): Danh sách câu hỏi
+            top_k (int): Số lượng kết quả trả về cho mỗi câu hỏi
+            age_filters (int or list): Một độ tuổi chung hoặc danh sách độ tuổi theo từng câu hỏi
+            engine (str): "chroma" hoặc "numpy", mặc định theo cấu hình VECTOR_STORE
             
-            for i, (doc, metadata, distance) in enumerate(zip(documents, metadatas, distances)):
+        Returns:
+            list: Danh sách kết quả tương ứng với từng câu hỏi
+        """
+        if not queries:
+            return []
+        
+        try:
+            if age_filters is None or isinstance(age_filters, int):
+                age_filters = [age_filters] * len(queries)
+            elif len(age_filters) != len(queries):
+                raise ValueError("age_filters phải có cùng số phần tử với queries")
+            
+            with timed("query_encode"):
+                query_embeddings = self.encode_queries(queries)
+            
+            engine = engine or self.vector_store
+            if engine != "numpy":
+                engine = "chroma"
+            start = time.perf_counter()
+            
+            # Gom câu hỏi theo age filter
+            groups = {}
+            for i, age_filter in enumerate(age_filters):
+                groups.setdefault(age_filter or None, []).append(i)
+            
+            all_results = [[] for _ in queries]
+            for age_filter, indexes in groups.items():
+                embeddings = [query_embeddings[i] for i in indexes]
+                if engine == "numpy":
+                    group_results = self._get_numpy_store().search_many(embeddings, top_k=top_k, age_filter=age_filter)
+                else:
+                    group_results = self._search_chroma_many(embeddings, top_k=top_k, age_filter=age_filter)
+                for i, results in zip(indexes, group_results):
+                    all_results[i] = results
+            
+            # Ghi nhận độ trễ trung bình mỗi câu hỏi để so sánh được với search đơn
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            per_query_ms = elapsed_ms / len(queries)
+            for _ in queries:
+                self.search_latency[engine].record(per_query_ms)
+                record_stage("vector_search", per_query_ms / 1000)
+            
+            logger.info(f"Search batch {len(queries)} câu hỏi ({engine}) trong {elapsed_ms:.1f}ms")
+            return all_results
+            
+        except Exception as e:
+            logger.error(f"Loi tim kiem batch: {e}")
+            return [[] for _ in queries]
+    
+    def _search_chroma(self, query_embedding, top_k=5, age_filter=None):
+        """Thực hiện search trong ChromaDB với embedding đã có"""
+        return self._search_chroma_many([query_embedding], top_k=top_k, age_filter=age_filter)[0]
+    
+    def _search_chroma_many(self, query_embeddings, top_k=5, age_filter=None):
+        """
+        Thực hiện search ChromaDB cho nhiều embedding
+        
+        Khi có age filter: query không kèm where clause, chỉ lấy id và distance, với
+        số kết quả gấp AGE_FILTER_OVERFETCH lần (chia thêm cho tỉ lệ chunk hợp tuổi),
+        lọc theo age index rồi lấy document/metadata của các id còn lại trong một lượt
+        get. Chỉ các câu hỏi không đủ top_k kết quả sau khi lọc mới phải query lại với
+        where clause; nếu over-fetch phải lấy gần hết collection thì dùng where clause luôn.
+        """
+        if not age_filter:
+            return self._query_chroma(query_embeddings, top_k)
+        
+        try:
+            age_index = self.get_age_index()
+        except Exception as e:
+            logger.warning(f"Không dùng được age index, lọc bằng where clause: {e}")
+            return self._query_chroma(query_embeddings, top_k, where=self._age_where_clause(age_filter))
+        
+        if age_index.covers_all(age_filter):
+            return self._query_chroma(query_embeddings, top_k)
+        
+        allowed = age_index.allowed_ids(age_filter)
+        if not allowed:
+            return [[] for _ in query_embeddings]
+        
+        where = self._age_where_clause(age_filter)
+        n_results = -(-top_k * max(1, AGE_FILTER_OVERFETCH) * age_index.total // len(allowed))
+        if n_results >= age_index.total:
+            return self._query_chroma(query_embeddings, top_k, where=where)
+        
+        search_results = self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            include=['distances']
+        )
+        
+        all_hits = []
+        need_fallback = []
+        for i, (ids, distances) in enumerate(zip(search_results['ids'], search_results['distances'])):
+            hits = [(doc_id, distance) for doc_id, distance in zip(ids, distances) if doc_id in allowed][:top_k]
+            all_hits.append(hits)
+            if len(hits) < min(top_k, len(allowed)):
+                need_fallback.append(i)
+        
+        # Lấy document/metadata một lần cho mọi id còn lại sau khi lọc
+        hit_ids = list({doc_id for hits in all_hits for doc_id, _ in hits})
+        stored = {}
+        if hit_ids:
+            fetched = self.collection.get(ids=hit_ids, include=['documents', 'metadatas'])
+            stored = {
+                doc_id: (doc, metadata)
+                for doc_id, doc, metadata in zip(fetched['ids'], fetched['documents'], fetched['metadatas'])
+            }
+        
+        all_results = []
+        for hits in all_hits:
+            results = []
+            for doc_id, distance in hits:
+                if doc_id not in stored:
+                    continue
+                doc, metadata = stored[doc_id]
+                results.append({
+                    'id': doc_id,
+                    'document': doc,
+                    'metadata': metadata or {},
+                    'distance': distance,
+                    'similarity': 1 - distance,
+                    'rank': len(results) + 1
+                })
+            all_results.append(results)
+        
+        if need_fallback:
+            logger.debug(f"Over-fetch không đủ kết quả cho {len(need_fallback)} câu hỏi, query lại với where clause")
+            fallback_results = self._query_chroma(
+                [query_embeddings[i] for i in need_fallback],
+                top_k,
+                where=where
+            )
+            for i, results in zip(need_fallback, fallback_results):
+                all_results[i] = results
+        
+        return all_results
+    
+    @staticmethod
+    def _age_where_clause(age_filter):
+        """Where clause lọc theo độ tuổi trên metadata"""
+        return {
+            "$and": [
+                {"age_min": {"$lte": age_filter}},
+                {"age_max": {"$gte": age_filter}}
+            ]
+        }
+    
+    def _query_chroma(self, query_embeddings, n_results, where=None):
+        """Một lượt query ChromaDB cho nhiều embedding"""
+        search_results = self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            where=where,
+            include=['documents', 'metadatas', 'distances']
+        )
+        
+        if not search_results or not search_results['documents']:
+            return [[] for _ in query_embeddings]
+        
+        # Format kết quả theo từng câu hỏi
+        all_results = []
+        for ids, documents, metadatas, distances in zip(
+            search_results['ids'],
+            search_results['documents'],
+            search_results['metadatas'],
+            search_results['distances']
+        ):
+            results = []
+            for i, (doc_id, doc, metadata, distance) in enumerate(zip(ids, documents, metadatas, distances)):
                 results.append({
+                    'id': doc_id,
                     'document': doc,
                     'metadata': metadata or {},
                     'distance': distance,
                     'similarity': 1 - distance,  # Chuyển distance thành similarity
                     'rank': i + 1
                 })
-            
-            logger.info(f"Tim thay {len(results)} ket qua cho query")
-            return results
-            
-        except Exception as e:
-            logger.error(f"Loi tim kiem: {e}")
-            return []
+            all_results.append(results)
+        
+        return all_results
+    
+    def get_search_stats(self):
+        """Lấy thống kê độ trễ search theo từng engine (không gồm thời gian encode query)"""
+        stats = {
+            "engine": self.vector_store,
+            "latency": {engine: latency.get_stats() for engine, latency in self.search_latency.items()}
+        }
+        if self.numpy_store is not None:
+            stats["numpy_store"] = self.numpy_store.get_stats()
+        return stats
     
     def add_documents(self, documents, metadatas=None, ids=None):
         """
@@ -216,6 +619,7 @@ class EmbeddingModel:
             embeddings = self.encode(documents, is_query=False)
             
             # Thêm vào collection
+            previous_version = self.get_collection_version()
             self.collection.add(
                 embeddings=embeddings,
                 documents=documents,
@@ -223,6 +627,9 @@ class EmbeddingModel:
                 ids=ids
             )
             
+            version = self.bump_collection_version()
+            self._update_chapter_summary(previous_version, version, added=metadatas)
+            
             logger.info(f"Đã thêm thành công {len(documents)} documents")
             return True
             
@@ -230,6 +637,62 @@ class EmbeddingModel:
             logger.error(f"Lỗi thêm documents: {e}")
             return False
     
+    def upsert_documents(self, documents, metadatas, ids):
+        """
+        Thêm mới hoặc cập nhật documents trong ChromaDB (encode lại nội dung)
+        
+        Returns:
+            bool: True nếu thành công
+        """
+        try:
+            if not documents:
+                return True
+            
+            logger.info(f"Đang upsert {len(documents)} documents vào ChromaDB")
+            embeddings = self.encode(documents, is_query=False)
+            
+            previous_version = self.get_collection_version()
+            previous_metadatas = self._get_existing_metadatas(ids)
+            self.collection.upsert(
+                embeddings=embeddings,
+                documents=documents,
+                metadatas=metadatas,
+                ids=ids
+            )
+            
+            version = self.bump_collection_version()
+            self._update_chapter_summary(previous_version, version, added=metadatas, removed=previous_metadatas)
+            return True
+            
+        except Exception as e:
+            logger.error(f"Lỗi upsert documents: {e}")
+            return False
+    
+    def update_metadatas(self, ids, metadatas):
+        """
+        Cập nhật metadata của documents đã có, không encode lại
+        
+        Returns:
+            bool: True nếu thành công
+        """
+        try:
+            if not ids:
+                return True
+            
+            previous_version = self.get_collection_version()
+            previous_metadatas = self._get_existing_metadatas(ids)
+            self.collection.update(ids=ids, metadatas=metadatas)
+            
+            version = self.bump_collection_version()
+            self._update_chapter_summary(previous_version, version, added=metadatas, removed=previous_metadatas)
+            
+            logger.info(f"Đã cập nhật metadata cho {len(ids)} documents")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Lỗi cập nhật metadata: {e}")
+            return False
+    
     def index_chunks(self, chunks):
         """
         Index các chunks dữ liệu vào ChromaDB
@@ -286,6 +749,34 @@ class EmbeddingModel:
             logger.error(f"Lỗi index chunks: {e}")
             return False
     
+    def delete_documents(self, ids):
+        """
+        Xóa documents khỏi ChromaDB theo danh sách ID
+        
+        Args:
+            ids (list): Danh sách ID cần xóa
+            
+        Returns:
+            bool: True nếu thành công
+        """
+        try:
+            if not ids:
+                return True
+            
+            previous_version = self.get_collection_version()
+            previous_metadatas = self._get_existing_metadatas(ids)
+            self.collection.delete(ids=list(ids))
+            
+            version = self.bump_collection_version()
+            self._update_chapter_summary(previous_version, version, removed=previous_metadatas)
+            
+            logger.info(f"Đã xóa {len(ids)} documents")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Lỗi xóa documents: {e}")
+            return False
+    
     def count(self):
         """Đếm số lượng documents trong collection"""
         try:
@@ -304,6 +795,7 @@ class EmbeddingModel:
             self.collection = self.chroma_client.create_collection(name=COLLECTION_NAME)
             logger.info("Đã tạo lại collection mới")
             
+            self.chapter_summary.reset(self.bump_collection_version())
             return True
             
         except Exception as e:
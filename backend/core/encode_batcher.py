@@ -0,0 +1,144 @@
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from utils.stats import LatencyStats
+
+# Cấu hình logging
+logger = logging.getLogger(__name__)
+
+class EncodeBatcher:
+    """
+    Gom các yêu cầu encode câu hỏi đồng thời thành một batch
+
+    Mỗi request thread gửi câu hỏi vào hàng đợi và chờ trên Future. Một thread nền
+    lấy yêu cầu đầu tiên cùng các yêu cầu đang chờ sẵn, gọi encode một lần rồi trả kết quả
+    về từng Future. Chỉ khi đã có yêu cầu khác chờ sẵn (đang có tải đồng thời) mới đợi thêm
+    tối đa `window_ms` để gom batch (không quá `max_batch`), nên một request đơn lẻ không bị trễ.
+    """
+
+    def __init__(self, encode_fn, window_ms=3, max_batch=32):
+        """
+        Args:
+            encode_fn (callable): Hàm nhận list văn bản, trả về list embeddings
+            window_ms (float): Thời gian tối đa chờ gom batch (ms)
+            max_batch (int): Số câu hỏi tối đa trong một batch
+        """
+        self.encode_fn = encode_fn
+        self.window = max(0.0, window_ms) / 1000.0
+        self.max_batch = max(1, int(max_batch))
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+        # Metrics
+        self.queue_delay = LatencyStats()
+        self.encode_latency = LatencyStats()
+        self.batch_count = 0
+        self.request_count = 0
+        self.batch_sizes = {}
+        self.errors = 0
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="encode-batcher", daemon=True)
+                self._thread.start()
+                logger.info(f"Đã khởi động EncodeBatcher (window={self.window * 1000:.1f}ms, max_batch={self.max_batch})")
+
+    def submit(self, text):
+        """
+        Gửi một văn bản cần encode
+
+        Returns:
+            Future: Kết quả là embedding của văn bản
+        """
+        self._ensure_started()
+        future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        return future
+
+    def encode(self, text, timeout=30):
+        """Encode một văn bản qua batcher (blocking)"""
+        return self.submit(text).result(timeout=timeout)
+
+    def _collect_batch(self):
+        """Lấy yêu cầu đầu tiên (blocking) và các yêu cầu đang chờ, có tải đồng thời thì gom thêm trong cửa sổ thời gian"""
+        batch = [self._queue.get()]
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if len(batch) == 1:
+            return batch
+
+        deadline = time.perf_counter() + self.window
+
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            started = time.perf_counter()
+
+            for _, _, enqueued_at in batch:
+                self.queue_delay.record((started - enqueued_at) * 1000)
+
+            # Bỏ trùng lặp trong cùng batch
+            texts = list(dict.fromkeys(text for text, _, _ in batch))
+
+            try:
+                embeddings = self.encode_fn(texts)
+                results = dict(zip(texts, embeddings))
+                for text, future, _ in batch:
+                    if not future.cancelled():
+                        future.set_result(results[text])
+            except Exception as e:
+                logger.error(f"Lỗi encode batch {len(texts)} câu hỏi: {e}")
+                with self._stats_lock:
+                    self.errors += 1
+                for _, future, _ in batch:
+                    if not future.cancelled():
+                        future.set_exception(e)
+
+            self.encode_latency.record((time.perf_counter() - started) * 1000)
+            with self._stats_lock:
+                self.batch_count += 1
+                self.request_count += len(batch)
+                self.batch_sizes[len(batch)] = self.batch_sizes.get(len(batch), 0) + 1
+
+    def get_stats(self):
+        """Lấy metrics của batcher"""
+        with self._stats_lock:
+            batch_count = self.batch_count
+            request_count = self.request_count
+            batch_sizes = dict(sorted(self.batch_sizes.items()))
+            errors = self.errors
+
+        return {
+            "window_ms": round(self.window * 1000, 3),
+            "max_batch": self.max_batch,
+            "batches": batch_count,
+            "requests": request_count,
+            "errors": errors,
+            "mean_batch_size": round(request_count / batch_count, 3) if batch_count else 0.0,
+            "batch_size_distribution": batch_sizes,
+            "queue_delay": self.queue_delay.get_stats(),
+            "encode_latency": self.encode_latency.get_stats(),
+            "pending": self._queue.qsize()
+        }
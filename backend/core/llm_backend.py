@@ -0,0 +1,224 @@
+import abc
+import json
+import time
+import random
+import hashlib
+import logging
+import threading
+from config import (
+    GEMINI_API_KEY, LLM_BACKEND,
+    STUB_LLM_SEED, STUB_LLM_LATENCY_MS, STUB_LLM_LATENCY_JITTER_MS,
+    STUB_LLM_TOKENS_PER_SECOND, STUB_LLM_TOKENS_PER_SECOND_JITTER, STUB_LLM_RESPONSE_TOKENS
+)
+
+# Cấu hình logging
+logger = logging.getLogger(__name__)
+
+# Cache các backend đã khởi tạo theo (loại backend, tên model)
+_backend_instances = {}
+_backend_lock = threading.Lock()
+
+def get_llm_backend(model_name):
+    """
+    Lấy backend sinh văn bản cho model, loại backend được chọn qua biến môi trường LLM_BACKEND
+
+    Args:
+        model_name (str): Tên model Gemini (vd: 'gemini-2.0-flash')
+
+    Returns:
+        LLMBackend
+    """
+    key = (LLM_BACKEND, model_name)
+    with _backend_lock:
+        backend = _backend_instances.get(key)
+        if backend is None:
+            if LLM_BACKEND == "stub":
+                logger.info(f"Khởi tạo StubBackend thay cho model {model_name}")
+                backend = StubBackend(
+                    model_name=model_name,
+                    seed=STUB_LLM_SEED,
+                    latency_ms=STUB_LLM_LATENCY_MS,
+                    latency_jitter_ms=STUB_LLM_LATENCY_JITTER_MS,
+                    tokens_per_second=STUB_LLM_TOKENS_PER_SECOND,
+                    tokens_per_second_jitter=STUB_LLM_TOKENS_PER_SECOND_JITTER,
+                    response_tokens=STUB_LLM_RESPONSE_TOKENS
+                )
+            else:
+                logger.info(f"Khởi tạo GeminiBackend với model {model_name}")
+                backend = GeminiBackend(model_name)
+            _backend_instances[key] = backend
+        return backend
+
+class LLMBackend(abc.ABC):
+    """
+    Interface chung cho các backend sinh văn bản
+
+    Các backend chỉ cần implement generate_stream, generate mặc định ghép các chunk lại.
+    expect_json: prompt yêu cầu trả về JSON (vd: xử lý tài liệu), StubBackend sinh JSON hợp lệ;
+    GeminiBackend không đổi generation config, định dạng JSON do prompt quy định.
+    """
+
+    name = "base"
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    @property
+    def fingerprint(self):
+        """Định danh backend + model, dùng trong key response cache để không trả lời bằng response của backend khác"""
+        return f"{self.name}:{self.model_name}"
+
+    def generate(self, prompt, temperature=0.2, max_output_tokens=4096, expect_json=False):
+        """
+        Sinh toàn bộ văn bản cho prompt
+
+        Returns:
+            str: Văn bản được sinh ra (chuỗi rỗng nếu không có)
+        """
+        return "".join(self.generate_stream(
+            prompt,
+            temperature=temperature,
+            max_output_tokens=max_output_tokens,
+            expect_json=expect_json
+        ))
+
+    @abc.abstractmethod
+    def generate_stream(self, prompt, temperature=0.2, max_output_tokens=4096, expect_json=False):
+        """Sinh văn bản dạng streaming, yield từng đoạn text"""
+
+class GeminiBackend(LLMBackend):
+    """Backend gọi Gemini API qua google.generativeai"""
+
+    name = "gemini"
+
+    def __init__(self, model_name):
+        super().__init__(model_name)
+        import google.generativeai as genai
+
+        genai.configure(api_key=GEMINI_API_KEY)
+        self._genai = genai
+        self.model = genai.GenerativeModel(model_name)
+
+    def _generation_config(self, temperature, max_output_tokens):
+        return self._genai.types.GenerationConfig(
+            temperature=temperature,
+            max_output_tokens=max_output_tokens
+        )
+
+    def generate(self, prompt, temperature=0.2, max_output_tokens=4096, expect_json=False):
+        response = self.model.generate_content(
+            prompt,
+            generation_config=self._generation_config(temperature, max_output_tokens)
+        )
+        if not response:
+            return ""
+        return response.text or ""
+
+    def generate_stream(self, prompt, temperature=0.2, max_output_tokens=4096, expect_json=False):
+        response = self.model.generate_content(
+            prompt,
+            generation_config=self._generation_config(temperature, max_output_tokens),
+            stream=True
+        )
+
+        for chunk in response:
+            text = getattr(chunk, 'text', '')
+            if text:
+                yield text
+
+# Từ vựng dùng để sinh văn bản giả lập
+STUB_VOCABULARY = (
+    "dinh dưỡng", "bữa ăn", "rau xanh", "trái cây", "chất đạm", "vitamin", "khoáng chất",
+    "năng lượng", "uống đủ nước", "hợp lý", "cân đối", "học sinh", "sức khỏe", "vệ sinh",
+    "an toàn thực phẩm", "mỗi ngày", "nên", "cần", "và", "các", "cho", "trẻ", "phát triển"
+)
+
+class StubBackend(LLMBackend):
+    """
+    Backend giả lập không cần mạng, dùng cho load test và benchmark
+
+    Độ trễ token đầu tiên và tốc độ sinh token được lấy mẫu từ phân phối chuẩn
+    (cắt ở 0) với seed cố định kết hợp với prompt, nên cùng prompt luôn cho
+    cùng văn bản và cùng thời gian.
+    """
+
+    name = "stub"
+
+    def __init__(self, model_name, seed=0, latency_ms=300, latency_jitter_ms=100,
+                 tokens_per_second=80, tokens_per_second_jitter=20, response_tokens=200):
+        """
+        Args:
+            seed (int): Seed cho bộ sinh số ngẫu nhiên
+            latency_ms (float): Độ trễ trung bình trước token đầu tiên (ms)
+            latency_jitter_ms (float): Độ lệch chuẩn của độ trễ (ms)
+            tokens_per_second (float): Tốc độ sinh token trung bình
+            tokens_per_second_jitter (float): Độ lệch chuẩn của tốc độ sinh token
+            response_tokens (int): Số token của mỗi response
+        """
+        super().__init__(model_name)
+        self.seed = seed
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.tokens_per_second = tokens_per_second
+        self.tokens_per_second_jitter = tokens_per_second_jitter
+        self.response_tokens = response_tokens
+
+    @property
+    def fingerprint(self):
+        return f"{self.name}:{self.model_name}:{self.seed}:{self.response_tokens}"
+
+    def _rng(self, prompt):
+        digest = hashlib.sha256(f"{self.seed}:{self.model_name}:{prompt}".encode('utf-8')).hexdigest()
+        return random.Random(int(digest[:16], 16))
+
+    def _sample_timing(self, rng):
+        latency = max(0.0, rng.gauss(self.latency_ms, self.latency_jitter_ms)) / 1000.0
+        tokens_per_second = max(1.0, rng.gauss(self.tokens_per_second, self.tokens_per_second_jitter))
+        return latency, tokens_per_second
+
+    def _make_tokens(self, rng, max_output_tokens):
+        count = max(1, min(self.response_tokens, max_output_tokens))
+        return [rng.choice(STUB_VOCABULARY) + " " for _ in range(count)]
+
+    def _make_json_document(self, rng, max_output_tokens):
+        """Tạo document JSON hợp lệ theo format xử lý tài liệu của admin"""
+        content = "".join(self._make_tokens(rng, max_output_tokens)).strip()
+        doc_id = f"stub{rng.randint(1, 9999)}"
+        return json.dumps({
+            "bai_info": {"id": doc_id, "title": "Tài liệu giả lập", "overview": content[:200]},
+            "chunks": [{
+                "id": f"{doc_id}_muc1_1",
+                "title": "Nội dung giả lập",
+                "content": content,
+                "summary": content[:100],
+                "content_type": "text",
+                "age_range": [1, 19],
+                "pages": "",
+                "related_chunks": [],
+                "word_count": len(content.split()),
+                "token_count": len(content.split()),
+                "contains_table": False,
+                "contains_figure": False
+            }],
+            "tables": [],
+            "figures": [],
+            "total_items": {"chunks": 1, "tables": 0, "figures": 0}
+        }, ensure_ascii=False)
+
+    def generate_stream(self, prompt, temperature=0.2, max_output_tokens=4096, expect_json=False):
+        rng = self._rng(prompt)
+        latency, tokens_per_second = self._sample_timing(rng)
+
+        delay = 1.0 / tokens_per_second
+
+        if expect_json:
+            # JSON chỉ hợp lệ khi hoàn chỉnh nên trả về một lần sau thời gian sinh tương ứng
+            document = self._make_json_document(rng, max_output_tokens)
+            time.sleep(latency + len(document.split()) * delay)
+            yield document
+            return
+
+        time.sleep(latency)
+        for token in self._make_tokens(rng, max_output_tokens):
+            yield token
+            time.sleep(delay)
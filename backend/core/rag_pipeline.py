@@ -1,35 +1,118 @@
 import logging
-import google.generativeai as genai
 from core.embedding_model import get_embedding_model
-from config import GEMINI_API_KEY, HUMAN_PROMPT_TEMPLATE, SYSTEM_PROMPT, TOP_K_RESULTS, TEMPERATURE, MAX_OUTPUT_TOKENS
+from core.response_cache import get_response_cache
+from core.llm_backend import get_llm_backend
+from utils.metrics import timed, record_stage
+from utils.tracing import span
+from config import CHAT_MODEL, HUMAN_PROMPT_TEMPLATE, SYSTEM_PROMPT, TOP_K_RESULTS, TEMPERATURE, MAX_OUTPUT_TOKENS
 import os
 import re
+import time
 
 # Cấu hình logging
 logger = logging.getLogger(__name__)
 
-# Cấu hình Gemini
-genai.configure(api_key=GEMINI_API_KEY)
+# Hướng dẫn trả lời theo nhóm tuổi: (tuổi tối đa của nhóm, hướng dẫn)
+AGE_GUIDANCE_BUCKETS = [
+    (3, "Sử dụng ngôn ngữ đơn giản, dễ hiểu cho phụ huynh có con nhỏ."),
+    (6, "Tập trung vào dinh dưỡng cho trẻ mầm non, ngôn ngữ phù hợp với phụ huynh."),
+    (12, "Nội dung phù hợp cho trẻ tiểu học, có thể giải thích đơn giản cho trẻ hiểu."),
+    (15, "Thông tin chi tiết hơn, phù hợp cho học sinh trung học cơ sở."),
+    (None, "Thông tin đầy đủ, chi tiết cho học sinh trung học phổ thông.")
+]
+
+def get_age_bucket(age):
+    """Xác định index nhóm tuổi trong AGE_GUIDANCE_BUCKETS"""
+    for index, (max_age, _) in enumerate(AGE_GUIDANCE_BUCKETS):
+        if max_age is None or age <= max_age:
+            return index
+    return len(AGE_GUIDANCE_BUCKETS) - 1
+
+# Câu trả lời khi không tìm thấy tài liệu liên quan
+NO_RESULT_RESPONSE = "Xin lỗi, tôi không tìm thấy thông tin liên quan đến câu hỏi của bạn trong tài liệu."
+
+# Pattern markdown image
+IMAGE_PATTERN = re.compile(r'!\[([^\]]*)\]\(([^)]+)\)')
+
+# Độ dài tối đa của đoạn text được giữ lại khi chờ image link hoàn chỉnh trong streaming
+MAX_PENDING_IMAGE_CHARS = 500
 
 class RAGPipeline:
-    def __init__(self):
-        """Khởi tạo RAG Pipeline chỉ với embedding model"""
+    def __init__(self, llm_backend=None):
+        """
+        Khởi tạo RAG Pipeline chỉ với embedding model
+        
+        Args:
+            llm_backend (LLMBackend): Backend sinh văn bản thay thế (vd: fake backend khi test),
+                mặc định lấy theo cấu hình LLM_BACKEND
+        """
         logger.info("Khởi tạo RAG Pipeline")
         
         self.embedding_model = get_embedding_model()
+        self.response_cache = get_response_cache()
         
-        # Khởi tạo Gemini model
-        self.gemini_model = genai.GenerativeModel('gemini-2.0-flash')
+        # Khởi tạo backend sinh văn bản
+        self.llm_backend = llm_backend or get_llm_backend(CHAT_MODEL)
         
         logger.info("RAG Pipeline đã sẵn sàng")
     
-    def generate_response(self, query, age=1):
+    @span("rag.retrieve")
+    def _retrieve_contexts(self, query, age=None):
+        """
+        Tìm kiếm tài liệu liên quan (chỉ các chunk phù hợp với độ tuổi) và chuẩn bị contexts, sources
+        
+        Returns:
+            tuple: (contexts, sources)
+        """
+        # SỬA: Chỉ search trong ChromaDB, không load lại dữ liệu
+        logger.info("Đang tìm kiếm thông tin liên quan...")
+        search_results = self.embedding_model.search(query, top_k=TOP_K_RESULTS, age_filter=age)
+        
+        contexts = []
+        sources = []
+        
+        for result in search_results or []:
+            # Lấy thông tin từ metadata
+            metadata = result.get('metadata', {})
+            content = result.get('document', '')
+            
+            # Thêm context
+            contexts.append({
+                "content": content,
+                "metadata": metadata
+            })
+            
+            # Thêm source reference
+            source_info = {
+                "title": metadata.get('title', metadata.get('chapter', 'Tài liệu dinh dưỡng')),
+                "pages": metadata.get('pages'),
+                "content_type": metadata.get('content_type', 'text')
+            }
+            
+            if source_info not in sources:
+                sources.append(source_info)
+        
+        return contexts, sources
+    
+    def _get_age_cache_key(self, age):
+        """
+        Phần độ tuổi trong key của response cache
+        
+        Gồm nhóm tuổi (quyết định hướng dẫn trong prompt) và signature của tập chunk
+        phù hợp với tuổi (quyết định kết quả retrieval).
+        """
+        return f"{get_age_bucket(age)}:{self.embedding_model.get_age_signature(age)}"
+    
+    @span("rag.generate_response")
+    def generate_response(self, query, age=1, use_cache=True):
         """
         Generate response cho user query sử dụng RAG
         
         Args:
             query (str): Câu hỏi của người dùng
             age (int): Tuổi của người dùng (1-19)
+            use_cache (bool): False để bỏ qua response cache (vd: regenerate),
+                kết quả mới vẫn được ghi lại vào cache
         
         Returns:
             dict: Response data with success status
@@ -37,78 +120,63 @@ class RAGPipeline:
         try:
             logger.info(f"Bắt đầu generate response cho query: {query[:50]}... (age: {age})")
             
-            # SỬA: Chỉ search trong ChromaDB, không load lại dữ liệu
-            logger.info("Đang tìm kiếm thông tin liên quan...")
-            search_results = self.embedding_model.search(query, top_k=TOP_K_RESULTS)
+            # Kiểm tra response cache
+            age_key = self._get_age_cache_key(age)
+            collection_version = self.embedding_model.get_collection_version()
+            if use_cache:
+                cached_response = self.response_cache.get(query, age_key, collection_version, self.llm_backend.fingerprint)
+                if cached_response:
+                    logger.info("Response cache hit, bỏ qua retrieval và generation")
+                    cached_response["cached"] = True
+                    return cached_response
             
-            if not search_results or len(search_results) == 0:
+            contexts, sources = self._retrieve_contexts(query, age)
+            
+            if not contexts:
                 logger.warning("Không tìm thấy thông tin liên quan")
                 return {
                     "success": True,
-                    "response": "Xin lỗi, tôi không tìm thấy thông tin liên quan đến câu hỏi của bạn trong tài liệu.",
+                    "response": NO_RESULT_RESPONSE,
                     "sources": []
                 }
             
-            # Chuẩn bị contexts từ kết quả tìm kiếm
-            contexts = []
-            sources = []
-            
-            for result in search_results:
-                # Lấy thông tin từ metadata
-                metadata = result.get('metadata', {})
-                content = result.get('document', '')
+            with timed("prompt_build"):
+                # Format contexts cho prompt
+                formatted_contexts = self._format_contexts(contexts)
                 
-                # Thêm context
-                contexts.append({
-                    "content": content,
-                    "metadata": metadata
-                })
-                
-                # Thêm source reference
-                source_info = {
-                    "title": metadata.get('title', metadata.get('chapter', 'Tài liệu dinh dưỡng')),
-                    "pages": metadata.get('pages'),
-                    "content_type": metadata.get('content_type', 'text')
-                }
-                
-                if source_info not in sources:
-                    sources.append(source_info)
-            
-            # Format contexts cho prompt
-            formatted_contexts = self._format_contexts(contexts)
-            
-            # Tạo prompt với age context
-            full_prompt = self._create_prompt_with_age_context(query, age, formatted_contexts)
+                # Tạo prompt với age context
+                full_prompt = self._create_prompt_with_age_context(query, age, formatted_contexts)
             
-            # Generate response với Gemini
-            logger.info("Đang tạo phản hồi với Gemini...")
-            response = self.gemini_model.generate_content(
-                full_prompt,
-                generation_config=genai.types.GenerationConfig(
+            # Generate response với LLM backend
+            logger.info(f"Đang tạo phản hồi với {self.llm_backend.name}...")
+            with timed("llm_generate"):
+                response_text = self.llm_backend.generate(
+                    full_prompt,
                     temperature=TEMPERATURE,
                     max_output_tokens=MAX_OUTPUT_TOKENS
                 )
-            )
             
-            if not response or not response.text:
-                logger.error("Gemini không trả về response")
+            if not response_text:
+                logger.error("LLM backend không trả về response")
                 return {
                     "success": False,
                     "error": "Không thể tạo phản hồi"
                 }
             
-            response_text = response.text.strip()
-            
             # Post-process response để xử lý hình ảnh
-            response_text = self._process_image_links(response_text)
+            with timed("post_process"):
+                response_text = self._process_image_links(response_text.strip())
             
             logger.info("Đã tạo phản hồi thành công")
             
-            return {
+            response_data = {
                 "success": True,
                 "response": response_text,
                 "sources": sources[:3]  # Giới hạn 3 sources để không quá dài
             }
+            self.response_cache.set(query, age_key, collection_version, self.llm_backend.fingerprint, response_data)
+            
+            return response_data
             
         except Exception as e:
             logger.error(f"Lỗi generate response: {str(e)}")
@@ -117,6 +185,146 @@ class RAGPipeline:
                 "error": f"Lỗi tạo phản hồi: {str(e)}"
             }
     
+    def generate_response_stream(self, query, age=1, use_cache=True):
+        """
+        Generate response dạng streaming cho user query sử dụng RAG
+        
+        Generator trả về lần lượt các event (event_type, data):
+            - ("sources", list): Các nguồn tài liệu, gửi trước khi sinh văn bản
+            - ("chunk", str): Một đoạn response đã xử lý image links
+            - ("done", dict): Response data đầy đủ như generate_response
+            - ("error", str): Thông báo lỗi, kết thúc stream
+        
+        Args:
+            query (str): Câu hỏi của người dùng
+            age (int): Tuổi của người dùng (1-19)
+            use_cache (bool): False để bỏ qua response cache
+        """
+        try:
+            logger.info(f"Bắt đầu stream response cho query: {query[:50]}... (age: {age})")
+            
+            # Kiểm tra response cache
+            age_key = self._get_age_cache_key(age)
+            collection_version = self.embedding_model.get_collection_version()
+            if use_cache:
+                cached_response = self.response_cache.get(query, age_key, collection_version, self.llm_backend.fingerprint)
+                if cached_response:
+                    logger.info("Response cache hit, trả về response đã cache")
+                    cached_response["cached"] = True
+                    yield "sources", cached_response.get("sources", [])
+                    yield "chunk", cached_response.get("response", "")
+                    yield "done", cached_response
+                    return
+            
+            contexts, sources = self._retrieve_contexts(query, age)
+            sources = sources[:3]  # Giới hạn 3 sources để không quá dài
+            
+            yield "sources", sources
+            
+            if not contexts:
+                logger.warning("Không tìm thấy thông tin liên quan")
+                yield "chunk", NO_RESULT_RESPONSE
+                yield "done", {
+                    "success": True,
+                    "response": NO_RESULT_RESPONSE,
+                    "sources": []
+                }
+                return
+            
+            with timed("prompt_build"):
+                formatted_contexts = self._format_contexts(contexts)
+                full_prompt = self._create_prompt_with_age_context(query, age, formatted_contexts)
+            
+            # Stream response, chỉ xử lý image links trên phần text đã hoàn chỉnh
+            logger.info(f"Đang stream phản hồi với {self.llm_backend.name}...")
+            processed_parts = []
+            pending = ""
+            
+            # Thời gian LLM (tới token đầu tiên và toàn bộ stream) và thời gian xử lý image links
+            # được đo riêng, không tính thời gian chờ client nhận chunk
+            llm_seconds = 0.0
+            post_process_seconds = 0.0
+            first_token = True
+            
+            stream = self.llm_backend.generate_stream(
+                full_prompt,
+                temperature=TEMPERATURE,
+                max_output_tokens=MAX_OUTPUT_TOKENS
+            )
+            llm_start = time.perf_counter()
+            for text in stream:
+                llm_seconds += time.perf_counter() - llm_start
+                if first_token:
+                    record_stage("llm_first_token", llm_seconds)
+                    first_token = False
+                
+                if not processed_parts and not pending:
+                    text = text.lstrip()
+                pending += text
+                
+                post_start = time.perf_counter()
+                ready, pending = self._split_stream_buffer(pending)
+                if ready:
+                    ready = self._process_image_links(ready)
+                    processed_parts.append(ready)
+                post_process_seconds += time.perf_counter() - post_start
+                
+                if ready:
+                    yield "chunk", ready
+                llm_start = time.perf_counter()
+            llm_seconds += time.perf_counter() - llm_start
+            record_stage("llm_generate", llm_seconds)
+            
+            if pending:
+                post_start = time.perf_counter()
+                pending = self._process_image_links(pending)
+                post_process_seconds += time.perf_counter() - post_start
+                processed_parts.append(pending)
+                yield "chunk", pending
+            record_stage("post_process", post_process_seconds)
+            
+            response_text = "".join(processed_parts).strip()
+            if not response_text:
+                logger.error("LLM backend không trả về response")
+                yield "error", "Không thể tạo phản hồi"
+                return
+            
+            logger.info("Đã stream phản hồi thành công")
+            
+            response_data = {
+                "success": True,
+                "response": response_text,
+                "sources": sources
+            }
+            self.response_cache.set(query, age_key, collection_version, self.llm_backend.fingerprint, response_data)
+            
+            yield "done", response_data
+            
+        except Exception as e:
+            logger.error(f"Lỗi stream response: {str(e)}")
+            yield "error", f"Lỗi tạo phản hồi: {str(e)}"
+    
+    def _split_stream_buffer(self, buffer):
+        """
+        Tách buffer streaming thành phần có thể xử lý ngay và phần cần chờ thêm
+        
+        Image link markdown có thể bị cắt giữa hai chunk, nên giữ lại phần bắt đầu
+        từ '![' cuối cùng nếu link đó chưa hoàn chỉnh.
+        
+        Returns:
+            tuple: (ready_text, pending_text)
+        """
+        start = buffer.rfind('![')
+        if start != -1 and not IMAGE_PATTERN.match(buffer, start):
+            if len(buffer) - start <= MAX_PENDING_IMAGE_CHARS:
+                return buffer[:start], buffer[start:]
+        
+        # '!' ở cuối có thể là phần đầu của image link tiếp theo
+        if buffer.endswith('!'):
+            return buffer[:-1], '!'
+        
+        return buffer, ""
+    
     def _format_contexts(self, contexts):
         """Format contexts thành string cho prompt"""
         formatted = []
@@ -140,16 +348,7 @@ class RAGPipeline:
     def _create_prompt_with_age_context(self, query, age, contexts):
         """Tạo prompt với age context"""
         # Xác định age group
-        if age <= 3:
-            age_guidance = "Sử dụng ngôn ngữ đơn giản, dễ hiểu cho phụ huynh có con nhỏ."
-        elif age <= 6:
-            age_guidance = "Tập trung vào dinh dưỡng cho trẻ mầm non, ngôn ngữ phù hợp với phụ huynh."
-        elif age <= 12:
-            age_guidance = "Nội dung phù hợp cho trẻ tiểu học, có thể giải thích đơn giản cho trẻ hiểu."
-        elif age <= 15:
-            age_guidance = "Thông tin chi tiết hơn, phù hợp cho học sinh trung học cơ sở."
-        else:
-            age_guidance = "Thông tin đầy đủ, chi tiết cho học sinh trung học phổ thông."
+        age_guidance = AGE_GUIDANCE_BUCKETS[get_age_bucket(age)][1]
         
         # Tạo system prompt với age context
         age_aware_system_prompt = f"""{SYSTEM_PROMPT}
@@ -175,9 +374,6 @@ Người dùng hiện tại {age} tuổi. {age_guidance}
         try:
             import re
             
-            # Tìm các pattern markdown image
-            image_pattern = r'!\[([^\]]*)\]\(([^)]+)\)'
-            
             def replace_image_path(match):
                 alt_text = match.group(1)
                 image_path = match.group(2)
@@ -218,9 +414,9 @@ Người dùng hiện tại {age} tuổi. {age_guidance}
                 return match.group(0)
             
             # Thay thế tất cả image links
-            processed_text = re.sub(image_pattern, replace_image_path, response_text)
+            processed_text = IMAGE_PATTERN.sub(replace_image_path, response_text)
             
-            logger.info(f"Processed {len(re.findall(image_pattern, response_text))} image links")
+            logger.debug(f"Processed {len(IMAGE_PATTERN.findall(response_text))} image links")
             return processed_text
             
         except Exception as e:
@@ -257,15 +453,14 @@ Hãy tạo các câu hỏi:
 Trả về danh sách câu hỏi, mỗi câu một dòng, không đánh số.
 """
             
-            response = self.gemini_model.generate_content(
-                follow_up_prompt,
-                generation_config=genai.types.GenerationConfig(
+            with timed("llm_follow_up"):
+                response_text = self.llm_backend.generate(
+                    follow_up_prompt,
                     temperature=0.7,
                     max_output_tokens=500
                 )
-            )
             
-            if not response or not response.text:
+            if not response_text:
                 return {
                     "success": False,
                     "error": "Không thể tạo câu hỏi gợi ý"
@@ -273,7 +468,7 @@ Trả về danh sách câu hỏi, mỗi câu một dòng, không đánh số.
             
             # Parse response thành list câu hỏi
             questions = []
-            lines = response.text.strip().split('\n')
+            lines = response_text.strip().split('\n')
             
             for line in lines:
                 line = line.strip()
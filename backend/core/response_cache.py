@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from utils.cache import LRUCache
+from utils.text import normalize_query
+from config import RESPONSE_CACHE_BACKEND, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, RESPONSE_CACHE_PATH
+
+# Cấu hình logging
+logger = logging.getLogger(__name__)
+
+# Global instance để implement singleton pattern
+_response_cache_instance = None
+
+def get_response_cache():
+    """
+    Singleton pattern để các RAGPipeline dùng chung một response cache
+    """
+    global _response_cache_instance
+    if _response_cache_instance is None:
+        logger.info(f"Khởi tạo ResponseCache với backend: {RESPONSE_CACHE_BACKEND}")
+        _response_cache_instance = ResponseCache(
+            backend=RESPONSE_CACHE_BACKEND,
+            maxsize=RESPONSE_CACHE_SIZE,
+            ttl=RESPONSE_CACHE_TTL,
+            path=RESPONSE_CACHE_PATH
+        )
+    return _response_cache_instance
+
+class MemoryCacheBackend:
+    """Backend lưu response trong bộ nhớ process"""
+
+    def __init__(self, maxsize, ttl):
+        self.cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value, version):
+        self.cache.set(key, value)
+
+    def invalidate(self, current_version):
+        # Version nằm trong key nên chỉ cần xóa để giải phóng bộ nhớ
+        self.cache.clear()
+
+    def get_stats(self):
+        return self.cache.get_stats()
+
+class SQLiteCacheBackend:
+    """Backend lưu response trong file SQLite, dùng chung giữa các worker"""
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl if ttl and ttl > 0 else None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS response_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    collection_version TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )"""
+            )
+            self._conn.commit()
+        logger.info(f"Đã mở SQLite response cache: {self.path}")
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM response_cache WHERE cache_key = ?", (key,)
+            ).fetchone()
+
+        if row is None or (self.ttl and row[1] + self.ttl <= time.time()):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return row[0]
+
+    def set(self, key, value, version):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (cache_key, value, collection_version, created_at) VALUES (?, ?, ?, ?)",
+                (key, value, version, time.time())
+            )
+            self._conn.commit()
+
+    def invalidate(self, current_version):
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM response_cache WHERE collection_version != ?", (current_version,)
+            )
+            if self.ttl:
+                self._conn.execute(
+                    "DELETE FROM response_cache WHERE created_at <= ?", (time.time() - self.ttl,)
+                )
+            self._conn.commit()
+        logger.info(f"Đã xóa {cursor.rowcount} response cũ khỏi SQLite cache")
+
+    def get_stats(self):
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "size": size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total > 0 else 0.0,
+            "path": self.path
+        }
+
+class ResponseCache:
+    """
+    Cache toàn bộ kết quả RAG (response + sources)
+
+    Key gồm câu hỏi đã chuẩn hóa, key độ tuổi, version của collection và
+    fingerprint của LLM backend sinh ra response, nên khi collection thay đổi
+    hoặc đổi LLM_BACKEND/model (vd: từ stub về Gemini) các response cũ tự động
+    không còn được dùng.
+    """
+
+    def __init__(self, backend="memory", maxsize=512, ttl=None, path=None):
+        self.enabled = backend != "none"
+        self._last_version = None
+        self._lock = threading.Lock()
+
+        if backend == "sqlite":
+            try:
+                self.backend = SQLiteCacheBackend(path, ttl)
+            except Exception as e:
+                logger.error(f"Lỗi mở SQLite cache, dùng cache bộ nhớ: {e}")
+                self.backend = MemoryCacheBackend(maxsize, ttl)
+        else:
+            self.backend = MemoryCacheBackend(maxsize, ttl)
+
+    @staticmethod
+    def make_key(query, age_key, collection_version, generator):
+        """Tạo key cache từ các thành phần (generator: LLMBackend.fingerprint)"""
+        raw = json.dumps([normalize_query(query), age_key, collection_version, generator], ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _check_version(self, collection_version):
+        """Dọn các response của version cũ khi collection thay đổi"""
+        with self._lock:
+            if self._last_version == collection_version:
+                return
+            previous = self._last_version
+            self._last_version = collection_version
+
+        if previous is not None:
+            logger.info(f"Collection version thay đổi ({previous} -> {collection_version}), invalidate response cache")
+            try:
+                self.backend.invalidate(collection_version)
+            except Exception as e:
+                logger.error(f"Lỗi invalidate response cache: {e}")
+
+    def get(self, query, age_key, collection_version, generator):
+        """
+        Lấy response đã cache
+
+        Returns:
+            dict hoặc None nếu không có trong cache
+        """
+        if not self.enabled:
+            return None
+
+        try:
+            self._check_version(collection_version)
+            value = self.backend.get(self.make_key(query, age_key, collection_version, generator))
+            return json.loads(value) if value is not None else None
+        except Exception as e:
+            logger.error(f"Lỗi đọc response cache: {e}")
+            return None
+
+    def set(self, query, age_key, collection_version, generator, response_data):
+        """Lưu response vào cache"""
+        if not self.enabled:
+            return
+
+        try:
+            self._check_version(collection_version)
+            value = json.dumps(response_data, ensure_ascii=False)
+            self.backend.set(self.make_key(query, age_key, collection_version, generator), value, collection_version)
+        except Exception as e:
+            logger.error(f"Lỗi ghi response cache: {e}")
+
+    def get_stats(self):
+        """Lấy thống kê response cache"""
+        if not self.enabled:
+            return {"enabled": False}
+
+        stats = self.backend.get_stats()
+        stats["enabled"] = True
+        stats["collection_version"] = self._last_version
+        return stats
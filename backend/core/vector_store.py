@@ -0,0 +1,246 @@
+import os
+import json
+import logging
+import tempfile
+import threading
+import numpy as np
+
+# Cấu hình logging
+logger = logging.getLogger(__name__)
+
+# Tên file của store
+EMBEDDINGS_FILE = "embeddings.npy"
+METADATA_FILE = "metadata.json"
+
+# Số bản ghi mỗi lần đọc từ ChromaDB khi rebuild
+REBUILD_BATCH_SIZE = 500
+
+class _StoreState:
+    """
+    Dữ liệu của một version store (không thay đổi sau khi tạo)
+
+    Mỗi lần load tạo một state mới và gán vào store bằng một lệnh duy nhất, nên
+    search đang chạy luôn thấy matrix, ids, metadata và mask tuổi của cùng một version.
+    """
+
+    __slots__ = ("version", "matrix", "ids", "documents", "metadatas", "age_min", "age_max", "_age_masks")
+
+    def __init__(self, version, matrix, ids, documents, metadatas):
+        self.version = version
+        self.matrix = matrix
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.age_min = np.array([m.get('age_min', 1) if m else 1 for m in metadatas], dtype=np.int16)
+        self.age_max = np.array([m.get('age_max', 19) if m else 19 for m in metadatas], dtype=np.int16)
+        self._age_masks = {}
+
+    def age_mask(self, age):
+        """Mask các vector phù hợp với độ tuổi, được tính một lần cho mỗi tuổi"""
+        mask = self._age_masks.get(age)
+        if mask is None:
+            mask = (self.age_min <= age) & (self.age_max >= age)
+            self._age_masks[age] = mask
+        return mask
+
+class NumpyVectorStore:
+    """
+    Vector store dạng ma trận float32 liên tục, lưu ra file .npy và đọc bằng memory-map
+
+    Với corpus vài trăm đến vài nghìn chunk, một phép nhân ma trận-vector trên
+    embeddings đã chuẩn hóa nhanh hơn nhiều so với một lượt query qua ChromaDB.
+    Store được build lại từ ChromaDB mỗi khi collection version thay đổi,
+    ChromaDB vẫn là nguồn dữ liệu gốc.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._embeddings_path = os.path.join(directory, EMBEDDINGS_FILE)
+        self._metadata_path = os.path.join(directory, METADATA_FILE)
+        self._lock = threading.Lock()
+
+        self._state = None
+
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def version(self):
+        state = self._state
+        return state.version if state is not None else None
+
+    def ensure_version(self, collection, version):
+        """
+        Đảm bảo store khớp với collection version, load từ file hoặc build lại nếu cần
+        """
+        state = self._state
+        if state is not None and state.version == version:
+            return
+
+        with self._lock:
+            state = self._state
+            if state is not None and state.version == version:
+                return
+
+            if not self._load(version):
+                self._rebuild(collection, version)
+                self._load(version)
+
+    def _load(self, version):
+        """Load store từ file nếu file đúng version"""
+        try:
+            with open(self._metadata_path, 'r', encoding='utf-8') as f:
+                sidecar = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        if sidecar.get("version") != version:
+            return False
+
+        try:
+            if sidecar["ids"]:
+                matrix = np.load(self._embeddings_path, mmap_mode='r')
+            else:
+                matrix = np.zeros((0, sidecar.get("dimension", 0)), dtype=np.float32)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Không đọc được embeddings của numpy store: {e}")
+            return False
+
+        state = _StoreState(version, matrix, sidecar["ids"], sidecar["documents"], sidecar["metadatas"])
+        self._state = state
+
+        logger.info(f"Đã load numpy store: {len(state.ids)} vectors (version {version})")
+        return True
+
+    def _rebuild(self, collection, version):
+        """Đọc toàn bộ embeddings từ ChromaDB và ghi ra file"""
+        logger.info(f"Đang build lại numpy store từ ChromaDB (version {version})")
+
+        ids, documents, metadatas, embeddings = [], [], [], []
+        total = collection.count()
+        for offset in range(0, total, REBUILD_BATCH_SIZE):
+            batch = collection.get(
+                limit=REBUILD_BATCH_SIZE,
+                offset=offset,
+                include=['embeddings', 'documents', 'metadatas']
+            )
+            ids.extend(batch['ids'])
+            documents.extend(batch['documents'])
+            metadatas.extend(m or {} for m in batch['metadatas'])
+            embeddings.extend(batch['embeddings'])
+
+        if embeddings:
+            matrix = np.asarray(embeddings, dtype=np.float32)
+            # Chuẩn hóa để dot product = cosine similarity
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            matrix = np.ascontiguousarray(matrix / norms, dtype=np.float32)
+
+            self._write_atomic(self._embeddings_path, 'wb', lambda f: np.save(f, matrix))
+            dimension = int(matrix.shape[1])
+        else:
+            dimension = 0
+
+        sidecar = {
+            "version": version,
+            "dimension": dimension,
+            "ids": ids,
+            "documents": documents,
+            "metadatas": metadatas
+        }
+        self._write_atomic(
+            self._metadata_path, 'w', lambda f: json.dump(sidecar, f, ensure_ascii=False), encoding='utf-8'
+        )
+
+        logger.info(f"Đã build numpy store với {len(ids)} vectors")
+
+    def _write_atomic(self, path, mode, write, encoding=None):
+        """
+        Ghi file qua một file tạm tên riêng rồi os.replace, để nhiều worker build
+        cùng lúc không ghi đè file tạm của nhau
+        """
+        tmp = tempfile.NamedTemporaryFile(
+            mode, encoding=encoding, dir=self.directory,
+            prefix=f"{os.path.basename(path)}.", suffix=".tmp", delete=False
+        )
+        try:
+            with tmp:
+                write(tmp)
+            # NamedTemporaryFile tạo file 0600, giữ quyền đọc cho worker chạy bằng user khác như trước
+            os.chmod(tmp.name, 0o644)
+            os.replace(tmp.name, path)
+        except BaseException:
+            try:
+                os.unlink(tmp.name)
+            except OSError:
+                pass
+            raise
+
+    def search(self, query_embedding, top_k=5, age_filter=None):
+        """
+        Tìm top-k chính xác bằng dot product
+
+        Returns:
+            list: Kết quả cùng format với EmbeddingModel.search
+        """
+        return self.search_many([query_embedding], top_k=top_k, age_filter=age_filter)[0]
+
+    def search_many(self, query_embeddings, top_k=5, age_filter=None):
+        """
+        Tìm top-k cho nhiều embedding bằng một phép nhân ma trận
+
+        Returns:
+            list: Danh sách kết quả tương ứng với từng embedding
+        """
+        # Đọc state một lần để cả lượt search dùng cùng một version
+        state = self._state
+        if state is None or state.matrix.shape[0] == 0:
+            return [[] for _ in query_embeddings]
+        matrix = state.matrix
+
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        scores = queries @ matrix.T
+
+        if age_filter:
+            mask = state.age_mask(age_filter)
+            scores = np.where(mask, scores, -np.inf)
+            available = int(mask.sum())
+        else:
+            available = matrix.shape[0]
+
+        k = min(top_k, available)
+        if k <= 0:
+            return [[] for _ in query_embeddings]
+
+        if k < matrix.shape[0]:
+            top_indices = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top_indices = np.tile(np.arange(matrix.shape[0]), (scores.shape[0], 1))
+
+        all_results = []
+        for row_scores, row_indices in zip(scores, top_indices):
+            row_indices = row_indices[np.argsort(-row_scores[row_indices])]
+            results = []
+            for rank, index in enumerate(row_indices):
+                similarity = float(row_scores[index])
+                results.append({
+                    'id': state.ids[index],
+                    'document': state.documents[index],
+                    'metadata': state.metadatas[index] or {},
+                    'distance': 1 - similarity,
+                    'similarity': similarity,
+                    'rank': rank + 1
+                })
+            all_results.append(results)
+        return all_results
+
+    def get_stats(self):
+        """Lấy thông tin store"""
+        state = self._state
+        if state is None:
+            return {"version": None, "vectors": 0, "dimension": 0, "directory": self.directory}
+        return {
+            "version": state.version,
+            "vectors": len(state.ids),
+            "dimension": int(state.matrix.shape[1]) if state.matrix.ndim == 2 else 0,
+            "directory": self.directory
+        }
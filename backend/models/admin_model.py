@@ -5,6 +5,7 @@ from bson.objectid import ObjectId
 import bcrypt
 import logging
 from dotenv import load_dotenv
+from utils.metrics import mongo_event_listeners
 
 # Cấu hình logging
 logger = logging.getLogger(__name__)
@@ -25,7 +26,7 @@ def get_db():
     global _mongo_client, _db
     if _mongo_client is None:
         try:
-            _mongo_client = MongoClient(MONGO_URI)
+            _mongo_client = MongoClient(MONGO_URI, event_listeners=mongo_event_listeners())
             _db = _mongo_client[DATABASE_NAME]
             logger.info(f"Đã kết nối đến database: {DATABASE_NAME}")
         except Exception as e:
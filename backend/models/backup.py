@@ -0,0 +1,467 @@
+import os
+import io
+import gzip
+import json
+import time
+import logging
+import datetime
+import threading
+from bson import json_util
+from pymongo import ASCENDING, ReplaceOne, UpdateOne
+from models.conversation_model import get_db
+from config import BACKUP_DIRECTORY, BACKUP_COMPRESSION, BACKUP_BATCH_SIZE, BACKUP_INCLUDE_PASSWORD_HASHES
+
+# Cấu hình logging
+logger = logging.getLogger(__name__)
+
+# Các collection được backup và field dùng làm watermark cho backup incremental
+BACKUP_COLLECTIONS = {
+    "users": "updated_at",
+    "admins": "updated_at",
+    "conversations": "updated_at",
+    "feedback": "updated_at",
+    "user_daily_activity": "updated_at",
+    "daily_rollups": "updated_at"
+}
+
+# Các field không được ghi vào backup (hash mật khẩu nếu BACKUP_INCLUDE_PASSWORD_HASHES=false)
+EXCLUDED_FIELDS = {} if BACKUP_INCLUDE_PASSWORD_HASHES else {"users": ["password"], "admins": ["password"]}
+
+FILE_EXTENSIONS = {"gzip": ".ndjson.gz", "zstd": ".ndjson.zst"}
+# Backup chứa toàn bộ dữ liệu người dùng (và có thể cả hash mật khẩu): chỉ user chạy app đọc được
+DIRECTORY_MODE = 0o700
+FILE_MODE = 0o600
+MANIFEST_FILE = "manifest.json"
+# Ghi lại manifest (tiến độ) tối đa mỗi khoảng thời gian này trong lúc backup (giây)
+PROGRESS_SAVE_INTERVAL = 2.0
+
+# Extended JSON dạng canonical giữ nguyên kiểu BSON (ObjectId, datetime, Int64...) khi restore
+JSON_OPTIONS = json_util.CANONICAL_JSON_OPTIONS
+
+def _import_zstandard():
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        raise RuntimeError("Nén zstd cần package zstandard (pip install zstandard)")
+
+def _create_private(path):
+    """Tạo file rỗng với quyền FILE_MODE (không phụ thuộc umask), mở lại để ghi vẫn giữ quyền này"""
+    os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, FILE_MODE))
+    os.chmod(path, FILE_MODE)
+
+def open_backup_writer(path, compression):
+    """File nén để ghi NDJSON (bytes)"""
+    _create_private(path)
+    if compression == "zstd":
+        zstandard = _import_zstandard()
+        return zstandard.ZstdCompressor(level=3).stream_writer(open(path, 'wb'))
+    return gzip.open(path, 'wb', compresslevel=6)
+
+def open_backup_reader(path):
+    """Đọc NDJSON từ file nén theo stream (chọn cách giải nén theo đuôi file)"""
+    if path.endswith(".zst"):
+        zstandard = _import_zstandard()
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb')))
+    return gzip.open(path, 'rb')
+
+def _parse_watermark(value):
+    return datetime.datetime.fromisoformat(value) if value else None
+
+class BackupManager:
+    """
+    Backup các collection MongoDB ra NDJSON nén (gzip hoặc zstd) theo stream và restore lại
+
+    Mỗi lần backup là một thư mục trong `directory` gồm một file cho mỗi collection và manifest.json
+    (trạng thái, tiến độ, số document, watermark). Document được đọc bằng cursor theo batch và ghi
+    từng dòng, nên bộ nhớ không phụ thuộc kích thước collection.
+
+    Backup incremental chỉ ghi các document có updated_at >= watermark của lần backup thành công
+    gần nhất (document bị xóa không được ghi nhận). Restore áp dụng lần lượt backup full và
+    các backup incremental nối tiếp nó.
+    """
+
+    def __init__(self, directory=BACKUP_DIRECTORY, db=None):
+        """
+        Args:
+            directory (str): Thư mục chứa các backup
+            db: Database cần backup (mặc định là database của app)
+        """
+        self.directory = directory
+        self.db = db
+        self._job_lock = threading.Lock()
+        self._current = None
+        self._thread = None
+
+    # ---------- Manifest ----------
+
+    def _backup_path(self, backup_id):
+        if not backup_id or os.path.basename(backup_id) != backup_id or backup_id.startswith("."):
+            raise ValueError("Backup ID không hợp lệ")
+        return os.path.join(self.directory, backup_id)
+
+    def _save_manifest(self, manifest):
+        path = os.path.join(self._backup_path(manifest["backup_id"]), MANIFEST_FILE)
+        tmp_path = f"{path}.tmp"
+        _create_private(tmp_path)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    def get_manifest(self, backup_id):
+        """Manifest của một backup, None nếu không tồn tại"""
+        path = os.path.join(self._backup_path(backup_id), MANIFEST_FILE)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def list_backups(self):
+        """Danh sách manifest, mới nhất trước"""
+        if not os.path.isdir(self.directory):
+            return []
+        manifests = []
+        for name in os.listdir(self.directory):
+            if os.path.isdir(os.path.join(self.directory, name)):
+                manifest = self.get_manifest(name)
+                if manifest:
+                    manifests.append(manifest)
+        manifests.sort(key=lambda manifest: manifest["started_at"], reverse=True)
+        return manifests
+
+    def latest_completed(self):
+        for manifest in self.list_backups():
+            if manifest["status"] == "completed":
+                return manifest
+        return None
+
+    def resolve_chain(self, backup_id):
+        """Chuỗi backup cần áp dụng để restore: backup full rồi tới các incremental, theo thứ tự thời gian"""
+        chain = []
+        current = backup_id
+        while current:
+            manifest = self.get_manifest(current)
+            if manifest is None:
+                raise ValueError(f"Không tìm thấy backup {current}")
+            if manifest["status"] != "completed":
+                raise ValueError(f"Backup {current} chưa hoàn tất (trạng thái: {manifest['status']})")
+            chain.append(manifest)
+            current = manifest.get("base_backup_id")
+        chain.reverse()
+        return chain
+
+    # ---------- Backup ----------
+
+    def start_backup(self, incremental=False, compression=None):
+        """
+        Chạy backup trong thread nền
+
+        Returns:
+            tuple: (True, manifest ban đầu) hoặc (False, thông báo lỗi nếu đang có backup chạy)
+        """
+        if not self._job_lock.acquire(blocking=False):
+            return False, "Đang có một backup chạy"
+        try:
+            manifest = self._prepare_backup(incremental, compression or BACKUP_COMPRESSION)
+        except Exception:
+            self._job_lock.release()
+            raise
+
+        def run():
+            try:
+                self._run_backup(manifest)
+            except Exception as e:
+                logger.error(f"Lỗi backup {manifest['backup_id']}: {e}")
+            finally:
+                self._job_lock.release()
+
+        self._thread = threading.Thread(target=run, name="mongo-backup", daemon=True)
+        self._thread.start()
+        return True, manifest
+
+    def run_backup(self, incremental=False, compression=None):
+        """Chạy backup ngay trong thread hiện tại (dùng cho script), trả về manifest khi xong"""
+        with self._job_lock:
+            manifest = self._prepare_backup(incremental, compression or BACKUP_COMPRESSION)
+            return self._run_backup(manifest)
+
+    def get_status(self):
+        """Manifest của backup đang chạy (hoặc lần chạy gần nhất trong process này)"""
+        return self._current
+
+    def _prepare_backup(self, incremental, compression):
+        if compression not in FILE_EXTENSIONS:
+            raise ValueError(f"Kiểu nén không hợp lệ: {compression}")
+        if compression == "zstd":
+            _import_zstandard()
+
+        base = self.latest_completed() if incremental else None
+        if incremental and base is None:
+            logger.warning("Chưa có backup nào hoàn tất, chuyển sang backup full")
+
+        started_at = datetime.datetime.now()
+        backup_type = "incremental" if base else "full"
+        backup_id = f"{started_at:%Y%m%d_%H%M%S}_{backup_type}"
+        suffix = 1
+        while os.path.exists(self._backup_path(backup_id)):
+            # Hai backup trong cùng một giây
+            suffix += 1
+            backup_id = f"{started_at:%Y%m%d_%H%M%S}_{backup_type}_{suffix}"
+        os.makedirs(self.directory, mode=DIRECTORY_MODE, exist_ok=True)
+        os.chmod(self.directory, DIRECTORY_MODE)
+        os.makedirs(self._backup_path(backup_id), mode=DIRECTORY_MODE)
+        os.chmod(self._backup_path(backup_id), DIRECTORY_MODE)
+
+        manifest = {
+            "backup_id": backup_id,
+            "type": backup_type,
+            "base_backup_id": base["backup_id"] if base else None,
+            "format": "ndjson",
+            "compression": compression,
+            "status": "running",
+            "started_at": started_at.isoformat(),
+            "finished_at": None,
+            "documents": 0,
+            "total_estimate": 0,
+            "progress": 0.0,
+            "error": None,
+            "collections": {}
+        }
+        for name, field in BACKUP_COLLECTIONS.items():
+            since = base["collections"].get(name, {}).get("watermark") if base else None
+            manifest["collections"][name] = {
+                "file": f"{name}{FILE_EXTENSIONS[compression]}",
+                "watermark_field": field,
+                "since": since,
+                "watermark": since,
+                "excluded_fields": EXCLUDED_FIELDS.get(name, []),
+                "status": "pending",
+                "documents": 0,
+                "total_estimate": 0,
+                "bytes": 0,
+                "compressed_bytes": 0
+            }
+        self._current = manifest
+        self._save_manifest(manifest)
+        return manifest
+
+    def _get_db(self):
+        return self.db if self.db is not None else get_db()
+
+    def _run_backup(self, manifest):
+        db = self._get_db()
+        path = self._backup_path(manifest["backup_id"])
+        started = time.monotonic()
+        try:
+            # Ước lượng tổng số document trước để tính tiến độ
+            for name, info in manifest["collections"].items():
+                query = self._build_query(info)
+                info["total_estimate"] = db[name].count_documents(query) if query else db[name].estimated_document_count()
+            manifest["total_estimate"] = sum(info["total_estimate"] for info in manifest["collections"].values())
+            self._save_manifest(manifest)
+
+            for name, info in manifest["collections"].items():
+                self._backup_collection(db[name], info, manifest, os.path.join(path, info["file"]))
+
+            manifest["status"] = "completed"
+            manifest["progress"] = 100.0
+            logger.info(
+                f"Backup {manifest['backup_id']} hoàn tất: {manifest['documents']} documents "
+                f"trong {time.monotonic() - started:.1f}s"
+            )
+        except Exception as e:
+            manifest["status"] = "failed"
+            manifest["error"] = str(e)
+            raise
+        finally:
+            manifest["finished_at"] = datetime.datetime.now().isoformat()
+            manifest["duration_seconds"] = round(time.monotonic() - started, 2)
+            self._save_manifest(manifest)
+        return manifest
+
+    @staticmethod
+    def _build_query(info):
+        since = _parse_watermark(info["since"])
+        return {info["watermark_field"]: {"$gte": since}} if since else {}
+
+    def _backup_collection(self, collection, info, manifest, file_path):
+        """Ghi một collection ra file NDJSON nén, sort theo watermark field để watermark không bỏ sót document"""
+        field = info["watermark_field"]
+        projection = {name: 0 for name in info["excluded_fields"]} or None
+        watermark = _parse_watermark(info["since"])
+        info["status"] = "running"
+        last_save = time.monotonic()
+
+        cursor = collection.find(self._build_query(info), projection).sort(field, ASCENDING).batch_size(BACKUP_BATCH_SIZE)
+        with open_backup_writer(file_path, manifest["compression"]) as out:
+            for document in cursor:
+                line = json_util.dumps(document, json_options=JSON_OPTIONS).encode("utf-8") + b"\n"
+                out.write(line)
+                info["documents"] += 1
+                info["bytes"] += len(line)
+                manifest["documents"] += 1
+
+                value = document.get(field)
+                if isinstance(value, datetime.datetime) and (watermark is None or value > watermark):
+                    watermark = value
+
+                if time.monotonic() - last_save >= PROGRESS_SAVE_INTERVAL:
+                    self._update_progress(manifest)
+                    last_save = time.monotonic()
+
+        info["watermark"] = watermark.isoformat() if watermark else None
+        info["compressed_bytes"] = os.path.getsize(file_path)
+        info["status"] = "completed"
+        self._update_progress(manifest)
+        logger.info(f"Đã backup {collection.name}: {info['documents']} documents, {info['compressed_bytes']} bytes")
+
+    def _update_progress(self, manifest):
+        if manifest["total_estimate"]:
+            manifest["progress"] = round(min(100.0, manifest["documents"] * 100.0 / manifest["total_estimate"]), 1)
+        self._save_manifest(manifest)
+
+    # ---------- Restore ----------
+
+    def restore(self, backup_id, db=None, drop=False, chain=True, collections=None, batch_size=BACKUP_BATCH_SIZE):
+        """
+        Restore một backup (mặc định gồm cả backup full và các incremental trước nó) bằng bulk write
+
+        Args:
+            db: Database đích (mặc định là database của app)
+            drop (bool): Xóa collection đích trước khi restore, chỉ dùng được khi chuỗi bắt đầu bằng backup full
+                (khi đó backup full được ghi bằng insert_many, sau đó tạo lại indexes)
+            chain (bool): False để chỉ áp dụng đúng backup_id
+            collections (list): Chỉ restore các collection này
+
+        Returns:
+            dict: Số document đã ghi theo collection và theo từng backup
+        """
+        manifests = self.resolve_chain(backup_id) if chain else [self.get_manifest(backup_id)]
+        if manifests[0] is None:
+            raise ValueError(f"Không tìm thấy backup {backup_id}")
+        if drop and manifests[0]["type"] != "full":
+            raise ValueError("Chỉ được xóa collection đích khi restore từ một backup full")
+
+        target_db = db if db is not None else self._get_db()
+        names = collections or list(manifests[-1]["collections"])
+        unknown = [name for name in names if name not in BACKUP_COLLECTIONS]
+        if unknown:
+            raise ValueError(f"Collection không có trong backup: {', '.join(unknown)}")
+
+        if drop:
+            for name in names:
+                target_db[name].drop()
+
+        result = {"backups": [], "collections": {name: 0 for name in names}}
+        started = time.monotonic()
+        for index, manifest in enumerate(manifests):
+            applied = {}
+            for name in names:
+                info = manifest["collections"].get(name)
+                if not info:
+                    continue
+                file_path = os.path.join(self._backup_path(manifest["backup_id"]), info["file"])
+                count = self._restore_file(
+                    target_db[name], file_path, batch_size,
+                    insert_only=drop and index == 0,
+                    keep_fields=bool(info.get("excluded_fields"))
+                )
+                applied[name] = count
+                result["collections"][name] += count
+            result["backups"].append({"backup_id": manifest["backup_id"], "type": manifest["type"], "documents": applied})
+            logger.info(f"Đã áp dụng backup {manifest['backup_id']}: {sum(applied.values())} documents")
+
+        if drop:
+            from models.indexes import ensure_indexes
+            ensure_indexes(target_db)
+            excluded = {
+                name: manifests[0]["collections"][name]["excluded_fields"] for name in names
+                if manifests[0]["collections"].get(name, {}).get("excluded_fields")
+            }
+            if excluded:
+                logger.warning(
+                    f"Backup không chứa các field {excluded} (BACKUP_INCLUDE_PASSWORD_HASHES=false), "
+                    f"các tài khoản được restore cần đặt lại mật khẩu"
+                )
+
+        result["duration_seconds"] = round(time.monotonic() - started, 2)
+        return result
+
+    @staticmethod
+    def _restore_file(collection, file_path, batch_size, insert_only=False, keep_fields=False):
+        """
+        Đọc file backup theo stream và ghi theo batch
+
+        insert_only: collection đích rỗng, dùng insert_many
+        keep_fields: backup không có một số field (vd: password), dùng $set để giữ giá trị hiện có
+        """
+        count = 0
+        batch = []
+
+        def flush():
+            if not batch:
+                return
+            if insert_only:
+                collection.insert_many(batch, ordered=False)
+            elif keep_fields:
+                collection.bulk_write([
+                    UpdateOne({"_id": document["_id"]}, {"$set": {k: v for k, v in document.items() if k != "_id"}}, upsert=True)
+                    for document in batch
+                ], ordered=False)
+            else:
+                collection.bulk_write([
+                    ReplaceOne({"_id": document["_id"]}, document, upsert=True) for document in batch
+                ], ordered=False)
+            batch.clear()
+
+        with open_backup_reader(file_path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                batch.append(json_util.loads(line, json_options=JSON_OPTIONS))
+                count += 1
+                if len(batch) >= batch_size:
+                    flush()
+            flush()
+        return count
+
+    def verify(self, backup_id):
+        """
+        Đọc lại toàn bộ file của một backup và so số document với manifest
+
+        Returns:
+            dict: ok và số document đọc được theo collection
+        """
+        manifest = self.get_manifest(backup_id)
+        if manifest is None:
+            raise ValueError(f"Không tìm thấy backup {backup_id}")
+
+        collections = {}
+        ok = manifest["status"] == "completed"
+        for name, info in manifest["collections"].items():
+            file_path = os.path.join(self._backup_path(backup_id), info["file"])
+            count = 0
+            error = None
+            try:
+                with open_backup_reader(file_path) as f:
+                    for line in f:
+                        if line.strip():
+                            json_util.loads(line, json_options=JSON_OPTIONS)
+                            count += 1
+            except Exception as e:
+                error = str(e)
+            matches = error is None and count == info["documents"]
+            ok = ok and matches
+            collections[name] = {"expected": info["documents"], "read": count, "ok": matches, "error": error}
+        return {"backup_id": backup_id, "ok": ok, "collections": collections}
+
+# Global instance để implement singleton pattern
+_backup_manager_instance = None
+
+def get_backup_manager():
+    """Singleton pattern để mỗi process chỉ chạy một backup tại một thời điểm"""
+    global _backup_manager_instance
+    if _backup_manager_instance is None:
+        _backup_manager_instance = BackupManager()
+    return _backup_manager_instance
@@ -4,7 +4,10 @@ from bson.objectid import ObjectId
 import logging
 from pymongo import MongoClient, DESCENDING
 from dotenv import load_dotenv
+from utils.metrics import mongo_event_listeners
+from utils.tracing import span
 import copy
+from utils.text import tokenize, build_highlighted_preview, find_token_spans
 
 # Cấu hình logging
 logger = logging.getLogger(__name__)
@@ -25,7 +28,7 @@ def get_db():
     global _mongo_client, _db
     if _mongo_client is None:
         try:
-            _mongo_client = MongoClient(MONGO_URI)
+            _mongo_client = MongoClient(MONGO_URI, event_listeners=mongo_event_listeners())
             _db = _mongo_client[DATABASE_NAME]
             logger.info(f"Đã kết nối đến database: {DATABASE_NAME}")
         except Exception as e:
@@ -65,10 +68,139 @@ def safe_datetime(timestamp_obj):
     
     return datetime.datetime.now()
 
+# Phiên bản cấu trúc lưu messages trong document
+# 1: mỗi message chứa versions, mỗi version chứa snapshot following_messages
+# 2: các message là node của một cây (parent_id), active_children trỏ tới nhánh đang hiển thị
+SCHEMA_VERSION = 2
+
+# Key trong active_children cho các message không có parent
+ROOT_KEY = "root"
+
+# Độ dài tối đa của last_message_preview
+MESSAGE_PREVIEW_LENGTH = 100
+
+# Số tin nhắn của conversation, document chưa có field tóm tắt (trước khi migrate) được tính tạm từ messages
+MESSAGE_COUNT_EXPRESSION = {"$ifNull": ["$message_count", {"$size": {"$ifNull": ["$messages", []]}}]}
+
+# Projection cho danh sách conversation: chỉ đọc các field tóm tắt, không trả về messages
+SUMMARY_PROJECTION = {
+    "title": 1,
+    "created_at": 1,
+    "updated_at": 1,
+    "age_context": 1,
+    "is_archived": 1,
+    "last_message_preview": 1,
+    "message_count": MESSAGE_COUNT_EXPRESSION,
+    "last_message_at": {"$ifNull": ["$last_message_at", {"$arrayElemAt": ["$messages.timestamp", -1]}]},
+    "legacy_last_message": {
+        "$cond": [
+            {"$eq": [{"$type": "$last_message_preview"}, "missing"]},
+            {"$arrayElemAt": ["$messages.content", -1]},
+            "$$REMOVE"
+        ]
+    }
+}
+
+# Projection đủ để dựng lại nhánh active (không đọc nội dung tin nhắn), dùng cho các bộ đếm khi xóa/rebuild
+ACTIVE_PATH_PROJECTION = {
+    "user_id": 1,
+    "created_at": 1,
+    "schema_version": 1,
+    "active_children": 1,
+    "messages._id": 1,
+    "messages.parent_id": 1,
+    "messages.timestamp": 1,
+    "messages.current_version": 1,
+    "messages.versions.timestamp": 1
+}
+
+# Projection cho bước xếp hạng kết quả tìm kiếm (không đọc messages)
+SEARCH_RANK_FIELDS = {"updated_at": 1, "title_tokens": 1}
+
+def build_message_preview(content, max_length=MESSAGE_PREVIEW_LENGTH):
+    """Cắt ngắn nội dung tin nhắn để hiển thị xem trước"""
+    content = content or ""
+    return content[:max_length] + "..." if len(content) > max_length else content
+
+def parent_key(parent_id):
+    """Key trong active_children cho các node con của parent_id"""
+    return ROOT_KEY if parent_id is None else str(parent_id)
+
+def make_message_node(role, content, parent_id=None, timestamp=None, sources=None, metadata=None, node_id=None):
+    """Tạo node message (schema 2)"""
+    node = {
+        "_id": node_id or ObjectId(),
+        "role": role,
+        "content": content,
+        "timestamp": safe_datetime(timestamp),
+        "parent_id": parent_id
+    }
+    if sources:
+        node["sources"] = sources
+    if metadata:
+        node["metadata"] = metadata
+    return node
+
+def convert_legacy_messages(messages):
+    """
+    Chuyển messages dạng cũ (schema 1) sang cây node
+    
+    Version đang chọn của mỗi message giữ nguyên _id, các message phía sau nó là nhánh con.
+    Các version khác được tạo _id mới, snapshot following_messages của chúng trở thành nhánh con.
+    
+    Returns:
+        tuple: (nodes, active_children)
+    """
+    nodes = []
+    active_children = {}
+    pending = [(list(messages or []), None)]
+    
+    while pending:
+        chain, parent_id = pending.pop()
+        if not chain:
+            continue
+        
+        message, rest = chain[0], chain[1:]
+        versions = message.get("versions") or [{
+            "version": 1,
+            "content": message.get("content", ""),
+            "timestamp": message.get("timestamp")
+        }]
+        current_version = message.get("current_version", 1)
+        if not 1 <= current_version <= len(versions):
+            current_version = len(versions)
+        
+        for number, version in enumerate(versions, start=1):
+            if number == current_version:
+                node = make_message_node(
+                    message.get("role", "user"),
+                    message.get("content", version.get("content", "")),
+                    parent_id,
+                    timestamp=version.get("timestamp", message.get("timestamp")),
+                    sources=message.get("sources"),
+                    metadata=message.get("metadata"),
+                    node_id=message.get("_id")
+                )
+                active_children[parent_key(parent_id)] = node["_id"]
+                pending.append((rest, node["_id"]))
+            else:
+                node = make_message_node(
+                    message.get("role", "user"),
+                    version.get("content", ""),
+                    parent_id,
+                    timestamp=version.get("timestamp"),
+                    sources=version.get("sources"),
+                    metadata=version.get("metadata")
+                )
+                pending.append((list(version.get("following_messages") or []), node["_id"]))
+            nodes.append(node)
+    
+    return nodes, active_children
+
 class Conversation:
     def __init__(self, user_id=None, title="Cuộc trò chuyện mới", age_context=None,
                  created_at=None, updated_at=None, is_archived=False, messages=None,
-                 conversation_id=None):
+                 conversation_id=None, active_children=None, schema_version=SCHEMA_VERSION):
         self.conversation_id = conversation_id
         self.user_id = user_id
         self.title = title
@@ -76,7 +208,17 @@ class Conversation:
         self.created_at = safe_datetime(created_at)
         self.updated_at = safe_datetime(updated_at)
         self.is_archived = is_archived
-        self.messages = messages or []
+        
+        if schema_version == SCHEMA_VERSION:
+            self.nodes = list(messages or [])
+            self.active_children = dict(active_children or {})
+        else:
+            # Document dạng cũ: chuyển trong bộ nhớ, lần ghi đầu tiên sẽ ghi lại toàn bộ theo schema mới
+            self.nodes, self.active_children = convert_legacy_messages(messages)
+        self._needs_migration = schema_version != SCHEMA_VERSION
+        # Thời điểm ghi gần nhất, dùng để đếm conversation được cập nhật trong ngày (daily_rollups)
+        self._last_write_at = self.updated_at
+        self._reindex()
 
     @classmethod
     def create(cls, user_id, title="Cuộc trò chuyện mới", age_context=None):
@@ -101,111 +243,93 @@ class Conversation:
             logger.error(f"Error creating conversation: {e}")
             raise
 
-    def serialize_message_for_following(self, message):
-        """Serialize message để lưu vào following_messages"""
-        serialized = {
-            "role": message["role"],
-            "content": message["content"],
-            "timestamp": safe_datetime(message.get("timestamp")),
-            "current_version": message.get("current_version", 1),
-            "is_edited": message.get("is_edited", False)
-        }
-        
-        if "sources" in message:
-            serialized["sources"] = message["sources"]
-        if "metadata" in message:
-            serialized["metadata"] = message["metadata"]
-        
-        # Serialize versions
-        if "versions" in message and message["versions"]:
-            serialized["versions"] = []
-            for version in message["versions"]:
-                version_data = {
-                    "version": version["version"],
-                    "content": version["content"],
-                    "timestamp": safe_datetime(version.get("timestamp")),
-                    "following_messages": version.get("following_messages", [])
-                }
-                if "sources" in version:
-                    version_data["sources"] = version["sources"]
-                if "metadata" in version:
-                    version_data["metadata"] = version["metadata"]
-                serialized["versions"].append(version_data)
-        
-        return serialized
-
-    def deserialize_message_from_following(self, serialized_message):
-        """Deserialize message từ following_messages"""
-        message = {
-            "_id": ObjectId(),
-            "role": serialized_message["role"],
-            "content": serialized_message["content"],
-            "timestamp": safe_datetime(serialized_message.get("timestamp")),
-            "current_version": serialized_message.get("current_version", 1),
-            "is_edited": serialized_message.get("is_edited", False)
-        }
-        
-        if "sources" in serialized_message:
-            message["sources"] = serialized_message["sources"]
-        if "metadata" in serialized_message:
-            message["metadata"] = serialized_message["metadata"]
-        
-        # Deserialize versions
-        if "versions" in serialized_message and serialized_message["versions"]:
-            message["versions"] = []
-            for version_data in serialized_message["versions"]:
-                version = {
-                    "version": version_data["version"],
-                    "content": version_data["content"],
-                    "timestamp": safe_datetime(version_data.get("timestamp")),
-                    "following_messages": version_data.get("following_messages", [])
-                }
-                if "sources" in version_data:
-                    version["sources"] = version_data["sources"]
-                if "metadata" in version_data:
-                    version["metadata"] = version_data["metadata"]
-                message["versions"].append(version)
-        else:
-            # Tạo version mặc định
-            message["versions"] = [{
-                "version": 1,
-                "content": message["content"],
-                "timestamp": message["timestamp"],
-                "following_messages": []
-            }]
-            if "sources" in message:
-                message["versions"][0]["sources"] = message["sources"]
-            if "metadata" in message:
-                message["versions"][0]["metadata"] = message["metadata"]
-        
-        return message
+    def _reindex(self):
+        """Build lại map id -> vị trí node và danh sách node con theo parent"""
+        self._node_index = {}
+        self._children = {}
+        for index, node in enumerate(self.nodes):
+            self._node_index[str(node["_id"])] = index
+            self._children.setdefault(parent_key(node.get("parent_id")), []).append(node["_id"])
+        self._messages_view = None
+
+    def _append_node(self, node):
+        self._node_index[str(node["_id"])] = len(self.nodes)
+        self.nodes.append(node)
+        self._children.setdefault(parent_key(node.get("parent_id")), []).append(node["_id"])
+        self._messages_view = None
+
+    def get_node(self, message_id):
+        """Tìm node theo id (bất kể thuộc nhánh nào)"""
+        index = self._node_index.get(str(message_id))
+        return None if index is None else self.nodes[index]
 
-    def capture_following_messages(self, from_message_index):
-        """Capture tất cả messages sau from_message_index"""
-        following_messages = []
+    def _active_child(self, key):
+        """Node con đang active của một parent (mặc định là node con mới nhất)"""
+        children = self._children.get(key)
+        if not children:
+            return None
         
-        for i in range(from_message_index + 1, len(self.messages)):
-            message = self.messages[i]
-            serialized = self.serialize_message_for_following(message)
-            following_messages.append(serialized)
+        active_id = self.active_children.get(key)
+        node = self.get_node(active_id) if active_id is not None else None
+        return node or self.get_node(children[-1])
+
+    def get_active_path(self):
+        """Các node trên nhánh đang hiển thị, từ tin nhắn đầu tiên tới tin nhắn cuối"""
+        path = []
+        node = self._active_child(ROOT_KEY)
+        while node is not None:
+            path.append(node)
+            node = self._active_child(str(node["_id"]))
+        return path
+
+    def _record_path_change(self, previous_path):
+        """Cập nhật user_daily_activity theo các tin nhắn rời khỏi/vào nhánh active so với previous_path"""
+        path = self.get_active_path()
+        previous_ids = {node["_id"] for node in previous_path}
+        current_ids = {node["_id"] for node in path}
         
-        logger.info(f"Captured {len(following_messages)} following messages from index {from_message_index}")
-        return following_messages
+        from models.user_activity_model import record_path_change
+        record_path_change(
+            self.user_id,
+            removed=[node for node in previous_path if node["_id"] not in current_ids],
+            added=[node for node in path if node["_id"] not in previous_ids]
+        )
 
-    def restore_following_messages(self, target_message_index, following_messages):
-        """Restore following messages sau target_message_index"""
-        # Cắt conversation tại target message
-        self.messages = self.messages[:target_message_index + 1]
+    def _build_message_view(self, node):
+        """Message theo format cũ (kèm versions) từ node, các node anh em là các version"""
+        siblings = self._children.get(parent_key(node.get("parent_id")), [node["_id"]])
         
-        # Restore messages
-        restored_count = 0
-        for serialized_message in following_messages:
-            message = self.deserialize_message_from_following(serialized_message)
-            self.messages.append(message)
-            restored_count += 1
+        versions = []
+        current_version = 1
+        for number, sibling_id in enumerate(siblings, start=1):
+            sibling = self.get_node(sibling_id)
+            version = {
+                "version": number,
+                "content": sibling["content"],
+                "timestamp": sibling.get("timestamp")
+            }
+            if "sources" in sibling:
+                version["sources"] = sibling["sources"]
+            if "metadata" in sibling:
+                version["metadata"] = sibling["metadata"]
+            versions.append(version)
+            
+            if sibling_id == node["_id"]:
+                current_version = number
         
-        logger.info(f"Restored {restored_count} following messages after index {target_message_index}")
-        return restored_count
+        message = dict(node)
+        message["parent_message_id"] = node.get("parent_id")
+        message["versions"] = versions
+        message["current_version"] = current_version
+        message["is_edited"] = len(versions) > 1
+        return message
+
+    @property
+    def messages(self):
+        """Danh sách message trên nhánh đang active (chỉ đọc)"""
+        if self._messages_view is None:
+            self._messages_view = [self._build_message_view(node) for node in self.get_active_path()]
+        return self._messages_view
 
     def to_dict(self):
         """Convert conversation object sang dictionary cho JSON serialization"""
@@ -282,9 +406,55 @@ class Conversation:
             created_at=conversation_dict.get("created_at"),
             updated_at=conversation_dict.get("updated_at"),
             is_archived=conversation_dict.get("is_archived", False),
-            messages=conversation_dict.get("messages", [])
+            messages=conversation_dict.get("messages", []),
+            active_children=conversation_dict.get("active_children"),
+            schema_version=conversation_dict.get("schema_version")
         )
 
+    def _serialize_message(self, node):
+        """Chuẩn hóa node trước khi ghi vào database"""
+        node_copy = node.copy()
+        node_copy["timestamp"] = safe_datetime(node_copy.get("timestamp"))
+        return node_copy
+
+    def build_summary_fields(self):
+        """Các field tóm tắt lưu kèm document để danh sách conversation không cần đọc messages"""
+        path = self.get_active_path()
+        last_message = path[-1] if path else None
+        return {
+            "message_count": len(path),
+            "last_message_preview": build_message_preview(last_message["content"]) if last_message else "",
+            "last_message_at": last_message.get("timestamp") if last_message else None
+        }
+
+    def build_search_fields(self):
+        """Các từ (đã bỏ dấu) của title và mọi tin nhắn, dùng cho index tìm kiếm"""
+        search_tokens = set()
+        for node in self.nodes:
+            search_tokens.update(tokenize(node.get("content")))
+        return {
+            "search_tokens": sorted(search_tokens),
+            "title_tokens": sorted(set(tokenize(self.title)))
+        }
+
+    def build_save_document(self):
+        """Document đầy đủ của conversation (dùng khi tạo mới hoặc ghi lại toàn bộ)"""
+        document = {
+            "schema_version": SCHEMA_VERSION,
+            "user_id": self.user_id,
+            "title": self.title,
+            "age_context": self.age_context,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "is_archived": self.is_archived,
+            "messages": [self._serialize_message(node) for node in self.nodes],
+            "active_children": dict(self.active_children)
+        }
+        document.update(self.build_summary_fields())
+        document.update(self.build_search_fields())
+        return document
+
+    @span("conversation.save")
     def save(self):
         """Lưu thông tin cuộc hội thoại vào database"""
         try:
@@ -293,29 +463,15 @@ class Conversation:
             
             self.updated_at = datetime.datetime.now()
             
-            save_dict = {
-                "user_id": self.user_id,
-                "title": self.title,
-                "age_context": self.age_context,
-                "created_at": self.created_at,
-                "updated_at": self.updated_at,
-                "is_archived": self.is_archived,
-                "messages": []
-            }
-            
-            for message in self.messages:
-                message_copy = message.copy()
-                message_copy["timestamp"] = safe_datetime(message_copy.get("timestamp"))
-                
-                if "versions" in message_copy:
-                    for version in message_copy["versions"]:
-                        version["timestamp"] = safe_datetime(version.get("timestamp"))
-                
-                save_dict["messages"].append(message_copy)
+            save_dict = self.build_save_document()
             
             if not self.conversation_id:
                 insert_result = conversations_collection.insert_one(save_dict)
                 self.conversation_id = insert_result.inserted_id
+                self._needs_migration = False
+                
+                from models.rollup_model import record_conversation_created
+                record_conversation_created(self.created_at)
                 logger.info(f"Saved new conversation with ID: {self.conversation_id}")
                 return self.conversation_id
             else:
@@ -323,108 +479,113 @@ class Conversation:
                     {"_id": self.conversation_id}, 
                     {"$set": save_dict}
                 )
+                self._needs_migration = False
                 logger.info(f"Updated conversation: {self.conversation_id}")
                 return self.conversation_id
         except Exception as e:
             logger.error(f"Error saving conversation: {e}")
             raise
 
-    def add_message(self, role, content, sources=None, metadata=None, parent_message_id=None):
-        """Thêm tin nhắn mới vào cuộc hội thoại"""
-        timestamp = datetime.datetime.now()
+    @span("conversation.write")
+    def _apply_update(self, update, required_id=None, new_messages=0):
+        """
+        Ghi một thay đổi nhỏ (delta) thay vì ghi lại toàn bộ conversation
+        
+        Args:
+            update: Update document
+            required_id: Nếu có, chỉ cập nhật khi node này vẫn còn trong conversation
+                (tránh ghi vào nhánh đã bị xóa ở nơi khác)
+            new_messages: Số tin nhắn mới được thêm (cộng vào daily_rollups)
+        """
+        if not self.conversation_id or self._needs_migration:
+            # Conversation chưa được lưu hoặc còn ở schema cũ: ghi toàn bộ
+            if self._needs_migration:
+                logger.info(f"Chuyển conversation {self.conversation_id} sang schema {SCHEMA_VERSION}")
+            self.save()
+        else:
+            query_filter = {"_id": self.conversation_id}
+            if required_id is not None:
+                query_filter["messages._id"] = required_id
+            
+            result = get_db().conversations.update_one(query_filter, update)
+            if result.matched_count == 0:
+                raise RuntimeError("Cuộc trò chuyện đã thay đổi, vui lòng tải lại")
         
-        message = {
-            "_id": ObjectId(),
-            "role": role,
-            "content": content,
-            "timestamp": timestamp,
-            "versions": [{
-                "content": content,
-                "timestamp": timestamp,
-                "version": 1,
-                "following_messages": []
-            }],
-            "current_version": 1,
-            "parent_message_id": parent_message_id,
-            "is_edited": False
+        from models.rollup_model import record_conversation_write
+        record_conversation_write(self.created_at, self._last_write_at, self.updated_at, messages=new_messages)
+        self._last_write_at = self.updated_at
+
+    def build_push_message_update(self, node, timestamp):
+        """Update document thêm một node và chuyển nhánh active của parent sang node đó"""
+        return {
+            "$push": {"messages": self._serialize_message(node)},
+            "$addToSet": {"search_tokens": {"$each": sorted(set(tokenize(node.get("content"))))}},
+            "$set": {
+                f"active_children.{parent_key(node.get('parent_id'))}": node["_id"],
+                "updated_at": timestamp,
+                **self.build_summary_fields()
+            }
         }
+
+    def update_metadata(self, **fields):
+        """
+        Cập nhật các thông tin của conversation (title, age_context, is_archived) mà không ghi lại messages
+        """
+        allowed_fields = ("title", "age_context", "is_archived")
+        updates = {key: value for key, value in fields.items() if key in allowed_fields}
+        for key, value in updates.items():
+            setattr(self, key, value)
         
-        if sources:
-            message["sources"] = sources
-            message["versions"][0]["sources"] = sources
-            
-        if metadata:
-            message["metadata"] = metadata
-            message["versions"][0]["metadata"] = metadata
+        if "title" in updates:
+            updates["title_tokens"] = sorted(set(tokenize(updates["title"])))
+        
+        self.updated_at = datetime.datetime.now()
+        updates["updated_at"] = self.updated_at
+        self._apply_update({"$set": updates})
+        logger.info(f"Updated conversation metadata {self.conversation_id}: {list(updates)}")
+        return self.conversation_id
 
-        self.messages.append(message)
+    def _add_node(self, role, content, parent_id, sources=None, metadata=None):
+        """Thêm node con cho parent_id và đặt làm nhánh active"""
+        timestamp = datetime.datetime.now()
+        node = make_message_node(role, content, parent_id, timestamp=timestamp, sources=sources, metadata=metadata)
+        previous_path = self.get_active_path()
+        
+        self._append_node(node)
+        self.active_children[parent_key(parent_id)] = node["_id"]
         self.updated_at = timestamp
-        self.save()
+        self._apply_update(self.build_push_message_update(node, timestamp), required_id=parent_id, new_messages=1)
+        
+        self._record_path_change(previous_path)
+        return node
+
+    def add_message(self, role, content, sources=None, metadata=None, parent_message_id=None):
+        """Thêm tin nhắn mới vào cuối nhánh đang active (hoặc sau parent_message_id nếu có)"""
+        if parent_message_id is None:
+            path = self.get_active_path()
+            parent_id = path[-1]["_id"] if path else None
+        else:
+            parent_id = ObjectId(parent_message_id) if isinstance(parent_message_id, str) else parent_message_id
+        
+        node = self._add_node(role, content, parent_id, sources=sources, metadata=metadata)
         
         logger.info(f"Added message to conversation {self.conversation_id}")
-        return message["_id"]
+        return node["_id"]
 
     def edit_message(self, message_id, new_content):
-        """Chỉnh sửa tin nhắn và lưu following messages vào version hiện tại"""
+        """Chỉnh sửa tin nhắn: tạo node anh em mới, nhánh cũ vẫn được giữ nguyên"""
         try:
-            message_index = None
-            for i, message in enumerate(self.messages):
-                if str(message["_id"]) == str(message_id):
-                    message_index = i
-                    break
-            
-            if message_index is None:
+            message = self.get_node(message_id)
+            if message is None:
                 return False, "Không tìm thấy tin nhắn"
             
-            message = self.messages[message_index]
-            
             if message["role"] != "user":
                 return False, "Chỉ có thể chỉnh sửa tin nhắn của người dùng"
             
-            timestamp = datetime.datetime.now()
+            self._add_node("user", new_content, message.get("parent_id"))
             
-            # Capture following messages cho version hiện tại
-            following_messages = self.capture_following_messages(message_index)
-            
-            # Khởi tạo versions nếu chưa có
-            if "versions" not in message:
-                message["versions"] = [{
-                    "content": message["content"],
-                    "timestamp": safe_datetime(message.get("timestamp", timestamp)),
-                    "version": 1,
-                    "following_messages": following_messages
-                }]
-                if "sources" in message:
-                    message["versions"][0]["sources"] = message["sources"]
-                if "metadata" in message:
-                    message["versions"][0]["metadata"] = message["metadata"]
-            else:
-                # Cập nhật following_messages cho version hiện tại
-                current_version_index = message.get("current_version", 1) - 1
-                if current_version_index < len(message["versions"]):
-                    message["versions"][current_version_index]["following_messages"] = following_messages
-            
-            # Tạo version mới
-            new_version = len(message["versions"]) + 1
-            new_version_data = {
-                "content": new_content,
-                "timestamp": timestamp,
-                "version": new_version,
-                "following_messages": []
-            }
-            
-            message["versions"].append(new_version_data)
-            message["current_version"] = new_version
-            message["content"] = new_content
-            message["is_edited"] = True
-            
-            # Xóa tất cả messages sau message được edit
-            self.messages = self.messages[:message_index + 1]
-            
-            self.updated_at = timestamp
-            self.save()
-            
-            logger.info(f"Edited message {message_id}, created version {new_version} with {len(following_messages)} following messages")
+            version_count = len(self._children[parent_key(message.get("parent_id"))])
+            logger.info(f"Edited message {message_id}, created version {version_count}")
             return True, "Đã chỉnh sửa tin nhắn thành công"
             
         except Exception as e:
@@ -434,49 +595,13 @@ class Conversation:
     def regenerate_bot_response_after_edit(self, user_message_id, new_response, sources=None):
         """Thêm phản hồi bot mới sau khi edit tin nhắn user"""
         try:
-            user_message_index = None
-            for i, message in enumerate(self.messages):
-                if str(message["_id"]) == str(user_message_id):
-                    user_message_index = i
-                    break
-            
-            if user_message_index is None:
+            user_message = self.get_node(user_message_id)
+            if user_message is None:
                 return False, "Không tìm thấy tin nhắn user"
             
-            timestamp = datetime.datetime.now()
-            bot_message = {
-                "_id": ObjectId(),
-                "role": "bot",
-                "content": new_response,
-                "timestamp": timestamp,
-                "versions": [{
-                    "content": new_response,
-                    "timestamp": timestamp,
-                    "version": 1,
-                    "following_messages": []
-                }],
-                "current_version": 1,
-                "parent_message_id": self.messages[user_message_index]["_id"],
-                "is_edited": False
-            }
-            
-            if sources:
-                bot_message["sources"] = sources
-                bot_message["versions"][0]["sources"] = sources
-            
-            self.messages.append(bot_message)
-            
-            # Cập nhật following_messages cho version hiện tại của user message
-            user_message = self.messages[user_message_index]
-            if "versions" in user_message:
-                current_version_index = user_message.get("current_version", 1) - 1
-                if current_version_index < len(user_message["versions"]):
-                    # Capture lại following messages bao gồm bot response mới
-                    following_messages = self.capture_following_messages(user_message_index)
-                    user_message["versions"][current_version_index]["following_messages"] = following_messages
-            
-            self.updated_at = timestamp
-            self.save()
+            # user_message_id là version trước khi edit, phản hồi thuộc về version đang active
+            active_message = self._active_child(parent_key(user_message.get("parent_id")))
+            self._add_node("bot", new_response, active_message["_id"], sources=sources)
             
             logger.info(f"Added bot response after edit for user message {user_message_id}")
             return True, "Đã tạo phản hồi mới"
@@ -488,69 +613,17 @@ class Conversation:
     def regenerate_response(self, message_id, new_response, sources=None):
         """Tạo version mới cho phản hồi bot"""
         try:
-            message_index = None
-            for i, message in enumerate(self.messages):
-                if str(message["_id"]) == str(message_id):
-                    message_index = i
-                    break
-            
-            if message_index is None:
+            message = self.get_node(message_id)
+            if message is None:
                 return False, "Không tìm thấy tin nhắn"
             
-            message = self.messages[message_index]
-            
             if message["role"] != "bot":
                 return False, "Chỉ có thể regenerate phản hồi của bot"
             
-            timestamp = datetime.datetime.now()
-            
-            # Capture following messages cho version hiện tại
-            following_messages = self.capture_following_messages(message_index)
-            
-            # Khởi tạo versions nếu chưa có
-            if "versions" not in message:
-                message["versions"] = [{
-                    "content": message["content"],
-                    "timestamp": safe_datetime(message.get("timestamp", timestamp)),
-                    "version": 1,
-                    "sources": message.get("sources", []),
-                    "following_messages": following_messages
-                }]
-                if "metadata" in message:
-                    message["versions"][0]["metadata"] = message["metadata"]
-            else:
-                # Cập nhật following_messages cho version hiện tại
-                current_version_index = message.get("current_version", 1) - 1
-                if current_version_index < len(message["versions"]):
-                    message["versions"][current_version_index]["following_messages"] = following_messages
-            
-            # Tạo version mới
-            new_version = len(message["versions"]) + 1
-            new_version_data = {
-                "content": new_response,
-                "timestamp": timestamp,
-                "version": new_version,
-                "following_messages": []
-            }
-            
-            if sources:
-                new_version_data["sources"] = sources
-            
-            message["versions"].append(new_version_data)
-            message["current_version"] = new_version
-            message["content"] = new_response
-            message["is_edited"] = True
+            self._add_node("bot", new_response, message.get("parent_id"), sources=sources)
             
-            if sources:
-                message["sources"] = sources
-            
-            # Xóa tất cả messages sau regenerate message
-            self.messages = self.messages[:message_index + 1]
-            
-            self.updated_at = datetime.datetime.now()
-            self.save()
-            
-            logger.info(f"Regenerated response for message {message_id}, version {new_version} with {len(following_messages)} following messages")
+            version_count = len(self._children[parent_key(message.get("parent_id"))])
+            logger.info(f"Regenerated response for message {message_id}, version {version_count}")
             return True, "Đã tạo phản hồi mới thành công"
             
         except Exception as e:
@@ -558,56 +631,34 @@ class Conversation:
             return False, f"Lỗi: {str(e)}"
 
     def switch_message_version(self, message_id, version_number):
-        """Chuyển đổi version của tin nhắn và restore following messages"""
+        """Chuyển đổi version của tin nhắn bằng cách trỏ nhánh active sang node anh em tương ứng"""
         try:
-            message_index = None
-            for i, message in enumerate(self.messages):
-                if str(message["_id"]) == str(message_id):
-                    message_index = i
-                    break
-            
-            if message_index is None:
+            message = self.get_node(message_id)
+            if message is None:
                 logger.error(f"Message not found: {message_id}")
                 return False
             
-            message = self.messages[message_index]
-            
-            if not message.get("versions") or version_number > len(message["versions"]) or version_number < 1:
+            key = parent_key(message.get("parent_id"))
+            siblings = self._children.get(key, [])
+            if not 1 <= version_number <= len(siblings):
                 logger.error(f"Version {version_number} not found for message {message_id}")
                 return False
             
-            current_version = message.get("current_version", 1)
-            logger.info(f"Switching message {message_id} from version {current_version} to version {version_number}")
-            
-            selected_version = message["versions"][version_number - 1]
-            
-            # Update message content to selected version
-            message["current_version"] = version_number
-            message["content"] = selected_version["content"]
-            
-            # Update sources and metadata
-            if "sources" in selected_version:
-                message["sources"] = selected_version["sources"]
-            elif "sources" in message:
-                del message["sources"]
-                    
-            if "metadata" in selected_version:
-                message["metadata"] = selected_version["metadata"]
-            elif "metadata" in message:
-                del message["metadata"]
-            
-            # Restore following messages từ version được chọn
-            following_messages = selected_version.get("following_messages", [])
-            if following_messages:
-                restored_count = self.restore_following_messages(message_index, following_messages)
-                logger.info(f"Restored {restored_count} following messages from version {version_number}")
-            else:
-                # Nếu không có following messages, chỉ cắt conversation tại message này
-                self.messages = self.messages[:message_index + 1]
-                logger.info(f"No following messages in version {version_number}, truncated conversation at message index {message_index}")
+            target_id = siblings[version_number - 1]
+            previous_path = self.get_active_path()
+            self.active_children[key] = target_id
+            self._messages_view = None
             
             self.updated_at = datetime.datetime.now()
-            self.save()
+            self._apply_update(
+                {"$set": {
+                    f"active_children.{key}": target_id,
+                    "updated_at": self.updated_at,
+                    **self.build_summary_fields()
+                }},
+                required_id=target_id
+            )
+            self._record_path_change(previous_path)
             
             logger.info(f"Successfully switched to version {version_number} for message {message_id}")
             return True
@@ -617,21 +668,48 @@ class Conversation:
             return False
 
     def delete_message_and_following(self, message_id):
-        """Xóa tin nhắn và tất cả tin nhắn sau nó"""
+        """Xóa tin nhắn (mọi version) và tất cả tin nhắn sau nó"""
         try:
-            message_index = None
-            for i, message in enumerate(self.messages):
-                if str(message["_id"]) == str(message_id):
-                    message_index = i
-                    break
-            
-            if message_index is None:
+            message = self.get_node(message_id)
+            if message is None:
                 return False, "Không tìm thấy tin nhắn"
             
-            self.messages = self.messages[:message_index]
+            key = parent_key(message.get("parent_id"))
+            removed_ids = []
+            pending = list(self._children.get(key, []))
+            while pending:
+                node_id = pending.pop()
+                removed_ids.append(node_id)
+                pending.extend(self._children.get(str(node_id), []))
+            
+            previous_path = self.get_active_path()
+            removed = {str(node_id) for node_id in removed_ids}
+            removed_keys = removed | {key}
+            removed_nodes = [node for node in self.nodes if str(node["_id"]) in removed]
+            self.nodes = [node for node in self.nodes if str(node["_id"]) not in removed]
+            for removed_key in removed_keys:
+                self.active_children.pop(removed_key, None)
+            self._reindex()
+            
             self.updated_at = datetime.datetime.now()
-            self.save()
+            self._apply_update(
+                {
+                    "$pull": {"messages": {"_id": {"$in": removed_ids}}},
+                    "$unset": {f"active_children.{removed_key}": "" for removed_key in removed_keys},
+                    "$set": {
+                        "updated_at": self.updated_at,
+                        **self.build_summary_fields(),
+                        "search_tokens": self.build_search_fields()["search_tokens"]
+                    }
+                },
+                required_id=message["_id"]
+            )
+            
+            from models.rollup_model import record_deleted
+            record_deleted(messages=removed_nodes)
+            self._record_path_change(previous_path)
             
+            logger.info(f"Deleted {len(removed_ids)} messages from conversation {self.conversation_id}")
             return True, "Đã xóa tin nhắn và các tin nhắn sau nó"
             
         except Exception as e:
@@ -644,7 +722,12 @@ class Conversation:
             if self.conversation_id:
                 db = get_db()
                 conversations_collection = db.conversations
-                conversations_collection.delete_one({"_id": self.conversation_id})
+                result = conversations_collection.delete_one({"_id": self.conversation_id})
+                if result.deleted_count:
+                    from models.rollup_model import record_deleted
+                    from models.user_activity_model import record_path_change
+                    record_deleted(conversations=[{"created_at": self.created_at, "messages": self.nodes}])
+                    record_path_change(self.user_id, removed=self.get_active_path())
                 logger.info(f"Đã xóa cuộc hội thoại: {self.conversation_id}")
                 return True
             return False
@@ -652,6 +735,42 @@ class Conversation:
             logger.error(f"Lỗi khi xóa cuộc hội thoại: {e}")
             return False
 
+    @classmethod
+    def delete_many(cls, query):
+        """
+        Xóa các conversation khớp query (vd: mọi conversation của một user), trừ bộ đếm
+        daily_rollups và user_daily_activity
+        
+        Returns:
+            int: Số conversation đã xóa
+        """
+        conversations_collection = get_db().conversations
+        deleted = list(conversations_collection.find(query, ACTIVE_PATH_PROJECTION))
+        if not deleted:
+            return 0
+        
+        result = conversations_collection.delete_many({"_id": {"$in": [conv["_id"] for conv in deleted]}})
+        if result.deleted_count == len(deleted):
+            deleted_conversations = deleted
+        else:
+            # Một số conversation đã bị xóa ở nơi khác trong lúc này, chỉ trừ những conversation thực sự bị xóa
+            remaining = {conv["_id"] for conv in conversations_collection.find(
+                {"_id": {"$in": [conv["_id"] for conv in deleted]}}, {"_id": 1}
+            )}
+            deleted_conversations = [conv for conv in deleted if conv["_id"] not in remaining]
+        
+        from models.rollup_model import record_deleted
+        from models.user_activity_model import record_path_change
+        record_deleted(conversations=deleted_conversations)
+        
+        removed_by_user = {}
+        for document in deleted_conversations:
+            conversation = cls.from_dict(document)
+            removed_by_user.setdefault(conversation.user_id, []).extend(conversation.get_active_path())
+        for user_id, removed in removed_by_user.items():
+            record_path_change(user_id, removed=removed)
+        return result.deleted_count
+
     @classmethod
     def find_by_id(cls, conversation_id):
         """Tìm cuộc hội thoại theo ID"""
@@ -685,7 +804,7 @@ class Conversation:
             if not include_archived:
                 query_filter["is_archived"] = {"$ne": True}
             
-            logger.info(f"Querying conversations with filter: {query_filter}, limit: {limit}, skip: {skip}")
+            logger.debug("Querying conversations with filter: %s, limit: %s, skip: %s", query_filter, limit, skip)
             
             conversations_cursor = conversations_collection.find(query_filter)\
                 .sort("updated_at", DESCENDING)\
@@ -693,7 +812,7 @@ class Conversation:
                 .limit(limit)
             
             conversations_list = list(conversations_cursor)
-            logger.info(f"Found {len(conversations_list)} conversations for user {user_id}")
+            logger.debug("Found %d conversations for user %s", len(conversations_list), user_id)
             
             result = []
             for conv_dict in conversations_list:
@@ -701,13 +820,202 @@ class Conversation:
                 if conv_obj:
                     result.append(conv_obj)
             
-            logger.info(f"Returning {len(result)} conversation objects")
             return result
             
         except Exception as e:
             logger.error(f"Error finding conversations by user: {e}")
             return []
 
+    @classmethod
+    def find_summaries_by_user(cls, user_id, limit=50, skip=0, include_archived=False):
+        """
+        Lấy danh sách tóm tắt cuộc hội thoại của user (không đọc messages)
+        
+        Returns:
+            list: Các dict tóm tắt (id, title, last_message, message_count...)
+        """
+        try:
+            db = get_db()
+            conversations_collection = db.conversations
+            
+            if isinstance(user_id, str):
+                user_id = ObjectId(user_id)
+            
+            query_filter = {"user_id": user_id}
+            if not include_archived:
+                query_filter["is_archived"] = {"$ne": True}
+            
+            pipeline = [
+                {"$match": query_filter},
+                {"$sort": {"updated_at": DESCENDING}},
+                {"$skip": skip}
+            ]
+            if limit:
+                pipeline.append({"$limit": limit})
+            pipeline.append({"$project": SUMMARY_PROJECTION})
+            
+            result = []
+            for conv_dict in conversations_collection.aggregate(pipeline):
+                last_message = conv_dict.get("last_message_preview")
+                if last_message is None:
+                    last_message = build_message_preview(conv_dict.get("legacy_last_message"))
+                
+                result.append({
+                    "id": str(conv_dict["_id"]),
+                    "title": conv_dict.get("title"),
+                    "created_at": safe_isoformat(conv_dict.get("created_at")),
+                    "updated_at": safe_isoformat(conv_dict.get("updated_at")),
+                    "age_context": conv_dict.get("age_context"),
+                    "is_archived": conv_dict.get("is_archived", False),
+                    "last_message": last_message,
+                    "last_message_at": safe_isoformat(conv_dict.get("last_message_at")),
+                    "message_count": conv_dict.get("message_count", 0)
+                })
+            
+            logger.info(f"Found {len(result)} conversation summaries for user {user_id}")
+            return result
+            
+        except Exception as e:
+            logger.error(f"Error finding conversation summaries by user: {e}")
+            return []
+
+    def _build_search_result(self, query_tokens):
+        """Tóm tắt một kết quả tìm kiếm kèm đoạn xem trước được highlight"""
+        query_set = set(query_tokens)
+        
+        # Ưu tiên tin nhắn trên nhánh đang hiển thị, sau đó tới các version khác
+        active_ids = {str(message["_id"]) for message in self.messages}
+        candidates = self.messages + [node for node in self.nodes if str(node["_id"]) not in active_ids]
+        
+        matching = []
+        for message in candidates:
+            matched = query_set.intersection(tokenize(message.get("content")))
+            if matched:
+                matching.append((len(matched), message))
+        
+        preview, highlights = "", []
+        if matching:
+            best_message = max(matching, key=lambda item: item[0])[1]
+            preview, highlights = build_highlighted_preview(best_message["content"], query_set, MESSAGE_PREVIEW_LENGTH)
+        
+        _, title_highlights = find_token_spans(self.title, query_set)
+        
+        return {
+            "id": str(self.conversation_id),
+            "title": self.title,
+            "title_highlights": [list(span) for span in title_highlights],
+            "created_at": safe_isoformat(self.created_at),
+            "updated_at": safe_isoformat(self.updated_at),
+            "age_context": self.age_context,
+            "is_archived": self.is_archived,
+            "message_count": len(self.messages),
+            "matching_messages": sum(1 for count, _ in matching if count == len(query_set)) or len(matching),
+            "preview": preview,
+            "highlights": highlights
+        }
+
+    @classmethod
+    def search_by_content(cls, user_id, query, limit=10, skip=0):
+        """
+        Tìm cuộc hội thoại của user theo nội dung tin nhắn và tiêu đề (không phân biệt dấu, hoa thường)
+        
+        Mỗi conversation lưu search_tokens (các từ đã bỏ dấu), query dùng index
+        {user_id, search_tokens}. Kết quả được xếp hạng theo số từ khớp trong tiêu đề,
+        sau đó theo thời gian cập nhật; chỉ các conversation trong trang mới được đọc messages.
+        
+        Returns:
+            tuple: (danh sách kết quả, tổng số conversation khớp)
+        """
+        try:
+            query_tokens = list(dict.fromkeys(tokenize(query)))
+            if not query_tokens:
+                return [], 0
+            
+            db = get_db()
+            conversations_collection = db.conversations
+            
+            if isinstance(user_id, str):
+                user_id = ObjectId(user_id)
+            
+            # Bước 1: xếp hạng và phân trang trên các field nhỏ
+            pipeline = [
+                {"$match": {"user_id": user_id, "search_tokens": {"$all": query_tokens}}},
+                {"$project": SEARCH_RANK_FIELDS},
+                {"$addFields": {
+                    "score": {"$size": {"$setIntersection": [{"$ifNull": ["$title_tokens", []]}, query_tokens]}}
+                }},
+                {"$sort": {"score": DESCENDING, "updated_at": DESCENDING}},
+                {"$facet": {
+                    "total": [{"$count": "count"}],
+                    "items": [{"$skip": skip}, {"$limit": limit}, {"$project": {"score": 1}}]
+                }}
+            ]
+            ranked = next(conversations_collection.aggregate(pipeline), {})
+            total = ranked["total"][0]["count"] if ranked.get("total") else 0
+            items = ranked.get("items", [])
+            if not items:
+                return [], total
+            
+            # Bước 2: đọc messages của các conversation trong trang để tạo preview
+            page_ids = [item["_id"] for item in items]
+            documents = {
+                doc["_id"]: doc
+                for doc in conversations_collection.find(
+                    {"_id": {"$in": page_ids}},
+                    {"search_tokens": 0, "title_tokens": 0}
+                )
+            }
+            
+            result = []
+            for item in items:
+                conversation = cls.from_dict(documents.get(item["_id"]))
+                if conversation:
+                    search_result = conversation._build_search_result(query_tokens)
+                    search_result["score"] = item["score"]
+                    result.append(search_result)
+            
+            logger.info(f"Search '{query}' for user {user_id}: {total} conversations")
+            return result, total
+            
+        except Exception as e:
+            logger.error(f"Error searching conversations: {e}")
+            return [], 0
+
+    @classmethod
+    def get_user_stats(cls, user_id):
+        """
+        Thống kê toàn bộ conversation của user bằng một aggregation (chỉ dùng các field tóm tắt)
+        
+        Returns:
+            dict: total_conversations, archived_conversations, total_messages
+        """
+        try:
+            db = get_db()
+            conversations_collection = db.conversations
+            
+            if isinstance(user_id, str):
+                user_id = ObjectId(user_id)
+            
+            pipeline = [
+                {"$match": {"user_id": user_id}},
+                {"$group": {
+                    "_id": None,
+                    "total_conversations": {"$sum": 1},
+                    "archived_conversations": {"$sum": {"$cond": [{"$eq": ["$is_archived", True]}, 1, 0]}},
+                    "total_messages": {"$sum": MESSAGE_COUNT_EXPRESSION}
+                }}
+            ]
+            stats = next(conversations_collection.aggregate(pipeline), None) or {}
+            
+            return {
+                "total_conversations": stats.get("total_conversations", 0),
+                "archived_conversations": stats.get("archived_conversations", 0),
+                "total_messages": stats.get("total_messages", 0)
+            }
+        except Exception as e:
+            logger.error(f"Error getting user conversation stats: {e}")
+            return {"total_conversations": 0, "archived_conversations": 0, "total_messages": 0}
+
     @classmethod
     def count_by_user(cls, user_id, include_archived=False):
         """Đếm số cuộc hội thoại của user"""
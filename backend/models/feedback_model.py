@@ -4,6 +4,7 @@ from pymongo import MongoClient
 from bson.objectid import ObjectId
 import logging
 from dotenv import load_dotenv
+from utils.metrics import mongo_event_listeners
 
 # Cấu hình logging
 logger = logging.getLogger(__name__)
@@ -24,7 +25,7 @@ def get_db():
     global _mongo_client, _db
     if _mongo_client is None:
         try:
-            _mongo_client = MongoClient(MONGO_URI)
+            _mongo_client = MongoClient(MONGO_URI, event_listeners=mongo_event_listeners())
             _db = _mongo_client[DATABASE_NAME]
             logger.info(f"Đã kết nối đến database: {DATABASE_NAME}")
         except Exception as e:
@@ -32,29 +33,6 @@ def get_db():
             raise
     return _db
 
-def ensure_indexes():
-    """Tạo các index cần thiết cho feedback collection"""
-    try:
-        db = get_db()
-        feedback_collection = db.feedback
-        
-        # Index cho user_id
-        feedback_collection.create_index("user_id")
-        
-        # Index cho status
-        feedback_collection.create_index("status")
-        
-        # Index cho category
-        feedback_collection.create_index("category")
-        
-        # Index cho created_at (để sắp xếp)
-        feedback_collection.create_index([("created_at", -1)])
-        
-        logger.info("Đã tạo indexes cho feedback collection")
-        
-    except Exception as e:
-        logger.error(f"Lỗi tạo indexes: {e}")
-
 class Feedback:
     def __init__(self, user_id=None, rating=5, category='', title='', content='',
                  status='pending', admin_response='', created_at=None, updated_at=None,
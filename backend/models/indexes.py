@@ -0,0 +1,253 @@
+import datetime
+import logging
+import threading
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, DESCENDING
+from models.conversation_model import get_db
+
+# Cấu hình logging
+logger = logging.getLogger(__name__)
+
+# Các index cần có cho từng collection
+INDEX_REGISTRY = {
+    "conversations": [
+        # Danh sách conversation của user: user_id (bằng) -> sort updated_at -> lọc is_archived
+        {"keys": [("user_id", ASCENDING), ("updated_at", DESCENDING), ("is_archived", ASCENDING)]},
+        # Tìm kiếm conversation theo từ (đã bỏ dấu)
+        {"keys": [("user_id", ASCENDING), ("search_tokens", ASCENDING)]},
+        # Thống kê admin theo khoảng thời gian, danh sách conversation mới nhất
+        {"keys": [("updated_at", DESCENDING)]},
+        {"keys": [("created_at", DESCENDING)]},
+        # Phân bố độ tuổi trên dashboard admin
+        {"keys": [("age_context", ASCENDING)]}
+    ],
+    "users": [
+        {"keys": [("email", ASCENDING)], "unique": True},
+        {"keys": [("role", ASCENDING), ("created_at", DESCENDING)]},
+        {"keys": [("created_at", DESCENDING)]},
+        # Backup incremental theo watermark updated_at (models/backup.py)
+        {"keys": [("updated_at", ASCENDING)]}
+    ],
+    "user_daily_activity": [
+        {"keys": [("user_id", ASCENDING), ("date", DESCENDING)], "unique": True},
+        {"keys": [("updated_at", ASCENDING)]}
+    ],
+    "admins": [
+        {"keys": [("email", ASCENDING)]}
+    ],
+    "feedback": [
+        {"keys": [("user_id", ASCENDING)]},
+        {"keys": [("status", ASCENDING)]},
+        {"keys": [("category", ASCENDING)]},
+        {"keys": [("created_at", DESCENDING)]},
+        {"keys": [("updated_at", ASCENDING)]}
+    ]
+}
+
+# Giá trị mẫu cho các query dưới đây (planner chỉ quan tâm đến dạng query)
+_SAMPLE_ID = ObjectId()
+_SAMPLE_TIME = datetime.datetime(2024, 1, 1)
+
+# Các dạng query đang dùng trong api/ và models/, được kiểm tra bằng explain()
+QUERY_SHAPES = [
+    {
+        "name": "history.get_conversations",
+        "collection": "conversations",
+        "filter": {"user_id": _SAMPLE_ID, "is_archived": {"$ne": True}},
+        "sort": [("updated_at", DESCENDING)]
+    },
+    {
+        "name": "history.count_by_user",
+        "collection": "conversations",
+        "filter": {"user_id": _SAMPLE_ID, "is_archived": {"$ne": True}},
+        "count": True
+    },
+    {
+        "name": "Conversation.search_by_content",
+        "collection": "conversations",
+        "filter": {"user_id": _SAMPLE_ID, "search_tokens": {"$all": ["rau", "xanh"]}}
+    },
+    {
+        "name": "Conversation.get_user_stats",
+        "collection": "conversations",
+        "filter": {"user_id": _SAMPLE_ID}
+    },
+    {
+        "name": "user_activity.get_recent_activity",
+        "collection": "user_daily_activity",
+        "filter": {"user_id": _SAMPLE_ID},
+        "sort": [("date", DESCENDING)]
+    },
+    {
+        "name": "admin.get_all_users (conversations của user)",
+        "collection": "conversations",
+        "filter": {"user_id": _SAMPLE_ID},
+        "sort": [("updated_at", DESCENDING)]
+    },
+    {
+        "name": "admin.get_all_conversations",
+        "collection": "conversations",
+        "filter": {},
+        "sort": [("updated_at", DESCENDING)]
+    },
+    {
+        "name": "admin.get_overview_stats (conversations cập nhật trong 24h)",
+        "collection": "conversations",
+        "filter": {"updated_at": {"$gte": _SAMPLE_TIME}},
+        "count": True
+    },
+    {
+        "name": "rollup.get_age_distribution",
+        "collection": "conversations",
+        "filter": {},
+        "sort": [("age_context", ASCENDING)]
+    },
+    {
+        "name": "auth.get_admin_recent_activities",
+        "collection": "conversations",
+        "filter": {},
+        "sort": [("updated_at", DESCENDING)]
+    },
+    {
+        "name": "User.find_by_email",
+        "collection": "users",
+        "filter": {"email": "user@example.com"}
+    },
+    {
+        "name": "User.get_all_admins",
+        "collection": "users",
+        "filter": {"role": "admin"},
+        "sort": [("created_at", DESCENDING)]
+    },
+    {
+        "name": "admin.get_all_users",
+        "collection": "users",
+        "filter": {},
+        "sort": [("created_at", DESCENDING)]
+    },
+    {
+        "name": "admin.get_overview_stats (số admin)",
+        "collection": "users",
+        "filter": {"role": "admin"},
+        "count": True
+    },
+    {
+        "name": "AdminUser.find_by_email",
+        "collection": "admins",
+        "filter": {"email": "admin@example.com", "is_active": True}
+    },
+    {
+        "name": "Feedback.find_by_user",
+        "collection": "feedback",
+        "filter": {"user_id": _SAMPLE_ID},
+        "sort": [("created_at", DESCENDING)]
+    },
+    {
+        "name": "Feedback.get_all_for_admin",
+        "collection": "feedback",
+        "filter": {"status": "pending"},
+        "sort": [("created_at", DESCENDING)]
+    }
+]
+
+_indexes_started = False
+_indexes_lock = threading.Lock()
+
+def ensure_indexes(db=None):
+    """
+    Tạo tất cả index trong INDEX_REGISTRY (create_index không làm gì nếu index đã tồn tại)
+
+    Args:
+        db: Database cần tạo index (mặc định là database của app, vd: database đích khi restore backup)
+
+    Returns:
+        dict: Số index đã đảm bảo và danh sách lỗi
+    """
+    db = db if db is not None else get_db()
+    created = 0
+    errors = []
+
+    for collection_name, specs in INDEX_REGISTRY.items():
+        collection = db[collection_name]
+        for spec in specs:
+            options = {key: value for key, value in spec.items() if key != "keys"}
+            try:
+                collection.create_index(spec["keys"], **options)
+                created += 1
+            except Exception as e:
+                logger.error(f"Lỗi tạo index {spec['keys']} cho {collection_name}: {e}")
+                errors.append({"collection": collection_name, "keys": spec["keys"], "error": str(e)})
+
+    logger.info(f"Đã đảm bảo {created} indexes cho {len(INDEX_REGISTRY)} collections")
+    return {"indexes": created, "errors": errors}
+
+def ensure_indexes_in_background():
+    """Tạo indexes trong thread nền một lần cho mỗi process, không chặn app khởi động khi MongoDB chậm"""
+    global _indexes_started
+    with _indexes_lock:
+        if _indexes_started:
+            return
+        _indexes_started = True
+
+    def run():
+        try:
+            ensure_indexes()
+        except Exception as e:
+            logger.error(f"Lỗi tạo indexes: {e}")
+
+    threading.Thread(target=run, name="ensure-indexes", daemon=True).start()
+
+def _collect_stages(plan, stages):
+    """Lấy tên tất cả các stage trong một plan (bao gồm các input stage lồng nhau)"""
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            if isinstance(value, (dict, list)):
+                _collect_stages(value, stages)
+    elif isinstance(plan, list):
+        for item in plan:
+            _collect_stages(item, stages)
+    return stages
+
+def _find_winning_plans(explain_result, plans):
+    """Tìm các winningPlan trong kết quả explain (find, count, aggregate có cấu trúc khác nhau)"""
+    if isinstance(explain_result, dict):
+        for key, value in explain_result.items():
+            if key == "winningPlan":
+                plans.append(value)
+            elif key != "rejectedPlans":
+                _find_winning_plans(value, plans)
+    elif isinstance(explain_result, list):
+        for item in explain_result:
+            _find_winning_plans(item, plans)
+    return plans
+
+def explain_query(db, shape):
+    """
+    Chạy explain (queryPlanner) cho một dạng query trong QUERY_SHAPES
+
+    Returns:
+        dict: Tên query, các stage của winning plan và có COLLSCAN hay không
+    """
+    if shape.get("count"):
+        command = {"count": shape["collection"], "query": shape.get("filter", {})}
+    else:
+        command = {"find": shape["collection"], "filter": shape.get("filter", {}), "limit": 1}
+        if shape.get("sort"):
+            command["sort"] = dict(shape["sort"])
+
+    explain_result = db.command("explain", command, verbosity="queryPlanner")
+    stages = _collect_stages(_find_winning_plans(explain_result, []), [])
+
+    return {
+        "name": shape["name"],
+        "collection": shape["collection"],
+        "stages": stages,
+        "collscan": "COLLSCAN" in stages
+    }
+
+def check_query_plans():
+    """Explain tất cả các query trong QUERY_SHAPES"""
+    db = get_db()
+    return [explain_query(db, shape) for shape in QUERY_SHAPES]
@@ -0,0 +1,231 @@
+import datetime
+import logging
+from pymongo import UpdateOne, ASCENDING
+from models.conversation_model import get_db
+
+# Cấu hình logging
+logger = logging.getLogger(__name__)
+
+# Giờ Việt Nam (Asia/Ho_Chi_Minh, UTC+7, không có giờ mùa hè)
+VIETNAM_TZ = datetime.timezone(datetime.timedelta(hours=7), name="Asia/Ho_Chi_Minh")
+VIETNAM_TZ_NAME = "Asia/Ho_Chi_Minh"
+VIETNAM_UTC_OFFSET = "+07:00"
+
+# _id của document cộng dồn toàn bộ lịch sử
+TOTAL_ROLLUP_ID = "total"
+
+# Các bộ đếm theo ngày
+ROLLUP_COUNTERS = ("new_users", "conversations_created", "conversations_updated", "messages")
+
+def vietnam_now():
+    return datetime.datetime.now(VIETNAM_TZ)
+
+def vietnam_date(timestamp):
+    """
+    Ngày (YYYY-MM-DD) theo giờ Việt Nam của một thời điểm
+
+    Datetime không có timezone được coi là UTC (giống cách MongoDB lưu và các query thống kê đang dùng).
+    """
+    if timestamp is None:
+        return None
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=datetime.timezone.utc)
+    return timestamp.astimezone(VIETNAM_TZ).date().isoformat()
+
+def _apply_counters(counters_by_date):
+    """
+    Cộng các bộ đếm ({ngày: {bộ đếm: giá trị}}) vào document của từng ngày và tổng của chúng vào document tổng
+
+    Lỗi chỉ được ghi log để không ảnh hưởng tới thao tác ghi chính.
+    """
+    total = {}
+    for counters in counters_by_date.values():
+        for counter, value in counters.items():
+            total[counter] = total.get(counter, 0) + value
+    if not total:
+        return
+    try:
+        now = datetime.datetime.now()
+        operations = [
+            UpdateOne(
+                {"_id": date},
+                {"$inc": counters, "$set": {"date": date, "updated_at": now}},
+                upsert=True
+            )
+            for date, counters in counters_by_date.items() if counters
+        ]
+        operations.append(UpdateOne(
+            {"_id": TOTAL_ROLLUP_ID},
+            {"$inc": total, "$set": {"updated_at": now}},
+            upsert=True
+        ))
+        get_db().daily_rollups.bulk_write(operations, ordered=False)
+    except Exception as e:
+        logger.warning(f"Không cập nhật được daily_rollups: {e}")
+
+def record_counters(counters, timestamp=None):
+    """Cộng các bộ đếm vào document của ngày (giờ Việt Nam) và document tổng"""
+    if not counters:
+        return
+    _apply_counters({vietnam_date(timestamp or datetime.datetime.now()): counters})
+
+def record_user_created(timestamp=None):
+    """Đếm user mới"""
+    record_counters({"new_users": 1}, timestamp)
+
+def record_conversation_created(timestamp=None):
+    """Đếm conversation mới"""
+    record_counters({"conversations_created": 1}, timestamp)
+
+def record_conversation_write(created_at, previous_write_at, timestamp, messages=0):
+    """
+    Đếm một lần ghi vào conversation
+
+    Conversation được tính là "cập nhật trong ngày" ở lần ghi đầu tiên của ngày,
+    nếu nó được tạo từ ngày trước đó (không đếm trùng với conversations_created).
+    """
+    counters = {}
+    if messages:
+        counters["messages"] = messages
+
+    date = vietnam_date(timestamp)
+    created_date = vietnam_date(created_at)
+    previous_date = vietnam_date(previous_write_at)
+    if created_date and created_date < date and (previous_date is None or previous_date < date):
+        counters["conversations_updated"] = 1
+
+    record_counters(counters, timestamp)
+
+def record_deleted(conversations=(), messages=(), users=()):
+    """
+    Trừ bộ đếm của các user, conversation và tin nhắn bị xóa, theo cùng cách tính với rebuild_rollups:
+    new_users theo ngày tạo user, conversations_created theo ngày tạo conversation,
+    messages theo ngày của từng tin nhắn còn được lưu
+
+    Args:
+        users: Các dict user bị xóa (created_at như đang lưu trong database)
+        conversations: Các dict conversation bị xóa (created_at, messages kèm timestamp)
+        messages: Các tin nhắn bị xóa khỏi một conversation còn lại (dict có timestamp)
+    """
+    counters_by_date = {}
+
+    def subtract(timestamp, counter):
+        date = vietnam_date(timestamp) if isinstance(timestamp, datetime.datetime) else None
+        if date:
+            day = counters_by_date.setdefault(date, {})
+            day[counter] = day.get(counter, 0) - 1
+
+    for conversation in conversations:
+        subtract(conversation.get("created_at"), "conversations_created")
+        for message in conversation.get("messages") or []:
+            subtract(message.get("timestamp"), "messages")
+    for message in messages:
+        subtract(message.get("timestamp"), "messages")
+    for user in users:
+        subtract(user.get("created_at"), "new_users")
+
+    _apply_counters(counters_by_date)
+
+def get_daily_rollups(days=7):
+    """
+    Bộ đếm của `days` ngày gần nhất (giờ Việt Nam), ngày không có hoạt động có giá trị 0
+
+    Returns:
+        list: Các dict theo thứ tự ngày tăng dần
+    """
+    today = vietnam_now().date()
+    dates = [(today - datetime.timedelta(days=offset)).isoformat() for offset in range(days - 1, -1, -1)]
+
+    stored = {doc["_id"]: doc for doc in get_db().daily_rollups.find({"_id": {"$in": dates}})}
+
+    result = []
+    for date in dates:
+        doc = stored.get(date, {})
+        row = {"date": date}
+        row.update({counter: doc.get(counter, 0) for counter in ROLLUP_COUNTERS})
+        result.append(row)
+    return result
+
+def get_total_rollup():
+    """
+    Bộ đếm của document tổng
+
+    Các bộ đếm được trừ lại khi xóa conversation/tin nhắn, nên conversations_created và messages là số
+    conversation và số tin nhắn (gồm mọi version) đang được lưu, dùng để tính trung bình tin nhắn mỗi conversation.
+    """
+    doc = get_db().daily_rollups.find_one({"_id": TOTAL_ROLLUP_ID}) or {}
+    return {counter: doc.get(counter, 0) for counter in ROLLUP_COUNTERS}
+
+def get_age_distribution():
+    """Phân bố conversation theo độ tuổi, query trực tiếp trên index age_context (sort trước để dùng index)"""
+    return list(get_db().conversations.aggregate([
+        {"$sort": {"age_context": ASCENDING}},
+        {"$group": {"_id": "$age_context", "count": {"$sum": 1}}},
+        {"$sort": {"_id": ASCENDING}}
+    ]))
+
+def _date_expression(field):
+    return {"$dateToString": {"format": "%Y-%m-%d", "date": field, "timezone": VIETNAM_UTC_OFFSET}}
+
+def rebuild_rollups():
+    """
+    Tính lại toàn bộ daily_rollups từ users và conversations (dùng khi backfill)
+
+    conversations_updated được tính theo updated_at hiện tại của mỗi conversation,
+    giống cách thống kê trực tiếp trước đây.
+
+    Returns:
+        int: Số document theo ngày đã ghi
+    """
+    db = get_db()
+    days = {}
+
+    def add(date, counter, value):
+        if date:
+            day = days.setdefault(date, {})
+            day[counter] = day.get(counter, 0) + value
+
+    for row in db.users.aggregate([
+        {"$match": {"created_at": {"$type": "date"}}},
+        {"$group": {"_id": _date_expression("$created_at"), "count": {"$sum": 1}}}
+    ]):
+        add(row["_id"], "new_users", row["count"])
+
+    for row in db.conversations.aggregate([
+        {"$match": {"created_at": {"$type": "date"}}},
+        {"$group": {"_id": _date_expression("$created_at"), "count": {"$sum": 1}}}
+    ]):
+        add(row["_id"], "conversations_created", row["count"])
+
+    for row in db.conversations.aggregate([
+        {"$match": {"created_at": {"$type": "date"}, "updated_at": {"$type": "date"}}},
+        {"$project": {"created": _date_expression("$created_at"), "updated": _date_expression("$updated_at")}},
+        {"$match": {"$expr": {"$gt": ["$updated", "$created"]}}},
+        {"$group": {"_id": "$updated", "count": {"$sum": 1}}}
+    ]):
+        add(row["_id"], "conversations_updated", row["count"])
+
+    for row in db.conversations.aggregate([
+        {"$project": {"messages.timestamp": 1}},
+        {"$unwind": "$messages"},
+        {"$match": {"messages.timestamp": {"$type": "date"}}},
+        {"$group": {"_id": _date_expression("$messages.timestamp"), "count": {"$sum": 1}}}
+    ], allowDiskUse=True):
+        add(row["_id"], "messages", row["count"])
+
+    now = datetime.datetime.now()
+    documents = []
+    total = {"_id": TOTAL_ROLLUP_ID, "updated_at": now}
+    for date, counters in sorted(days.items()):
+        document = {"_id": date, "date": date, "updated_at": now}
+        for key, value in counters.items():
+            document[key] = value
+            total[key] = total.get(key, 0) + value
+        documents.append(document)
+    documents.append(total)
+
+    db.daily_rollups.delete_many({})
+    db.daily_rollups.insert_many(documents)
+
+    logger.info(f"Đã tính lại daily_rollups cho {len(days)} ngày")
+    return len(days)
@@ -0,0 +1,119 @@
+import datetime
+import logging
+from bson.objectid import ObjectId
+from pymongo import DESCENDING, UpdateOne
+from models.conversation_model import get_db, Conversation, ACTIVE_PATH_PROJECTION
+
+# Cấu hình logging
+logger = logging.getLogger(__name__)
+
+def _to_object_id(user_id):
+    return ObjectId(user_id) if isinstance(user_id, str) else user_id
+
+def _count_by_date(messages):
+    """Số tin nhắn theo ngày (YYYY-MM-DD) từ timestamp của từng tin nhắn"""
+    counts = {}
+    for message in messages:
+        timestamp = message.get("timestamp")
+        if isinstance(timestamp, datetime.datetime):
+            date = timestamp.strftime("%Y-%m-%d")
+            counts[date] = counts.get(date, 0) + 1
+    return counts
+
+def record_path_change(user_id, removed=(), added=()):
+    """
+    Cập nhật bộ đếm số tin nhắn theo ngày của user (collection user_daily_activity)
+
+    Bộ đếm tính cùng một thứ với total_messages của Conversation.get_user_stats:
+    các tin nhắn trên nhánh đang active. Khi nhánh active thay đổi (thêm tin nhắn,
+    edit/regenerate, đổi version, xóa tin nhắn hoặc conversation), các tin nhắn rời
+    khỏi nhánh được trừ và các tin nhắn mới vào nhánh được cộng theo ngày của chúng.
+    Bản ghi về 0 bị xóa. Lỗi chỉ được ghi log để không ảnh hưởng tới việc lưu tin nhắn.
+
+    Args:
+        removed: Các tin nhắn (dict có timestamp) rời khỏi nhánh active
+        added: Các tin nhắn mới vào nhánh active
+    """
+    if not user_id:
+        return
+
+    deltas = _count_by_date(added)
+    for date, count in _count_by_date(removed).items():
+        deltas[date] = deltas.get(date, 0) - count
+    deltas = {date: delta for date, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    try:
+        user_id = _to_object_id(user_id)
+        now = datetime.datetime.now()
+        collection = get_db().user_daily_activity
+        collection.bulk_write([
+            UpdateOne(
+                {"user_id": user_id, "date": date},
+                {"$inc": {"messages": delta}, "$set": {"updated_at": now}},
+                upsert=True
+            )
+            for date, delta in deltas.items()
+        ], ordered=False)
+        if any(delta < 0 for delta in deltas.values()):
+            collection.delete_many({"user_id": user_id, "date": {"$in": list(deltas)}, "messages": {"$lte": 0}})
+    except Exception as e:
+        logger.warning(f"Không cập nhật được user_daily_activity: {e}")
+
+def delete_user_activity(user_id):
+    """Xóa toàn bộ bộ đếm của user (khi xóa user)"""
+    try:
+        get_db().user_daily_activity.delete_many({"user_id": _to_object_id(user_id)})
+    except Exception as e:
+        logger.warning(f"Không xóa được user_daily_activity của user {user_id}: {e}")
+
+def get_recent_activity(user_id, days=7):
+    """
+    Số tin nhắn theo ngày của các ngày có hoạt động gần nhất
+
+    Returns:
+        dict: {"YYYY-MM-DD": số tin nhắn}, ngày mới nhất trước
+    """
+    try:
+        cursor = get_db().user_daily_activity.find(
+            {"user_id": _to_object_id(user_id)},
+            {"_id": 0, "date": 1, "messages": 1}
+        ).sort("date", DESCENDING).limit(days)
+        return {doc["date"]: doc["messages"] for doc in cursor}
+    except Exception as e:
+        logger.error(f"Lỗi lấy hoạt động của user: {e}")
+        return {}
+
+def rebuild_user_activity(user_id=None):
+    """
+    Tính lại toàn bộ bộ đếm từ nhánh active của các conversation (dùng khi backfill)
+
+    Returns:
+        int: Số bản ghi (user, ngày) đã ghi
+    """
+    db = get_db()
+    match = {"user_id": _to_object_id(user_id)} if user_id else {}
+
+    # Nhánh active phải dựng từ cây node nên được tính trong Python, chỉ đọc các field cần thiết
+    counts = {}
+    for document in db.conversations.find(match, ACTIVE_PATH_PROJECTION):
+        conversation = Conversation.from_dict(document)
+        for date, count in _count_by_date(conversation.get_active_path()).items():
+            key = (conversation.user_id, date)
+            counts[key] = counts.get(key, 0) + count
+
+    db.user_daily_activity.delete_many(match)
+
+    now = datetime.datetime.now()
+    written = 0
+    for (row_user_id, date), count in counts.items():
+        db.user_daily_activity.update_one(
+            {"user_id": row_user_id, "date": date},
+            {"$set": {"messages": count, "updated_at": now}},
+            upsert=True
+        )
+        written += 1
+
+    logger.info(f"Đã tính lại {written} bản ghi user_daily_activity")
+    return written
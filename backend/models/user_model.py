@@ -5,6 +5,7 @@ from bson.objectid import ObjectId
 import bcrypt
 import logging
 from dotenv import load_dotenv
+from utils.metrics import mongo_event_listeners
 
 # Cấu hình logging
 logger = logging.getLogger(__name__)
@@ -25,7 +26,7 @@ def get_db():
     global _mongo_client, _db
     if _mongo_client is None:
         try:
-            _mongo_client = MongoClient(MONGO_URI)
+            _mongo_client = MongoClient(MONGO_URI, event_listeners=mongo_event_listeners())
             _db = _mongo_client[DATABASE_NAME]
             logger.info(f"Đã kết nối đến database: {DATABASE_NAME}")
         except Exception as e:
@@ -176,6 +177,10 @@ class User:
                 # Đây là người dùng mới
                 insert_result = users_collection.insert_one(self.to_dict())
                 self.user_id = insert_result.inserted_id
+
+                from models.rollup_model import record_user_created
+                record_user_created(self.created_at)
+
                 logger.info(f"Đã tạo người dùng mới với ID: {self.user_id}")
                 return self.user_id
             else:
@@ -205,7 +210,12 @@ class User:
             if self.user_id:
                 db = get_db()
                 users_collection = db.users
-                users_collection.delete_one({"_id": self.user_id})
+                deleted = users_collection.find_one_and_delete({"_id": self.user_id}, {"created_at": 1})
+                if deleted:
+                    from models.rollup_model import record_deleted
+                    from models.user_activity_model import delete_user_activity
+                    record_deleted(users=[deleted])
+                    delete_user_activity(self.user_id)
                 logger.info(f"Đã xóa người dùng: {self.user_id}")
                 return True
             return False
@@ -0,0 +1,296 @@
+import os
+import sys
+import json
+import uuid
+import shutil
+import argparse
+import logging
+import datetime
+import tempfile
+
+# Set UTF-8 encoding cho console
+os.environ['PYTHONIOENCODING'] = 'utf-8'
+
+# Thêm thư mục cha vào sys.path để import các module từ thư mục backend
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymongo import MongoClient
+from bson import ObjectId, Int64, json_util
+from models.backup import (
+    BackupManager, FILE_EXTENSIONS, BACKUP_COLLECTIONS, EXCLUDED_FIELDS, DIRECTORY_MODE, FILE_MODE,
+    JSON_OPTIONS, open_backup_reader, _import_zstandard
+)
+from config import BACKUP_DIRECTORY, BACKUP_BATCH_SIZE
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("backup_db")
+
+def get_target_db(args):
+    """Database đích khi restore: --mongo-uri/--db nếu có, mặc định là database của app"""
+    if not args.mongo_uri and not args.db:
+        return None
+    from models.conversation_model import MONGO_URI, DATABASE_NAME
+    client = MongoClient(args.mongo_uri or MONGO_URI)
+    return client[args.db or DATABASE_NAME]
+
+def _patch_mongomock_bulk():
+    """
+    pymongo >= 4.9 truyền thêm keyword sort cho ReplaceOne/UpdateOne khi bulk_write,
+    mongomock (4.x) chưa nhận keyword này nên bỏ nó đi (chỉ dùng trong self-test)
+    """
+    from mongomock.collection import BulkOperationBuilder
+
+    for name in ("add_replace", "add_update"):
+        original = getattr(BulkOperationBuilder, name)
+        if getattr(original, "_ignores_sort", False):
+            continue
+
+        def wrapper(self, *args, _original=original, **kwargs):
+            kwargs.pop("sort", None)
+            return _original(self, *args, **kwargs)
+
+        wrapper._ignores_sort = True
+        setattr(BulkOperationBuilder, name, wrapper)
+
+def _seed_self_test_data(db, now):
+    """Dữ liệu mẫu cho mọi collection được backup (có ObjectId, datetime, Int64, unicode, password)"""
+    user_ids = [ObjectId() for _ in range(3)]
+    db.users.insert_many([
+        {"_id": user_id, "name": f"Người dùng {i}", "email": f"user{i}@example.com",
+         "password": f"$2b$12$hash{i}", "created_at": now, "updated_at": now}
+        for i, user_id in enumerate(user_ids)
+    ])
+    db.admins.insert_one({"email": "admin@example.com", "password": "$2b$12$adminhash", "role": "super_admin",
+                          "updated_at": now})
+    db.conversations.insert_many([
+        {"user_id": user_ids[i % 3], "title": f"Cuộc trò chuyện {i}", "message_count": Int64(2),
+         "messages": [{"_id": ObjectId(), "role": "user", "content": "Bé 2 tuổi nên ăn gì?", "timestamp": now},
+                      {"_id": ObjectId(), "role": "bot", "content": "Trả lời", "timestamp": now}],
+         "created_at": now, "updated_at": now - datetime.timedelta(minutes=i)}
+        for i in range(50)
+    ])
+    db.feedback.insert_one({"user_id": user_ids[0], "rating": 5, "comment": "Tốt", "updated_at": now})
+    db.user_daily_activity.insert_one({"user_id": user_ids[0], "date": now.strftime("%Y-%m-%d"),
+                                       "messages": 2, "updated_at": now})
+    db.daily_rollups.insert_one({"_id": now.strftime("%Y-%m-%d"), "new_users": 3, "messages": 100, "updated_at": now})
+    return user_ids
+
+def _canonical_documents(collection, excluded_fields=()):
+    """Các document (bỏ field không được backup) dạng JSON chuẩn, sort theo _id để so sánh"""
+    documents = []
+    for document in collection.find():
+        for field in excluded_fields:
+            document.pop(field, None)
+        documents.append(json_util.dumps(document, json_options=JSON_OPTIONS, sort_keys=True))
+    return sorted(documents)
+
+def run_self_test(mongo_uri=None):
+    """
+    Kiểm tra backup/restore đầu-cuối trên database tạm: backup full, sửa dữ liệu, backup
+    incremental, restore --drop chuỗi backup vào database khác rồi so sánh document,
+    kiểm tra field password không nằm trong backup và quyền file/thư mục chỉ cho chủ sở hữu
+
+    Dùng mongod thật nếu có mongo_uri (database tên ngẫu nhiên, xóa sau khi chạy),
+    ngược lại dùng mongomock.
+
+    Returns:
+        bool: True nếu mọi kiểm tra đều đạt
+    """
+    if mongo_uri:
+        client = MongoClient(mongo_uri)
+    else:
+        try:
+            import mongomock
+        except ImportError:
+            logger.error("Can cai mongomock (pip install mongomock) hoac truyen --mongo-uri cua mot mongod tam")
+            return False
+        _patch_mongomock_bulk()
+        client = mongomock.MongoClient()
+
+    prefix = f"backup_selftest_{uuid.uuid4().hex[:8]}"
+    source, target = client[f"{prefix}_src"], client[f"{prefix}_dst"]
+    directory = tempfile.mkdtemp(prefix="backup_selftest_")
+    failures = []
+
+    def check(condition, message):
+        if not condition:
+            failures.append(message)
+            logger.error(f"FAIL: {message}")
+
+    try:
+        try:
+            _import_zstandard()
+            incremental_compression = "zstd"
+        except Exception:
+            incremental_compression = "gzip"
+
+        # Dùng thời điểm trong quá khứ, làm tròn ms như MongoDB lưu datetime
+        now = datetime.datetime.now().replace(microsecond=0) - datetime.timedelta(days=1)
+        user_ids = _seed_self_test_data(source, now)
+        manager = BackupManager(directory=os.path.join(directory, "backups"), db=source)
+
+        full = manager.run_backup(compression="gzip")
+        check(full["type"] == "full" and full["status"] == "completed", "backup full khong hoan tat")
+        check(manager.verify(full["backup_id"])["ok"], "verify backup full that bai")
+
+        # Thay đổi sau backup full: sửa, thêm document (updated_at mới hơn watermark)
+        later = now + datetime.timedelta(hours=1)
+        source.conversations.update_one({}, {"$set": {"title": "Đã đổi tên", "updated_at": later}})
+        source.conversations.insert_one({"user_id": user_ids[1], "title": "Mới", "messages": [],
+                                         "created_at": later, "updated_at": later})
+        source.users.insert_one({"name": "Mới", "email": "new@example.com", "password": "$2b$12$newhash",
+                                 "created_at": later, "updated_at": later})
+        source.daily_rollups.update_one({}, {"$inc": {"messages": 1}, "$set": {"updated_at": later}})
+
+        incremental = manager.run_backup(incremental=True, compression=incremental_compression)
+        check(incremental["type"] == "incremental" and incremental["base_backup_id"] == full["backup_id"],
+              "backup thu hai khong phai incremental cua backup full")
+        # Watermark dùng $gte nên document có updated_at đúng bằng watermark được ghi lại lần nữa
+        check(2 <= incremental["collections"]["conversations"]["documents"] < full["collections"]["conversations"]["documents"],
+              "backup incremental khong chi chua cac conversation thay doi")
+        check(manager.verify(incremental["backup_id"])["ok"], "verify backup incremental that bai")
+
+        # Field bị loại không được xuất hiện trong file backup
+        for manifest in (full, incremental):
+            backup_path = os.path.join(manager.directory, manifest["backup_id"])
+            check(os.stat(backup_path).st_mode & 0o777 == DIRECTORY_MODE,
+                  f"thu muc {manifest['backup_id']} khong phai {oct(DIRECTORY_MODE)}")
+            for name, info in manifest["collections"].items():
+                file_path = os.path.join(backup_path, info["file"])
+                check(os.stat(file_path).st_mode & 0o777 == FILE_MODE,
+                      f"file {manifest['backup_id']}/{info['file']} khong phai {oct(FILE_MODE)}")
+                with open_backup_reader(file_path) as f:
+                    for line in f:
+                        if line.strip():
+                            document = json_util.loads(line, json_options=JSON_OPTIONS)
+                            leaked = [field for field in EXCLUDED_FIELDS.get(name, []) if field in document]
+                            check(not leaked, f"{manifest['backup_id']}/{name} chua field {leaked}")
+
+        # Restore --drop vào database đích đã có dữ liệu cũ
+        target.conversations.insert_one({"title": "du lieu cu phai bi xoa"})
+        result = manager.restore(incremental["backup_id"], db=target, drop=True)
+        check([backup["backup_id"] for backup in result["backups"]] == [full["backup_id"], incremental["backup_id"]],
+              "restore khong ap dung dung chuoi backup full + incremental")
+
+        for name in BACKUP_COLLECTIONS:
+            excluded = EXCLUDED_FIELDS.get(name, [])
+            expected = _canonical_documents(source[name], excluded)
+            restored = _canonical_documents(target[name])
+            check(expected == restored,
+                  f"{name}: {len(restored)} document sau restore khac {len(expected)} document nguon")
+            if excluded:
+                check(target[name].count_documents({"$or": [{field: {"$exists": True}} for field in excluded]}) == 0,
+                      f"{name}: document sau restore van co field {excluded}")
+
+        logger.info(
+            f"Self-test {'mongod' if mongo_uri else 'mongomock'}: backup {full['backup_id']} (gzip) + "
+            f"{incremental['backup_id']} ({incremental_compression}), restore {result['collections']}"
+        )
+    except Exception as e:
+        failures.append(str(e))
+        logger.exception(f"Self-test loi: {e}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+        client.drop_database(source.name)
+        client.drop_database(target.name)
+
+    if failures:
+        logger.error(f"Self-test that bai: {len(failures)} kiem tra khong dat")
+        return False
+    logger.info("Self-test dat: du lieu sau restore khop voi nguon, khong co field bi loai trong backup")
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Backup MongoDB ra NDJSON nen (gzip/zstd) va restore lai, ho tro backup incremental"
+    )
+    parser.add_argument("--directory", type=str, default=BACKUP_DIRECTORY,
+                        help=f"Thu muc chua backup (mac dinh: {BACKUP_DIRECTORY})")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    backup_parser = subparsers.add_parser("backup", help="Tao backup moi")
+    backup_parser.add_argument("--incremental", action="store_true",
+                               help="Chi ghi cac document thay doi tu lan backup thanh cong gan nhat")
+    backup_parser.add_argument("--compression", choices=list(FILE_EXTENSIONS), default=None,
+                               help="Kieu nen (mac dinh: BACKUP_COMPRESSION)")
+
+    restore_parser = subparsers.add_parser("restore", help="Restore mot backup (kem backup full va cac incremental truoc no)")
+    restore_parser.add_argument("backup_id", type=str, help="ID backup (ten thu muc)")
+    restore_parser.add_argument("--drop", action="store_true",
+                                help="Xoa collection dich truoc khi restore")
+    restore_parser.add_argument("--no-chain", action="store_true",
+                                help="Chi ap dung dung backup nay, khong ap dung cac backup truoc no")
+    restore_parser.add_argument("--collections", type=str, default=None,
+                                help="Danh sach collection can restore, cach nhau boi dau phay")
+    restore_parser.add_argument("--mongo-uri", type=str, default=None,
+                                help="MongoDB URI dich (mac dinh: MONGO_URI)")
+    restore_parser.add_argument("--db", type=str, default=None,
+                                help="Ten database dich (mac dinh: MONGO_DB_NAME)")
+    restore_parser.add_argument("--batch-size", type=int, default=BACKUP_BATCH_SIZE,
+                                help=f"So document moi lan bulk write (mac dinh: {BACKUP_BATCH_SIZE})")
+
+    subparsers.add_parser("list", help="Liet ke cac backup")
+
+    verify_parser = subparsers.add_parser("verify", help="Doc lai file backup va so so document voi manifest")
+    verify_parser.add_argument("backup_id", type=str, help="ID backup (ten thu muc)")
+
+    self_test_parser = subparsers.add_parser(
+        "self-test",
+        help="Backup full + incremental roi restore --drop tren database tam va so sanh du lieu (mac dinh dung mongomock)"
+    )
+    self_test_parser.add_argument("--mongo-uri", type=str, default=None,
+                                  help="MongoDB URI cua mot mongod tam (tao va xoa database ten ngau nhien)")
+
+    args = parser.parse_args()
+
+    if args.command == "self-test":
+        sys.exit(0 if run_self_test(args.mongo_uri) else 1)
+
+    backup_manager = BackupManager(directory=args.directory)
+
+    try:
+        if args.command == "backup":
+            manifest = backup_manager.run_backup(incremental=args.incremental, compression=args.compression)
+            for name, info in manifest["collections"].items():
+                logger.info(f"{name}: {info['documents']} documents, {info['compressed_bytes']} bytes")
+            logger.info(
+                f"Da tao backup {manifest['backup_id']} ({manifest['type']}): {manifest['documents']} documents "
+                f"trong {manifest['duration_seconds']}s"
+            )
+
+        elif args.command == "restore":
+            collections = [name.strip() for name in args.collections.split(",") if name.strip()] if args.collections else None
+            result = backup_manager.restore(
+                args.backup_id,
+                db=get_target_db(args),
+                drop=args.drop,
+                chain=not args.no_chain,
+                collections=collections,
+                batch_size=args.batch_size
+            )
+            for name, count in result["collections"].items():
+                logger.info(f"{name}: {count} documents")
+            logger.info(f"Da restore {len(result['backups'])} backup trong {result['duration_seconds']}s")
+
+        elif args.command == "list":
+            for manifest in backup_manager.list_backups():
+                logger.info(
+                    f"{manifest['backup_id']}: {manifest['type']}, {manifest['status']}, "
+                    f"{manifest['documents']} documents, {manifest['compression']}"
+                    + (f", tu {manifest['base_backup_id']}" if manifest.get("base_backup_id") else "")
+                )
+
+        elif args.command == "verify":
+            result = backup_manager.verify(args.backup_id)
+            logger.info(json.dumps(result, ensure_ascii=False, indent=2))
+            if not result["ok"]:
+                logger.error(f"Backup {args.backup_id} khong hop le")
+                sys.exit(1)
+            logger.info(f"Backup {args.backup_id} hop le")
+
+    except (ValueError, RuntimeError) as e:
+        logger.error(str(e))
+        sys.exit(1)
@@ -0,0 +1,151 @@
+import os
+import sys
+import json
+import argparse
+import logging
+import datetime
+
+# Set UTF-8 encoding cho console
+os.environ['PYTHONIOENCODING'] = 'utf-8'
+
+# Thêm thư mục cha vào sys.path để import các module từ thư mục backend
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bson
+from bson.objectid import ObjectId
+from models.conversation_model import Conversation, make_message_node, parent_key
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("benchmark_conversation_writes")
+
+USER_MESSAGE = "Con tôi 8 tuổi, nên ăn sáng như thế nào để đủ chất cho cả buổi học? " * 2
+BOT_MESSAGE = "Bữa sáng cho trẻ nên có đủ 4 nhóm chất: tinh bột, chất đạm, chất béo và vitamin, khoáng chất. " * 15
+SOURCES = [
+    {"title": "Bài 1: Dinh dưỡng hợp lý", "pages": "12-14", "content_type": "text"},
+    {"title": "Bài 2: Bữa ăn học đường", "pages": "20", "content_type": "table"}
+]
+
+def update_size(update):
+    """Số byte BSON của update (bọc trong field 'u' như trong lệnh update gửi tới MongoDB)"""
+    return len(bson.encode({"u": update}))
+
+def build_conversation(message_count, edit_every, extra_messages=()):
+    """
+    Tạo conversation giả lập (không ghi database), cứ edit_every lượt thì tin nhắn user có thêm một version
+
+    Args:
+        extra_messages: Các cặp (role, content, sources) nối thêm vào cuối nhánh active
+
+    Returns:
+        tuple: (conversation, các node được nối thêm)
+    """
+    nodes = []
+    active_children = {}
+    parent_id = None
+
+    def append(role, content, sources=None):
+        node = make_message_node(role, content, parent_id, sources=sources)
+        nodes.append(node)
+        active_children[parent_key(parent_id)] = node["_id"]
+        return node["_id"]
+
+    for i in range(message_count // 2):
+        if edit_every and i % edit_every == 0:
+            # Version cũ vẫn nằm trong cây, version mới là nhánh active
+            append("user", USER_MESSAGE)
+        parent_id = append("user", USER_MESSAGE)
+        parent_id = append("bot", BOT_MESSAGE, SOURCES)
+
+    extra_nodes = []
+    for role, content, sources in extra_messages:
+        parent_id = append(role, content, sources)
+        extra_nodes.append(nodes[-1])
+
+    conversation = Conversation(
+        user_id=ObjectId(), title="Benchmark", age_context=8, conversation_id=ObjectId(),
+        messages=nodes, active_children=active_children
+    )
+    return conversation, extra_nodes
+
+def measure_turn(message_count, edit_every):
+    """
+    Đo số byte gửi tới MongoDB cho một lượt chat (1 tin nhắn user + 1 phản hồi bot)
+
+    Returns:
+        dict: Kết quả so sánh ghi toàn bộ ($set messages) và ghi delta ($push)
+    """
+    turn = [("user", USER_MESSAGE, None), ("bot", BOT_MESSAGE, SOURCES)]
+    timestamp = datetime.datetime.now()
+
+    full_bytes = 0
+    delta_bytes = 0
+    for count in range(1, len(turn) + 1):
+        conversation, extra_nodes = build_conversation(message_count, edit_every, turn[:count])
+
+        # Cách cũ: mỗi add_message ghi lại toàn bộ document
+        full_bytes += update_size({"$set": conversation.build_save_document()})
+        # Cách mới: chỉ $push node mới
+        delta_bytes += update_size(conversation.build_push_message_update(extra_nodes[-1], timestamp))
+
+    document_bytes = len(bson.encode(conversation.build_save_document()))
+    return {
+        "messages": message_count,
+        "document_bytes": document_bytes,
+        "full_rewrite_bytes_per_turn": full_bytes,
+        "delta_bytes_per_turn": delta_bytes,
+        "reduction": round(full_bytes / delta_bytes, 1) if delta_bytes else None
+    }
+
+def measure_regenerate(message_count, edit_every):
+    """Đo số byte cho một lần regenerate phản hồi bot cuối cùng và một lần chuyển version"""
+    conversation, _ = build_conversation(message_count, edit_every)
+    timestamp = datetime.datetime.now()
+
+    last_message = conversation.get_active_path()[-1]
+    node = make_message_node("bot", BOT_MESSAGE, last_message["parent_id"], sources=SOURCES)
+    key = parent_key(last_message["parent_id"])
+
+    return {
+        "messages": message_count,
+        "full_rewrite_bytes": update_size({"$set": conversation.build_save_document()}),
+        "delta_bytes": update_size(conversation.build_push_message_update(node, timestamp)),
+        "switch_version_bytes": update_size({"$set": {f"active_children.{key}": node["_id"], "updated_at": timestamp}})
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark so byte ghi MongoDB moi luot chat")
+    parser.add_argument("--sizes", type=str, default="10,100,500",
+                        help="So tin nhan co san trong conversation, phan cach bang dau phay (mac dinh: 10,100,500)")
+    parser.add_argument("--edit-every", type=int, default=10,
+                        help="Cu N luot thi co mot tin nhan user co 2 version, 0 de tat (mac dinh: 10)")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Ghi ket qua ra file JSON")
+
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    report = {
+        "timestamp": datetime.datetime.now().isoformat(),
+        "edit_every": args.edit_every,
+        "turn": [measure_turn(size, args.edit_every) for size in sizes],
+        "regenerate": [measure_regenerate(size, args.edit_every) for size in sizes]
+    }
+
+    for row in report["turn"]:
+        logger.info(
+            f"{row['messages']:>5} messages: full rewrite {row['full_rewrite_bytes_per_turn']:>10,} B/turn, "
+            f"delta {row['delta_bytes_per_turn']:>7,} B/turn (x{row['reduction']})"
+        )
+    for row in report["regenerate"]:
+        logger.info(
+            f"{row['messages']:>5} messages: regenerate full {row['full_rewrite_bytes']:>10,} B, "
+            f"delta {row['delta_bytes']:>7,} B, switch version {row['switch_version_bytes']:>5,} B"
+        )
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        logger.info(f"Da ghi report: {args.output}")
@@ -0,0 +1,184 @@
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import datetime
+import statistics
+import tempfile
+import threading
+
+# Set UTF-8 encoding cho console
+os.environ['PYTHONIOENCODING'] = 'utf-8'
+
+# Thêm thư mục cha vào sys.path để import các module từ thư mục backend
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.logging_setup import setup_logging, stop_logging, get_logging_stats, TEXT_FORMAT
+from utils.tracing import install_log_record_factory, start_trace, finish_trace
+from utils.stats import LatencyStats
+
+# Logger của script ghi thẳng ra stdout, không đi qua pipeline đang được đo
+report_logger = logging.getLogger("benchmark_logging")
+report_logger.propagate = False
+report_logger.addHandler(logging.StreamHandler(sys.stdout))
+report_logger.setLevel(logging.INFO)
+
+MESSAGE = "Con tôi 8 tuổi, nên ăn sáng như thế nào để đủ chất cho cả buổi học?"
+
+class SlowStream:
+    """Stream giả lập console bị chậm (pipe tới docker/journald đầy, terminal chậm): mỗi lần write chờ `delay_ms`"""
+
+    def __init__(self, stream, delay_ms):
+        self.stream = stream
+        self.delay = delay_ms / 1000
+
+    def write(self, text):
+        if self.delay:
+            time.sleep(self.delay)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+def setup_sync_logging(log_dir, stream):
+    """Cấu hình cũ: basicConfig, mỗi lệnh log ghi trực tiếp ra console và file trong thread của request"""
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    formatter = logging.Formatter(TEXT_FORMAT)
+    console = logging.StreamHandler(stream)
+    console.setFormatter(formatter)
+    file_handler = logging.FileHandler(os.path.join(log_dir, "app.log"), encoding='utf-8')
+    file_handler.setFormatter(formatter)
+    root.addHandler(console)
+    root.addHandler(file_handler)
+    root.setLevel(logging.INFO)
+    return [console, file_handler]
+
+def simulate_request(request_logger, lines, work_ms):
+    """Một request giả lập: log `lines` dòng INFO xen kẽ với `work_ms` ms xử lý (sleep)"""
+    trace, tokens = start_trace("POST /api/chat")
+    try:
+        for i in range(lines):
+            request_logger.info(f"  Message {i}: user - {MESSAGE[:30]}... (current_version: 1)")
+            if work_ms:
+                time.sleep(work_ms / 1000 / lines)
+    finally:
+        finish_trace(trace, tokens)
+
+def run_load(mode, threads, requests_per_thread, lines, work_ms):
+    """
+    Chạy `threads` thread, mỗi thread gửi `requests_per_thread` request liên tiếp
+
+    Returns:
+        dict: Độ trễ request (ms), throughput và thời gian chờ ghi hết log sau khi request cuối kết thúc
+    """
+    request_logger = logging.getLogger("api.chat")
+    stats = LatencyStats(window=threads * requests_per_thread)
+    barrier = threading.Barrier(threads + 1)
+
+    def worker():
+        barrier.wait()
+        for _ in range(requests_per_thread):
+            start = time.perf_counter()
+            simulate_request(request_logger, lines, work_ms)
+            stats.record((time.perf_counter() - start) * 1000)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    result = {"mode": mode}
+    result.update(stats.get_stats())
+    result["requests_per_second"] = round(threads * requests_per_thread / elapsed, 1)
+    return result
+
+def run_mode(mode, args):
+    log_dir = tempfile.mkdtemp(prefix=f"benchmark_logging_{mode}_")
+    with open(os.path.join(log_dir, "console.log"), 'w', encoding='utf-8') as console_file:
+        console_stream = SlowStream(console_file, args.console_delay_ms)
+        if mode == "sync":
+            handlers = setup_sync_logging(log_dir, console_stream)
+        else:
+            setup_logging(level="INFO", log_dir=log_dir, sampling="", stream=console_stream)
+
+        result = run_load(mode, args.threads, args.requests, args.lines, args.work_ms)
+
+        # Thời gian để thread nền ghi hết các record còn trong queue
+        drain_start = time.perf_counter()
+        if mode == "sync":
+            for handler in handlers:
+                handler.flush()
+                handler.close()
+        else:
+            result["dropped"] = get_logging_stats()["dropped"]
+            stop_logging()
+        result["drain_ms"] = round((time.perf_counter() - drain_start) * 1000, 2)
+        result["log_dir"] = log_dir
+
+    logging.getLogger().handlers.clear()
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark do tre request khi log dong bo va log qua queue")
+    parser.add_argument("--threads", type=int, default=8,
+                        help="So request dong thoi (mac dinh: 8)")
+    parser.add_argument("--requests", type=int, default=200,
+                        help="So request moi thread (mac dinh: 200)")
+    parser.add_argument("--lines", type=int, default=40,
+                        help="So dong log INFO moi request (mac dinh: 40, nhu switch_message_version voi 20 tin nhan)")
+    parser.add_argument("--work-ms", type=float, default=0,
+                        help="Thoi gian xu ly gia lap moi request, ms (mac dinh: 0)")
+    parser.add_argument("--console-delay-ms", type=float, default=0,
+                        help="Do tre moi lan ghi ra console, ms (gia lap stdout bi chan, mac dinh: 0)")
+    parser.add_argument("--rounds", type=int, default=5,
+                        help="So vong chay xen ke hai che do, bao cao trung vi (mac dinh: 5)")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Ghi ket qua ra file JSON")
+
+    args = parser.parse_args()
+    install_log_record_factory()
+
+    report = {
+        "timestamp": datetime.datetime.now().isoformat(),
+        "threads": args.threads,
+        "requests_per_thread": args.requests,
+        "lines_per_request": args.lines,
+        "work_ms": args.work_ms,
+        "console_delay_ms": args.console_delay_ms,
+        "rounds": [],
+        "results": []
+    }
+
+    # Chạy xen kẽ hai chế độ nhiều vòng để nhiễu của máy (CPU bị chia sẻ) ảnh hưởng đều cả hai
+    for round_index in range(args.rounds):
+        report["rounds"].append([run_mode(mode, args) for mode in ("sync", "queue")])
+
+    for mode_index, mode in enumerate(("sync", "queue")):
+        rows = [round_rows[mode_index] for round_rows in report["rounds"]]
+        row = {"mode": mode}
+        for key in ("p50_ms", "p95_ms", "p99_ms", "requests_per_second", "drain_ms"):
+            row[key] = round(statistics.median(r[key] for r in rows), 2)
+        row["dropped"] = sum(r.get("dropped", 0) for r in rows)
+        report["results"].append(row)
+        report_logger.info(
+            f"{row['mode']:>5}: p50 {row['p50_ms']:>8.2f} ms, p95 {row['p95_ms']:>8.2f} ms, "
+            f"p99 {row['p99_ms']:>8.2f} ms, {row['requests_per_second']:>8.1f} req/s, drain {row['drain_ms']:.0f} ms"
+            + (f", bo {row['dropped']} dong log (queue day)" if row.get("dropped") else "")
+            + f" (trung vi {args.rounds} vong)"
+        )
+    sync_row, queue_row = report["results"]
+    if queue_row["p50_ms"]:
+        report_logger.info(f"Giam do tre p50: x{sync_row['p50_ms'] / queue_row['p50_ms']:.1f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        report_logger.info(f"Da ghi report: {args.output}")
@@ -0,0 +1,242 @@
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import datetime
+
+# Set UTF-8 encoding cho console
+os.environ['PYTHONIOENCODING'] = 'utf-8'
+
+# Thêm thư mục cha vào sys.path để import các module từ thư mục backend
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+
+from core.embedding_model import get_embedding_model, VECTOR_STORE_ENGINES
+from config import EMBEDDING_MODEL
+from core.age_index import clamp_age
+from utils.stats import percentile
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("benchmark_retrieval")
+
+# Tắt log chi tiết từng lượt search trong lúc benchmark
+logging.getLogger("core.embedding_model").setLevel(logging.WARNING)
+
+DEFAULT_BENCHMARK_FILE = os.path.join(os.path.dirname(BACKEND_DIR), "benchmark.json")
+DEFAULT_REPORT_DIR = os.path.join(BACKEND_DIR, "benchmark_reports")
+
+def load_benchmark(path, limit=None):
+    """Đọc file benchmark, bỏ qua các câu hỏi không có context chuẩn"""
+    with open(path, 'r', encoding='utf-8') as f:
+        records = json.load(f)
+
+    records = [r for r in records if r.get('question') and r.get('contexts')]
+    if limit:
+        records = records[:limit]
+    return records
+
+def summarize_latency(values):
+    """Tính các percentile độ trễ (ms)"""
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values), 3) if values else 0.0,
+        "p50_ms": round(percentile(values, 50), 3),
+        "p95_ms": round(percentile(values, 95), 3),
+        "p99_ms": round(percentile(values, 99), 3),
+        "max_ms": round(values[-1], 3) if values else 0.0
+    }
+
+def get_record_age(record):
+    """Lấy tuổi đại diện (cận dưới) từ age_group dạng "a-b" của câu hỏi benchmark"""
+    try:
+        return clamp_age(str(record.get('age_group', '')).split('-')[0])
+    except ValueError:
+        return None
+
+def score_results(retrieved_ids, gold_ids, k_values):
+    """
+    Tính recall@k và reciprocal rank cho một câu hỏi
+
+    Returns:
+        tuple: (dict recall theo k, reciprocal rank)
+    """
+    gold = set(gold_ids)
+    recalls = {}
+    for k in k_values:
+        recalls[k] = len(gold.intersection(retrieved_ids[:k])) / len(gold)
+
+    reciprocal_rank = 0.0
+    for rank, doc_id in enumerate(retrieved_ids, start=1):
+        if doc_id in gold:
+            reciprocal_rank = 1.0 / rank
+            break
+
+    return recalls, reciprocal_rank
+
+def run_engine(embedding_model, records, query_embeddings, engine, k_values, warmup, use_age_filter=False):
+    """Chạy toàn bộ câu hỏi qua một engine, đo chất lượng và độ trễ query"""
+    max_k = max(k_values)
+    ages = [get_record_age(record) if use_age_filter else None for record in records]
+
+    # Warmup (load numpy store, age index, cache của ChromaDB...)
+    for embedding, age in zip(query_embeddings[:warmup], ages):
+        embedding_model.search_by_embedding(embedding, top_k=max_k, age_filter=age, engine=engine)
+
+    recall_sums = {k: 0.0 for k in k_values}
+    mrr_sum = 0.0
+    query_latencies = []
+    misses = []
+
+    started = time.perf_counter()
+    for record, embedding, age in zip(records, query_embeddings, ages):
+        t0 = time.perf_counter()
+        results = embedding_model.search_by_embedding(embedding, top_k=max_k, age_filter=age, engine=engine)
+        query_latencies.append((time.perf_counter() - t0) * 1000)
+
+        retrieved_ids = [r.get('id') for r in results]
+        recalls, reciprocal_rank = score_results(retrieved_ids, record['contexts'], k_values)
+        for k in k_values:
+            recall_sums[k] += recalls[k]
+        mrr_sum += reciprocal_rank
+
+        if reciprocal_rank == 0.0 and len(misses) < 20:
+            misses.append({"question": record['question'], "gold": record['contexts'], "retrieved": retrieved_ids})
+    elapsed = time.perf_counter() - started
+
+    total = len(records)
+    return {
+        "engine": engine,
+        "recall": {f"@{k}": round(recall_sums[k] / total, 4) for k in k_values},
+        "mrr": round(mrr_sum / total, 4),
+        "query_latency": summarize_latency(query_latencies),
+        "throughput_qps": round(total / elapsed, 2) if elapsed > 0 else 0.0,
+        "sample_misses": misses
+    }
+
+def run_batched(embedding_model, records, engine, max_k, batch_size):
+    """Đo throughput end-to-end (encode + search) qua search_many"""
+    questions = [r['question'] for r in records]
+    started = time.perf_counter()
+    for i in range(0, len(questions), batch_size):
+        embedding_model.search_many(questions[i:i + batch_size], top_k=max_k, engine=engine)
+    elapsed = time.perf_counter() - started
+    return {
+        "batch_size": batch_size,
+        "throughput_qps": round(len(questions) / elapsed, 2) if elapsed > 0 else 0.0
+    }
+
+def run_benchmark(benchmark_file, k_values, engines, limit=None, warmup=5, batch_size=0, output=None, age_filter=False):
+    records = load_benchmark(benchmark_file, limit)
+    logger.info(f"Da doc {len(records)} cau hoi tu {benchmark_file}")
+
+    embedding_model = get_embedding_model()
+
+    # Encode từng câu hỏi (không qua cache) để đo độ trễ encode thật
+    for record in records[:warmup]:
+        embedding_model.encode(record['question'], is_query=True)
+
+    encode_latencies = []
+    query_embeddings = []
+    for record in records:
+        t0 = time.perf_counter()
+        query_embeddings.append(embedding_model.encode(record['question'], is_query=True)[0])
+        encode_latencies.append((time.perf_counter() - t0) * 1000)
+
+    report = {
+        "timestamp": datetime.datetime.now().isoformat(),
+        "benchmark_file": os.path.abspath(benchmark_file),
+        "questions": len(records),
+        "embedding_model": EMBEDDING_MODEL,
+        "collection_size": embedding_model.count(),
+        "collection_version": embedding_model.get_collection_version(),
+        "k_values": k_values,
+        "encode_latency": summarize_latency(encode_latencies),
+        "engines": {}
+    }
+
+    for engine in engines:
+        logger.info(f"Dang chay benchmark voi engine: {engine}")
+        result = run_engine(embedding_model, records, query_embeddings, engine, k_values, warmup)
+        if batch_size > 0:
+            result["batched"] = run_batched(embedding_model, records, engine, max(k_values), batch_size)
+
+        if age_filter:
+            # Chạy lại với tuổi của từng câu hỏi để so sánh độ trễ khi lọc theo tuổi
+            filtered = run_engine(embedding_model, records, query_embeddings, engine, k_values, warmup, use_age_filter=True)
+            filtered.pop("engine")
+            filtered["p95_delta_ms"] = round(filtered["query_latency"]["p95_ms"] - result["query_latency"]["p95_ms"], 3)
+            result["age_filtered"] = filtered
+            logger.info(
+                f"[{engine} + age filter] MRR={filtered['mrr']}, query p95={filtered['query_latency']['p95_ms']}ms "
+                f"(delta {filtered['p95_delta_ms']}ms)"
+            )
+
+        report["engines"][engine] = result
+
+        recall_text = ", ".join(f"recall{k}={v}" for k, v in result["recall"].items())
+        logger.info(
+            f"[{engine}] {recall_text}, MRR={result['mrr']}, "
+            f"query p50={result['query_latency']['p50_ms']}ms p95={result['query_latency']['p95_ms']}ms "
+            f"p99={result['query_latency']['p99_ms']}ms, {result['throughput_qps']} qps"
+        )
+
+    logger.info(
+        f"Encode p50={report['encode_latency']['p50_ms']}ms p95={report['encode_latency']['p95_ms']}ms "
+        f"p99={report['encode_latency']['p99_ms']}ms"
+    )
+
+    if not output:
+        os.makedirs(DEFAULT_REPORT_DIR, exist_ok=True)
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        output = os.path.join(DEFAULT_REPORT_DIR, f"retrieval_{timestamp}.json")
+
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    logger.info(f"Da ghi report: {output}")
+
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark chat luong va do tre retrieval voi benchmark.json")
+    parser.add_argument("--benchmark-file", type=str, default=DEFAULT_BENCHMARK_FILE,
+                        help="Duong dan file benchmark (mac dinh: benchmark.json o thu muc goc)")
+    parser.add_argument("--k", type=str, default="1,3,5,10",
+                        help="Cac gia tri k cho recall@k, phan cach bang dau phay (mac dinh: 1,3,5,10)")
+    parser.add_argument("--engine", type=str, default="chroma", choices=list(VECTOR_STORE_ENGINES) + ["all"],
+                        help="Vector store engine can benchmark (mac dinh: chroma)")
+    parser.add_argument("--limit", type=int, default=None,
+                        help="Chi chay N cau hoi dau tien")
+    parser.add_argument("--warmup", type=int, default=5,
+                        help="So cau hoi chay warmup truoc khi do (mac dinh: 5)")
+    parser.add_argument("--batch-size", type=int, default=0,
+                        help="Neu > 0, do them throughput qua search_many voi batch size nay")
+    parser.add_argument("--age-filter", action="store_true",
+                        help="Chay them mot luot loc theo tuoi (lay tu age_group) de so sanh do tre")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Duong dan file report JSON (mac dinh: benchmark_reports/retrieval_<timestamp>.json)")
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.benchmark_file):
+        logger.error(f"File {args.benchmark_file} khong ton tai!")
+        sys.exit(1)
+
+    k_values = sorted({int(k) for k in args.k.split(",") if k.strip()})
+    engines = list(VECTOR_STORE_ENGINES) if args.engine == "all" else [args.engine]
+
+    run_benchmark(
+        args.benchmark_file,
+        k_values,
+        engines,
+        limit=args.limit,
+        warmup=args.warmup,
+        batch_size=args.batch_size,
+        output=args.output,
+        age_filter=args.age_filter
+    )
@@ -0,0 +1,53 @@
+import os
+import sys
+import json
+import argparse
+import logging
+
+# Set UTF-8 encoding cho console
+os.environ['PYTHONIOENCODING'] = 'utf-8'
+
+# Thêm thư mục cha vào sys.path để import các module từ thư mục backend
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.indexes import ensure_indexes, check_query_plans
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("check_indexes")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Explain cac query da dang ky trong models/indexes.py, that bai neu co COLLSCAN"
+    )
+    parser.add_argument("--skip-create", action="store_true",
+                        help="Khong tao index truoc khi kiem tra")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Ghi ket qua explain ra file JSON")
+
+    args = parser.parse_args()
+
+    if not args.skip_create:
+        result = ensure_indexes()
+        if result["errors"]:
+            logger.error(f"Co {len(result['errors'])} index tao loi")
+
+    results = check_query_plans()
+    failed = [r for r in results if r["collscan"]]
+
+    for r in results:
+        status = "COLLSCAN" if r["collscan"] else "OK"
+        logger.info(f"[{status}] {r['collection']}: {r['name']} -> {' <- '.join(r['stages'])}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        logger.info(f"Da ghi ket qua: {args.output}")
+
+    if failed:
+        logger.error(f"{len(failed)}/{len(results)} query dung COLLSCAN")
+        sys.exit(1)
+
+    logger.info(f"Tat ca {len(results)} query deu dung index")
@@ -1,6 +1,8 @@
 import os
 import sys
 import time
+import json
+import hashlib
 import argparse
 import logging
 
@@ -11,7 +13,8 @@ os.environ['PYTHONIOENCODING'] = 'utf-8'
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from core.data_processor import DataProcessor
-from core.embedding_model import get_embedding_model
+from core.embedding_model import get_embedding_model, PASSAGE_PREFIX
+from config import EMBEDDING_MODEL
 
 # Cấu hình logging với UTF-8
 logging.basicConfig(
@@ -24,6 +27,74 @@ logging.basicConfig(
 )
 logger = logging.getLogger("embed_data")
 
+# Các trường metadata thay đổi mỗi lần chạy, không tính vào hash
+VOLATILE_METADATA_FIELDS = ("created_at",)
+
+def get_manifest_path(embedding_model):
+    """Manifest hash được lưu cạnh thư mục ChromaDB"""
+    return f"{embedding_model.persist_directory.rstrip(os.sep)}_manifest.json"
+
+def compute_item_hashes(content, metadata):
+    """
+    Tính hash nội dung (gồm model và prefix dùng để encode) và hash metadata của một item
+    
+    Returns:
+        dict: {"content_hash": ..., "metadata_hash": ...}
+    """
+    content_raw = json.dumps([EMBEDDING_MODEL, PASSAGE_PREFIX, content], ensure_ascii=False)
+    stable_metadata = {k: v for k, v in (metadata or {}).items() if k not in VOLATILE_METADATA_FIELDS}
+    metadata_raw = json.dumps(stable_metadata, ensure_ascii=False, sort_keys=True)
+    return {
+        "content_hash": hashlib.sha256(content_raw.encode('utf-8')).hexdigest(),
+        "metadata_hash": hashlib.sha256(metadata_raw.encode('utf-8')).hexdigest()
+    }
+
+def load_manifest(path):
+    """Đọc manifest, trả về None nếu không có; manifest của model/prefix khác chỉ giữ lại ID"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    
+    if manifest.get("embedding_model") != EMBEDDING_MODEL or manifest.get("passage_prefix") != PASSAGE_PREFIX:
+        logger.warning("Manifest duoc tao voi model/prefix khac, se encode lai toan bo")
+        # Giữ lại danh sách ID (bỏ hash) để vẫn xóa được các item không còn trong data
+        return {item_id: {} for item_id in manifest.get("items", {})}
+    return manifest.get("items", {})
+
+def save_manifest(path, items):
+    """Ghi manifest (atomic)"""
+    manifest = {
+        "embedding_model": EMBEDDING_MODEL,
+        "passage_prefix": PASSAGE_PREFIX,
+        "updated_at": time.strftime('%Y-%m-%d %H:%M:%S'),
+        "items": items
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    logger.info(f"Da ghi manifest {len(items)} items: {path}")
+
+def build_manifest_from_collection(embedding_model, data_ids):
+    """
+    Tạo manifest từ dữ liệu đang có trong ChromaDB (lần đầu chạy incremental)
+    
+    Chỉ lấy các ID sinh ra từ thư mục data (data_ids): tài liệu admin upload nằm
+    chung collection nhưng không thuộc manifest nên không bao giờ bị xóa.
+    Giả định các embeddings hiện có được tạo bằng EMBEDDING_MODEL hiện tại.
+    """
+    logger.info("Chua co manifest, tinh hash tu du lieu hien co trong ChromaDB")
+    data_ids = list(data_ids)
+    if not data_ids:
+        return {}
+    stored = embedding_model.collection.get(ids=data_ids, include=['documents', 'metadatas'])
+    items = {}
+    for doc_id, document, metadata in zip(stored['ids'], stored['documents'], stored['metadatas']):
+        items[doc_id] = compute_item_hashes(document, metadata)
+    return items
+
 def embed_all_data(data_dir, force=False):
     """
     Embedding tất cả dữ liệu từ thư mục data
@@ -45,19 +116,17 @@ def embed_all_data(data_dir, force=False):
         logger.info(f"Da ton tai chi muc voi {collection_size} items")
         end_time = time.time()
         logger.info(f"Hoan thanh kiem tra chi muc trong {end_time - start_time:.2f} giay")
-        logger.info("Su dung --force de tao lai chi muc")
+        logger.info("Su dung --incremental de cap nhat phan thay doi hoac --force de tao lai chi muc")
         return
     
     # Nếu buộc tạo lại hoặc chưa có chỉ mục, tạo mới
     if force:
         logger.info("Xoa chi muc cu va tao lai...")
-        try:
-            embedding_model.chroma_client.delete_collection(name=embedding_model.collection.name)
-            # Tạo lại collection mới
-            embedding_model.collection = embedding_model.chroma_client.create_collection(name=embedding_model.collection.name)
+        # delete_collection tạo lại collection và cập nhật version (invalidate response cache)
+        if embedding_model.delete_collection():
             logger.info("Da xoa va tao lai collection")
-        except Exception as e:
-            logger.error(f"Loi khi xoa collection: {e}")
+        else:
+            logger.error("Loi khi xoa collection")
     
     # Chuẩn bị dữ liệu cho embedding
     logger.info("Dang chuan bi du lieu cho qua trinh embedding...")
@@ -84,6 +153,15 @@ def embed_all_data(data_dir, force=False):
             logger.error(f"Loi xu ly batch {i//batch_size + 1}")
             return
     
+    # Build age index cho version mới để các worker không phải build khi nhận query
+    embedding_model.get_age_index()
+    
+    # Ghi manifest để các lần chạy incremental sau chỉ encode phần thay đổi
+    save_manifest(
+        get_manifest_path(embedding_model),
+        {item["id"]: compute_item_hashes(item["content"], item.get("metadata")) for item in all_items if item.get("id")}
+    )
+    
     end_time = time.time()
     elapsed_time = end_time - start_time
     
@@ -91,12 +169,116 @@ def embed_all_data(data_dir, force=False):
     final_count = embedding_model.count()
     logger.info(f"Hoan thanh qua trinh embedding {final_count} items trong {elapsed_time:.2f} giay")
 
+def embed_incremental(data_dir, batch_size=50):
+    """
+    Chỉ encode lại các item mới hoặc có nội dung thay đổi, xóa các item không còn tồn tại
+    
+    Chỉ xóa các item có trong manifest lần trước (tức là sinh ra từ thư mục data) mà
+    nay không còn trong data; tài liệu admin upload vào cùng collection được giữ nguyên.
+    
+    Args:
+        data_dir: Đường dẫn đến thư mục chứa dữ liệu
+        batch_size: Số item mỗi lần upsert
+    """
+    logger.info(f"Bat dau embedding incremental tu {data_dir}")
+    start_time = time.time()
+    
+    data_processor = DataProcessor(data_dir=data_dir)
+    embedding_model = get_embedding_model()
+    manifest_path = get_manifest_path(embedding_model)
+    
+    manifest = load_manifest(manifest_path)
+    
+    # Gom item theo ID (ID trùng lặp thì item sau ghi đè item trước)
+    items = {}
+    for item in data_processor.prepare_for_embedding():
+        item_id = item.get("id")
+        if not item_id or not item.get("content"):
+            continue
+        if item_id in items:
+            logger.warning(f"ID trung lap: {item_id}")
+        items[item_id] = item
+    
+    if manifest is None:
+        manifest = build_manifest_from_collection(embedding_model, items)
+    
+    existing_ids = set(embedding_model.collection.get(include=[])['ids'])
+    
+    to_upsert = []
+    to_update_metadata = []
+    new_hashes = {}
+    for item_id, item in items.items():
+        hashes = compute_item_hashes(item["content"], item.get("metadata"))
+        new_hashes[item_id] = hashes
+        old_hashes = manifest.get(item_id)
+        
+        if item_id not in existing_ids or not old_hashes or old_hashes.get("content_hash") != hashes["content_hash"]:
+            to_upsert.append(item_id)
+        elif old_hashes.get("metadata_hash") != hashes["metadata_hash"]:
+            to_update_metadata.append(item_id)
+    
+    to_delete = sorted((set(manifest) - set(items)) & existing_ids)
+    
+    logger.info(
+        f"Tong {len(items)} items: {len(to_upsert)} can encode, "
+        f"{len(to_update_metadata)} chi cap nhat metadata, {len(to_delete)} can xoa, "
+        f"{len(items) - len(to_upsert) - len(to_update_metadata)} khong doi"
+    )
+    
+    # Manifest được cập nhật dần theo các bước thành công
+    # (item cần xóa giữ lại trong manifest đến khi xóa xong để lần chạy sau còn xóa tiếp)
+    updated_manifest = {item_id: manifest[item_id] for item_id in items if item_id in manifest and item_id in existing_ids}
+    updated_manifest.update({item_id: manifest[item_id] for item_id in to_delete})
+    
+    try:
+        for i in range(0, len(to_upsert), batch_size):
+            batch_ids = to_upsert[i:i + batch_size]
+            logger.info(f"Dang encode batch {i//batch_size + 1}/{(len(to_upsert) + batch_size - 1)//batch_size}, kich thuoc: {len(batch_ids)}")
+            success = embedding_model.upsert_documents(
+                [items[item_id]["content"] for item_id in batch_ids],
+                [items[item_id].get("metadata", {}) for item_id in batch_ids],
+                batch_ids
+            )
+            if not success:
+                logger.error(f"Loi upsert batch {i//batch_size + 1}")
+                return False
+            for item_id in batch_ids:
+                updated_manifest[item_id] = new_hashes[item_id]
+        
+        if to_update_metadata:
+            success = embedding_model.update_metadatas(
+                to_update_metadata,
+                [items[item_id].get("metadata", {}) for item_id in to_update_metadata]
+            )
+            if not success:
+                logger.error("Loi cap nhat metadata")
+                return False
+            for item_id in to_update_metadata:
+                updated_manifest[item_id] = new_hashes[item_id]
+        
+        if to_delete:
+            if not embedding_model.delete_documents(to_delete):
+                logger.error("Loi xoa cac items khong con ton tai")
+                return False
+            for item_id in to_delete:
+                updated_manifest.pop(item_id, None)
+    finally:
+        save_manifest(manifest_path, updated_manifest)
+    
+    embedding_model.get_age_index()
+    
+    elapsed_time = time.time() - start_time
+    logger.info(f"Hoan thanh embedding incremental, collection co {embedding_model.count()} items, trong {elapsed_time:.2f} giay")
+    return True
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Embedding du lieu cho he thong Nutribot")
     parser.add_argument("--data-dir", type=str, default="data", 
                         help="Duong dan den thu muc chua du lieu (mac dinh: data)")
     parser.add_argument("--force", action="store_true", 
                         help="Xoa va tao lai chi muc neu da ton tai")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Chi encode lai cac item moi/thay doi va xoa cac item khong con ton tai")
     
     args = parser.parse_args()
     
@@ -109,4 +291,8 @@ if __name__ == "__main__":
         sys.exit(1)
     
     # Thực hiện embedding
-    embed_all_data(data_dir, args.force)
\ No newline at end of file
+    if args.incremental and not args.force:
+        if not embed_incremental(data_dir):
+            sys.exit(1)
+    else:
+        embed_all_data(data_dir, args.force)
\ No newline at end of file
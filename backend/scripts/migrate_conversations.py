@@ -0,0 +1,111 @@
+import os
+import sys
+import argparse
+import logging
+
+# Set UTF-8 encoding cho console
+os.environ['PYTHONIOENCODING'] = 'utf-8'
+
+# Thêm thư mục cha vào sys.path để import các module từ thư mục backend
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bson
+from models.conversation_model import get_db, Conversation, SCHEMA_VERSION
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("migrate_conversations")
+
+def migrate_conversations(batch_size=100, dry_run=False, limit=None):
+    """
+    Chuyển các conversation dạng cũ (versions + following_messages) sang cây node
+    và bổ sung các field tóm tắt (message_count, last_message_preview, last_message_at)
+    cùng các field tìm kiếm (search_tokens, title_tokens)
+
+    Conversation bị thay đổi trong lúc chạy (updated_at khác) sẽ được bỏ qua,
+    chúng sẽ tự chuyển ở lần ghi tiếp theo.
+
+    Returns:
+        dict: Thống kê số document và kích thước trước/sau
+    """
+    conversations = get_db().conversations
+    query_filter = {"$or": [
+        {"schema_version": {"$ne": SCHEMA_VERSION}},
+        {"message_count": {"$exists": False}},
+        {"search_tokens": {"$exists": False}}
+    ]}
+    cursor = conversations.find(query_filter).batch_size(batch_size)
+    if limit:
+        cursor = cursor.limit(limit)
+
+    stats = {
+        "scanned": 0,
+        "migrated": 0,
+        "skipped": 0,
+        "bytes_before": 0,
+        "bytes_after": 0,
+        "max_bytes_before": 0,
+        "max_bytes_after": 0
+    }
+
+    for document in cursor:
+        stats["scanned"] += 1
+
+        conversation = Conversation.from_dict(document)
+        changes = {
+            "schema_version": SCHEMA_VERSION,
+            "messages": conversation.nodes,
+            "active_children": conversation.active_children,
+            **conversation.build_summary_fields(),
+            **conversation.build_search_fields()
+        }
+        converted = dict(document, **changes)
+
+        size_before = len(bson.encode(document))
+        size_after = len(bson.encode(converted))
+        stats["bytes_before"] += size_before
+        stats["bytes_after"] += size_after
+        stats["max_bytes_before"] = max(stats["max_bytes_before"], size_before)
+        stats["max_bytes_after"] = max(stats["max_bytes_after"], size_after)
+
+        if dry_run:
+            continue
+
+        result = conversations.update_one(
+            {"_id": document["_id"], "updated_at": document.get("updated_at")},
+            {"$set": changes}
+        )
+        if result.matched_count:
+            stats["migrated"] += 1
+        else:
+            stats["skipped"] += 1
+            logger.warning(f"Bo qua conversation {document['_id']} (da thay doi trong luc migrate)")
+
+        if stats["scanned"] % batch_size == 0:
+            logger.info(f"Da xu ly {stats['scanned']} conversations")
+
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chuyen conversations sang cau truc cay version (schema 2) va bo sung field tom tat, tim kiem")
+    parser.add_argument("--batch-size", type=int, default=100,
+                        help="So document moi batch khi doc tu MongoDB (mac dinh: 100)")
+    parser.add_argument("--limit", type=int, default=None,
+                        help="Chi xu ly N conversation dau tien")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Chi tinh kich thuoc truoc/sau, khong ghi database")
+
+    args = parser.parse_args()
+
+    stats = migrate_conversations(batch_size=args.batch_size, dry_run=args.dry_run, limit=args.limit)
+
+    logger.info(
+        f"Scanned {stats['scanned']}, migrated {stats['migrated']}, skipped {stats['skipped']}"
+        f"{' (dry run)' if args.dry_run else ''}"
+    )
+    logger.info(
+        f"Kich thuoc: {stats['bytes_before']:,} B -> {stats['bytes_after']:,} B, "
+        f"document lon nhat: {stats['max_bytes_before']:,} B -> {stats['max_bytes_after']:,} B"
+    )
@@ -0,0 +1,39 @@
+import os
+import sys
+import argparse
+import logging
+
+# Set UTF-8 encoding cho console
+os.environ['PYTHONIOENCODING'] = 'utf-8'
+
+# Thêm thư mục cha vào sys.path để import các module từ thư mục backend
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.rollup_model import rebuild_rollups, get_daily_rollups, get_total_rollup
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("rebuild_rollups")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Tinh lai collection daily_rollups (thong ke theo ngay gio Viet Nam) tu users va conversations"
+    )
+    parser.add_argument("--days", type=int, default=7,
+                        help="So ngay gan nhat in ra sau khi tinh lai (mac dinh: 7)")
+
+    args = parser.parse_args()
+
+    day_count = rebuild_rollups()
+    logger.info(f"Da ghi {day_count} ngay vao daily_rollups")
+
+    for row in get_daily_rollups(args.days):
+        logger.info(
+            f"{row['date']}: {row['new_users']} users moi, {row['conversations_created']} conversations moi, "
+            f"{row['conversations_updated']} cap nhat, {row['messages']} tin nhan"
+        )
+
+    total = get_total_rollup()
+    logger.info(f"Tong: {total['messages']} tin nhan, {total['conversations_created']} conversations")
@@ -0,0 +1,28 @@
+import os
+import sys
+import argparse
+import logging
+
+# Set UTF-8 encoding cho console
+os.environ['PYTHONIOENCODING'] = 'utf-8'
+
+# Thêm thư mục cha vào sys.path để import các module từ thư mục backend
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.user_activity_model import rebuild_user_activity
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("rebuild_user_activity")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tinh lai bo dem tin nhan theo ngay (user_daily_activity) tu conversations")
+    parser.add_argument("--user-id", type=str, default=None,
+                        help="Chi tinh lai cho mot user (mac dinh: tat ca)")
+
+    args = parser.parse_args()
+
+    written = rebuild_user_activity(args.user_id)
+    logger.info(f"Da ghi {written} ban ghi (user, ngay)")
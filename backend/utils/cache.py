@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Cache LRU thread-safe có giới hạn kích thước và thời gian sống (TTL)
+
+    Dùng chung cho các lớp cache in-process (query embedding, response...).
+    Các bộ đếm hit/miss/eviction được giữ lại để expose qua API health.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        """
+        Args:
+            maxsize (int): Số phần tử tối đa trong cache
+            ttl (float): Thời gian sống của mỗi phần tử (giây), None = không hết hạn
+        """
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = ttl if ttl and ttl > 0 else None
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        """Lấy giá trị theo key, trả về default nếu không có hoặc đã hết hạn"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Thêm hoặc cập nhật một phần tử, loại bỏ phần tử cũ nhất nếu vượt giới hạn"""
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+            self._data[key] = (value, expires_at)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        """Xóa một phần tử khỏi cache"""
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def clear(self):
+        """Xóa toàn bộ cache (giữ nguyên các bộ đếm)"""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def get_stats(self):
+        """Lấy thống kê cache"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": round(self.hits / total, 4) if total > 0 else 0.0
+            }
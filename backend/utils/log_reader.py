@@ -0,0 +1,373 @@
+import os
+import re
+import gzip
+import json
+import logging
+import datetime
+from collections import deque
+from config import LOG_DIR
+
+# Cấu hình logging
+logger = logging.getLogger(__name__)
+
+# Kích thước block khi đọc ngược file log
+BLOCK_SIZE = 64 * 1024
+# Dòng dài hơn giới hạn này bị cắt (giữ bộ nhớ cố định khi gặp dòng bất thường)
+MAX_LINE_BYTES = 256 * 1024
+# Số byte tối đa được quét trong một lần query, hết budget thì trả về cursor để đọc tiếp
+MAX_SCAN_BYTES = 32 * 1024 * 1024
+MAX_PAGE_SIZE = 500
+
+# Các nguồn log: file hiện tại, các file đã xoay vòng nằm cạnh (app.log.1.gz, app.log.2.gz...)
+LOG_SOURCES = {
+    "app": os.path.join(LOG_DIR, "app.log"),
+    "error": os.path.join(LOG_DIR, "error.log"),
+    "embed_data": os.path.join(os.getcwd(), "embed_data.log")
+}
+
+# Định dạng text: '%(asctime)s - [%(trace_id)s] %(name)s - %(levelname)s - %(message)s' (trace_id có thể không có)
+TEXT_LINE_PATTERN = re.compile(
+    r'^(?P<ts>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3}) - '
+    r'(?:\[(?P<trace_id>[^\]]+)\] )?(?P<logger>\S+) - '
+    r'(?P<level>DEBUG|INFO|WARNING|ERROR|CRITICAL) - (?P<message>.*)$'
+)
+
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40, "CRITICAL": 50}
+
+def parse_line(line):
+    """
+    Parse dòng đầu của một log entry (JSON hoặc text), None nếu là dòng tiếp theo của entry trước (traceback...)
+
+    Returns:
+        dict: timestamp (datetime), level, logger, trace_id, message, exception
+    """
+    if line.startswith("{"):
+        try:
+            data = json.loads(line)
+            return {
+                "timestamp": datetime.datetime.fromisoformat(data["ts"]),
+                "level": data.get("level", "INFO"),
+                "logger": data.get("logger"),
+                "trace_id": data.get("trace_id"),
+                "message": data.get("message", ""),
+                "exception": data.get("exception")
+            }
+        except (ValueError, KeyError, TypeError):
+            return None
+
+    match = TEXT_LINE_PATTERN.match(line)
+    if not match:
+        return None
+    return {
+        "timestamp": datetime.datetime.strptime(match.group("ts"), "%Y-%m-%d %H:%M:%S,%f"),
+        "level": match.group("level"),
+        "logger": match.group("logger"),
+        "trace_id": match.group("trace_id"),
+        "message": match.group("message"),
+        "exception": None
+    }
+
+def _decode(raw):
+    if len(raw) > MAX_LINE_BYTES:
+        raw = raw[:MAX_LINE_BYTES]
+    return raw.decode("utf-8", errors="replace").rstrip("\r")
+
+def _reverse_lines(f, end):
+    """
+    Đọc ngược các dòng của file từ vị trí `end`, mỗi lần một block
+
+    Yields:
+        tuple: (offset bắt đầu dòng, số byte đã đọc thêm, nội dung dòng dạng bytes)
+    """
+    position = end
+    remainder = b""
+    while position > 0:
+        size = min(BLOCK_SIZE, position)
+        position -= size
+        f.seek(position)
+        block = f.read(size) + remainder
+
+        lines = block.split(b"\n")
+        # Offset bắt đầu của từng dòng tính xuôi từ đầu block (dòng cuối có thể chứa remainder đã bị cắt)
+        starts = []
+        offset = position
+        for line in lines:
+            starts.append(offset)
+            offset += len(line) + 1
+
+        for index in range(len(lines) - 1, 0, -1):
+            yield starts[index], size, lines[index]
+            size = 0
+
+        remainder = lines[0]
+        if len(remainder) > MAX_LINE_BYTES:
+            # Chỉ giữ phần đầu của dòng quá dài, bộ nhớ không tăng theo độ dài dòng
+            remainder = remainder[:MAX_LINE_BYTES]
+    if remainder:
+        yield 0, 0, remainder
+
+def _forward_lines(f):
+    """Đọc xuôi các dòng (dùng cho file gzip, không seek ngược được)"""
+    offset = 0
+    for line in f:
+        yield offset, len(line), line.rstrip(b"\n")
+        offset += len(line)
+
+class LogQuery:
+    """Điều kiện lọc log: level tối thiểu, khoảng thời gian, chuỗi con (không phân biệt hoa thường)"""
+
+    def __init__(self, level=None, since=None, until=None, search=None):
+        self.min_level = LEVELS.get((level or "").upper(), 0)
+        self.since = self._to_local(since)
+        self.until = self._to_local(until)
+        self.search = (search or "").lower()
+
+    @staticmethod
+    def _to_local(value):
+        """Timestamp trong log là giờ local không có timezone, chuyển mốc thời gian có timezone về cùng dạng"""
+        if value is not None and value.tzinfo is not None:
+            return value.astimezone().replace(tzinfo=None)
+        return value
+
+    def matches(self, entry):
+        if self.min_level and LEVELS.get(entry["level"], 0) < self.min_level:
+            return False
+        timestamp = entry["timestamp"]
+        if timestamp is not None:
+            if self.since and timestamp < self.since:
+                return False
+            if self.until and timestamp > self.until:
+                return False
+        if self.search:
+            haystack = " ".join(filter(None, (entry["message"], entry["logger"], entry.get("exception"), entry.get("trace_id"))))
+            if self.search not in haystack.lower():
+                return False
+        return True
+
+    def is_before_range(self, entry):
+        """Entry cũ hơn `since`: mọi entry trước nó trong file cũng cũ hơn, có thể dừng đọc"""
+        return self.since is not None and entry["timestamp"] is not None and entry["timestamp"] < self.since
+
+def _make_entry(header, continuation):
+    entry = dict(header) if header else {
+        "timestamp": None, "level": "INFO", "logger": None, "trace_id": None, "message": "", "exception": None
+    }
+    if continuation:
+        extra = "\n".join(continuation)
+        if header is None:
+            entry["message"] = extra
+        else:
+            entry["exception"] = f"{entry['exception']}\n{extra}" if entry.get("exception") else extra
+    return entry
+
+class LogReader:
+    """
+    Đọc log từ cuối file về đầu theo từng block, lọc và phân trang bằng cursor qua cả các file đã xoay vòng
+
+    Bộ nhớ dùng không phụ thuộc kích thước file: file thường được đọc ngược theo block,
+    file gzip được đọc xuôi theo stream và chỉ giữ lại `limit` entry cuối cùng khớp điều kiện.
+    Cursor có dạng "<chỉ số file>:<offset>": đọc tiếp các entry nằm trước offset (byte, tính trên
+    dữ liệu đã giải nén) của file đó, file 0 là file hiện tại, 1 là file xoay vòng gần nhất...
+    """
+
+    def __init__(self, sources=None):
+        self.sources = sources or LOG_SOURCES
+
+    def get_files(self, source):
+        """Danh sách file của một nguồn, từ mới tới cũ"""
+        base = self.sources[source]
+        files = [base] if os.path.exists(base) else []
+        index = 1
+        while True:
+            for candidate in (f"{base}.{index}.gz", f"{base}.{index}"):
+                if os.path.exists(candidate):
+                    files.append(candidate)
+                    break
+            else:
+                break
+            index += 1
+        return files
+
+    def list_sources(self):
+        """Các nguồn log và tổng dung lượng (byte) của từng nguồn"""
+        result = []
+        for source in self.sources:
+            files = self.get_files(source)
+            result.append({
+                "source": source,
+                "files": len(files),
+                "size_bytes": sum(os.path.getsize(path) for path in files)
+            })
+        return result
+
+    @staticmethod
+    def parse_cursor(cursor):
+        """Cursor "<file>:<offset>" -> (file, offset), offset None nghĩa là đọc từ cuối file"""
+        if not cursor:
+            return 0, None
+        try:
+            file_index, offset = cursor.split(":", 1)
+            return max(0, int(file_index)), (max(0, int(offset)) if offset else None)
+        except ValueError:
+            raise ValueError("Cursor không hợp lệ")
+
+    def query(self, source="app", limit=100, query=None, cursor=None):
+        """
+        Lấy tối đa `limit` entry khớp điều kiện, mới nhất trước, bắt đầu từ cursor (None = cuối file mới nhất)
+
+        Returns:
+            dict: entries, next_cursor (None nếu đã đọc hết), scanned_bytes
+        """
+        if source not in self.sources:
+            raise ValueError(f"Nguồn log không hợp lệ: {source}")
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        query = query or LogQuery()
+        file_index, end = self.parse_cursor(cursor)
+        files = self.get_files(source)
+
+        entries = []
+        scanned = 0
+        next_cursor = None
+        while file_index < len(files):
+            path = files[file_index]
+            remaining = limit - len(entries)
+            if path.endswith(".gz"):
+                found, next_end, read_bytes, stop = self._scan_gzip(path, end, remaining, query)
+            else:
+                found, next_end, read_bytes, stop = self._scan_plain(path, end, remaining, query, MAX_SCAN_BYTES - scanned)
+            entries.extend(found)
+            scanned += read_bytes
+
+            if stop:
+                # Đã gặp entry cũ hơn `since`: phần còn lại và các file cũ hơn không cần đọc
+                next_cursor = None
+                break
+            if next_end:
+                # Dừng giữa file (đủ limit hoặc hết budget)
+                next_cursor = f"{file_index}:{next_end}"
+                break
+
+            file_index += 1
+            end = None
+            next_cursor = f"{file_index}:" if file_index < len(files) else None
+            if len(entries) >= limit or scanned >= MAX_SCAN_BYTES:
+                break
+
+        return {
+            "entries": [self._serialize(entry, source) for entry in entries],
+            "next_cursor": next_cursor,
+            "scanned_bytes": scanned
+        }
+
+    @staticmethod
+    def _serialize(entry, source):
+        return {
+            "timestamp": entry["timestamp"].isoformat() if entry["timestamp"] else None,
+            "level": entry["level"],
+            "source": source,
+            "logger": entry["logger"],
+            "trace_id": entry["trace_id"],
+            "message": entry["message"],
+            "exception": entry["exception"]
+        }
+
+    def _scan_plain(self, path, end, limit, query, budget):
+        """
+        Đọc ngược file thường từ `end` (None = cuối file)
+
+        Returns:
+            tuple: (entries, offset để đọc tiếp hoặc 0 nếu hết file, số byte đã đọc, có dừng vì `since` không)
+        """
+        found = []
+        scanned = 0
+        continuation = []
+        with open(path, 'rb') as f:
+            if end is None:
+                f.seek(0, os.SEEK_END)
+                end = f.tell()
+            for line_offset, read_bytes, raw in _reverse_lines(f, end):
+                scanned += read_bytes
+                line = _decode(raw)
+                if not line.strip():
+                    continue
+                header = parse_line(line)
+                if header is None:
+                    # Dòng tiếp theo của một entry (traceback), gom lại cho tới khi gặp dòng đầu
+                    continuation.append(line)
+                    continue
+                entry = _make_entry(header, list(reversed(continuation)))
+                continuation = []
+
+                if query.is_before_range(entry):
+                    return found, line_offset, scanned, True
+                if query.matches(entry):
+                    found.append(entry)
+                if len(found) >= limit or scanned >= budget:
+                    return found, line_offset, scanned, False
+
+        if continuation:
+            # Các dòng ở đầu file không có dòng đầu entry (file bị cắt khi xoay vòng)
+            entry = _make_entry(None, list(reversed(continuation)))
+            if query.matches(entry):
+                found.append(entry)
+        return found, 0, scanned, False
+
+    def _scan_gzip(self, path, end, limit, query):
+        """
+        Đọc xuôi file gzip tới offset `end` (None = cả file), chỉ giữ `limit` entry khớp cuối cùng
+
+        Returns:
+            tuple: như _scan_plain
+        """
+        matched = deque(maxlen=limit)
+        scanned = 0
+        first_timestamp = None
+        header = None
+        header_offset = 0
+        continuation = []
+
+        def flush():
+            if header is None and not continuation:
+                return
+            entry = _make_entry(header, continuation)
+            if query.matches(entry):
+                matched.append((header_offset, entry))
+
+        with gzip.open(path, 'rb') as f:
+            for line_offset, read_bytes, raw in _forward_lines(f):
+                if end is not None and line_offset >= end:
+                    break
+                scanned += read_bytes
+                line = _decode(raw)
+                if not line.strip():
+                    continue
+                parsed = parse_line(line)
+                if parsed is None:
+                    continuation.append(line)
+                    continue
+                flush()
+                header, header_offset, continuation = parsed, line_offset, []
+                if first_timestamp is None:
+                    first_timestamp = parsed["timestamp"]
+                if query.until and parsed["timestamp"] and parsed["timestamp"] > query.until:
+                    # Các entry từ đây trở đi đều mới hơn `until`
+                    header = None
+                    break
+            flush()
+
+        entries = [entry for _, entry in reversed(matched)]
+        if len(matched) == limit and matched[0][0] > 0:
+            # Có thể còn entry khớp nằm trước entry cũ nhất đã lấy
+            return entries, matched[0][0], scanned, False
+        stop = query.since is not None and first_timestamp is not None and first_timestamp < query.since
+        return entries, 0, scanned, stop
+
+# Global instance để implement singleton pattern
+_log_reader_instance = None
+
+def get_log_reader():
+    """Singleton pattern cho LogReader"""
+    global _log_reader_instance
+    if _log_reader_instance is None:
+        _log_reader_instance = LogReader()
+    return _log_reader_instance
@@ -0,0 +1,318 @@
+import os
+import sys
+import gzip
+import json
+import queue
+import atexit
+import random
+import shutil
+import logging
+import datetime
+import threading
+import logging.handlers
+from contextlib import contextmanager
+from config import (
+    LOG_LEVEL, LOG_DIR, LOG_CONSOLE_FORMAT, LOG_FILE_MAX_BYTES, LOG_FILE_BACKUP_COUNT,
+    LOG_FILE_ROTATION, LOG_QUEUE_SIZE, LOG_SAMPLING
+)
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: không có flock, chỉ hỗ trợ một process ghi log (chạy dev)
+    fcntl = None
+
+# Định dạng text cho console (trace_id được thêm bởi utils.tracing.install_log_record_factory)
+TEXT_FORMAT = '%(asctime)s - [%(trace_id)s] %(name)s - %(levelname)s - %(message)s'
+
+APP_LOG_FILE = "app.log"
+ERROR_LOG_FILE = "error.log"
+
+# Các thuộc tính chuẩn của LogRecord, những thuộc tính khác (truyền qua extra=) được ghi thêm vào JSON
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "trace_id"}
+
+_listener = None
+_queue_handler = None
+_hooks_registered = False
+_setup_lock = threading.Lock()
+
+class JsonFormatter(logging.Formatter):
+    """Mỗi record là một dòng JSON: ts, level, logger, trace_id, message (+ exception, các field extra)"""
+
+    def format(self, record):
+        data = {
+            "ts": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "trace_id": getattr(record, "trace_id", "-"),
+            "message": record.getMessage()
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                data[key] = value
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+class GzipRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    RotatingFileHandler nén các file đã xoay vòng thành app.log.1.gz, app.log.2.gz...
+
+    An toàn khi nhiều process (các worker gunicorn) cùng ghi một file: mỗi lần ghi giữ flock chia sẻ
+    trên file .lock và mở lại file nếu process khác vừa xoay vòng, việc xoay vòng giữ flock độc quyền
+    và chỉ làm khi file (theo kích thước trên đĩa) vẫn còn vượt ngưỡng. File được mở ở chế độ append.
+    """
+
+    def __init__(self, filename, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.namer = self._gzip_name
+        self.rotator = self._gzip_rotate
+        self._lock_path = f"{self.baseFilename}.lock"
+        self._lock_file = None
+        self._lock_pid = None
+
+    @staticmethod
+    def _gzip_name(name):
+        return f"{name}.gz"
+
+    @staticmethod
+    def _gzip_rotate(source, dest):
+        with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.remove(source)
+
+    @contextmanager
+    def _process_lock(self, exclusive):
+        if fcntl is None:
+            yield
+            return
+        # flock gắn với file được mở, process con sau fork phải mở file lock riêng
+        if self._lock_file is None or self._lock_pid != os.getpid():
+            self._lock_file = open(self._lock_path, 'a')
+            self._lock_pid = os.getpid()
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _stream_is_current(self):
+        """False nếu đường dẫn log giờ trỏ tới file khác (process khác đã xoay vòng)"""
+        if self.stream is None:
+            return True
+        try:
+            return os.fstat(self.stream.fileno()).st_ino == os.stat(self.baseFilename).st_ino
+        except OSError:
+            return False
+
+    def _reopen(self):
+        if self.stream is not None:
+            self.stream.close()
+        self.stream = self._open()
+
+    def _file_is_full(self, record):
+        if self.maxBytes <= 0:
+            return False
+        try:
+            size = os.stat(self.baseFilename).st_size
+        except OSError:
+            return False
+        return size > 0 and size + len(self.format(record)) + 1 >= self.maxBytes
+
+    def shouldRollover(self, record):
+        return self._file_is_full(record)
+
+    def emit(self, record):
+        try:
+            if self._file_is_full(record):
+                with self._process_lock(exclusive=True):
+                    if not self._stream_is_current():
+                        self._reopen()
+                    # Kiểm tra lại sau khi có lock: process khác có thể vừa xoay vòng xong
+                    if self._file_is_full(record):
+                        self.doRollover()
+            with self._process_lock(exclusive=False):
+                if not self._stream_is_current():
+                    self._reopen()
+                logging.FileHandler.emit(self, record)
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        super().close()
+        if self._lock_file is not None and self._lock_pid == os.getpid():
+            self._lock_file.close()
+        self._lock_file = None
+
+class SamplingFilter(logging.Filter):
+    """
+    Chỉ giữ lại một tỉ lệ record DEBUG/INFO của các logger được cấu hình (vd: vòng lặp debug nhiều log)
+
+    WARNING trở lên luôn được giữ. Tỉ lệ áp dụng cho logger và các logger con của nó.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        # Sắp xếp prefix dài trước để logger con ưu tiên cấu hình riêng
+        self.rates = sorted(rates.items(), key=lambda item: len(item[0]), reverse=True)
+
+    def _rate(self, name):
+        for prefix, rate in self.rates:
+            if name == prefix or name.startswith(prefix + "."):
+                return rate
+        return 1.0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+def parse_sampling(value):
+    """Đọc cấu hình sampling dạng "api.chat=0.1,models.conversation_model=0.25" """
+    rates = {}
+    for item in (value or "").split(","):
+        if "=" not in item:
+            continue
+        name, rate = item.split("=", 1)
+        try:
+            rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+        except ValueError:
+            continue
+    return rates
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler không bao giờ chặn request: khi queue đầy record bị bỏ qua và được đếm lại
+
+    Thread gọi log chỉ đẩy record vào queue, không copy record và không gộp args (getMessage) -
+    việc format do thread listener làm. Vì vậy không truyền vào args các object sẽ bị thay đổi ngay sau
+    lệnh log (code trong repo dùng f-string). Traceback được format ngay (exc_text) để không giữ frame
+    của request trong queue.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._exception_formatter = logging.Formatter()
+
+    def prepare(self, record):
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self._exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class DrainingQueueListener(logging.handlers.QueueListener):
+    """QueueListener chờ chỗ trống trong queue khi dừng, để luôn ghi hết các record còn lại"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+def _build_handlers(log_dir, stream=None):
+    console = logging.StreamHandler(stream or sys.stderr)
+    console.setFormatter(JsonFormatter() if LOG_CONSOLE_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+    handlers = [console]
+
+    def file_handler(name):
+        path = os.path.join(log_dir, name)
+        if LOG_FILE_ROTATION == "external":
+            # Xoay vòng bằng logrotate: WatchedFileHandler mở lại file khi nó bị đổi tên
+            return logging.handlers.WatchedFileHandler(path, encoding='utf-8')
+        return GzipRotatingFileHandler(
+            path, maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUP_COUNT, encoding='utf-8'
+        )
+
+    try:
+        os.makedirs(log_dir, exist_ok=True)
+        app_file = file_handler(APP_LOG_FILE)
+        app_file.setFormatter(JsonFormatter())
+        error_file = file_handler(ERROR_LOG_FILE)
+        error_file.setLevel(logging.ERROR)
+        error_file.setFormatter(JsonFormatter())
+        handlers.extend([app_file, error_file])
+    except OSError as e:
+        sys.stderr.write(f"Không tạo được file log trong {log_dir}: {e}\n")
+    return handlers
+
+def setup_logging(level=LOG_LEVEL, log_dir=LOG_DIR, sampling=LOG_SAMPLING, stream=None):
+    """
+    Cấu hình logging cho app: root logger chỉ đẩy record vào queue, một thread nền (QueueListener)
+    ghi ra console (`stream`, mặc định stderr) và các file JSON xoay vòng có nén trong `log_dir`
+
+    Gọi nhiều lần không tạo thêm listener.
+    """
+    global _listener, _queue_handler, _hooks_registered
+    from utils.tracing import install_log_record_factory
+
+    with _setup_lock:
+        if _listener is not None:
+            return _listener
+
+        install_log_record_factory()
+
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        _queue_handler = NonBlockingQueueHandler(log_queue)
+        rates = parse_sampling(sampling)
+        if rates:
+            # Lọc trước khi vào queue để record bị bỏ không tốn chi phí format
+            _queue_handler.addFilter(SamplingFilter(rates))
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_queue_handler)
+        root.setLevel(level)
+
+        _listener = DrainingQueueListener(log_queue, *_build_handlers(log_dir, stream), respect_handler_level=True)
+        _listener.start()
+        if not _hooks_registered:
+            atexit.register(stop_logging)
+            if hasattr(os, "register_at_fork"):
+                # Worker được fork (gunicorn --preload) không có thread listener của process cha
+                os.register_at_fork(after_in_child=_restart_listener_after_fork)
+            _hooks_registered = True
+        return _listener
+
+def _restart_listener_after_fork():
+    global _listener
+    if _listener is None:
+        return
+    # Queue mới: lock của queue cũ có thể đang bị giữ bởi thread không còn tồn tại sau fork
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _queue_handler.queue = log_queue
+    _listener = DrainingQueueListener(log_queue, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
+
+def stop_logging():
+    """Ghi nốt các record còn trong queue và dừng thread listener"""
+    global _listener
+    with _setup_lock:
+        if _listener is None:
+            return
+        try:
+            _listener.stop()
+        except Exception:
+            pass
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+def get_logging_stats():
+    """Số record đang chờ trong queue và số record bị bỏ do queue đầy"""
+    if _queue_handler is None:
+        return {"enabled": False}
+    return {
+        "enabled": True,
+        "queued": _queue_handler.queue.qsize(),
+        "queue_size": LOG_QUEUE_SIZE,
+        "dropped": _queue_handler.dropped
+    }
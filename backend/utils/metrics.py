@@ -0,0 +1,365 @@
+import time
+import bisect
+import logging
+import threading
+from functools import wraps
+from utils.tracing import SpanContext, add_span
+
+# Cấu hình logging
+logger = logging.getLogger(__name__)
+
+# Bucket mặc định cho histogram độ trễ (giây)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Tên các metric dùng chung
+HTTP_REQUEST_SECONDS = "nutribot_http_request_duration_seconds"
+HTTP_REQUESTS_TOTAL = "nutribot_http_requests_total"
+HTTP_IN_FLIGHT = "nutribot_http_requests_in_flight"
+STAGE_SECONDS = "nutribot_stage_duration_seconds"
+STAGE_ERRORS_TOTAL = "nutribot_stage_errors_total"
+STAGE_IN_FLIGHT = "nutribot_stage_in_flight"
+MONGO_COMMANDS_TOTAL = "nutribot_mongo_commands_total"
+
+# Lệnh MongoDB chỉ đọc, các lệnh khác được tính là ghi
+MONGO_READ_COMMANDS = frozenset(("find", "aggregate", "count", "distinct", "getMore", "listCollections", "listIndexes"))
+# Lệnh nội bộ của driver, không tính vào metrics
+MONGO_IGNORED_COMMANDS = frozenset(("hello", "isMaster", "ismaster", "ping", "endSessions", "saslStart", "saslContinue", "buildInfo"))
+
+class Histogram:
+    """Histogram cộng dồn theo bucket (giống Prometheus), observe chỉ tốn một bisect và một lock"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self):
+        """Số lần đo theo từng bucket (cộng dồn), tổng và số lần đo"""
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self.sum, self.count
+
+        cumulative = []
+        running = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            running += bucket_count
+            cumulative.append((bound, running))
+        return {"buckets": cumulative, "sum": total, "count": count}
+
+    @staticmethod
+    def quantile(snapshot, q):
+        """Ước lượng quantile từ bucket (nội suy tuyến tính trong bucket chứa quantile)"""
+        count = snapshot["count"]
+        if not count:
+            return 0.0
+        rank = q * count
+        lower_bound, lower_count = 0.0, 0
+        for bound, cumulative in snapshot["buckets"]:
+            if cumulative >= rank:
+                if bound == float("inf"):
+                    return lower_bound
+                in_bucket = cumulative - lower_count
+                fraction = (rank - lower_count) / in_bucket if in_bucket else 0.0
+                return lower_bound + (bound - lower_bound) * fraction
+            lower_bound, lower_count = bound, cumulative
+        return lower_bound
+
+class Counter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+class Gauge:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+class MetricsRegistry:
+    """
+    Registry các histogram, counter, gauge theo tên và label
+
+    Mỗi bộ (tên, label) được tạo một lần, các lần sau chỉ là một lần tra dict.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._help = {}
+        self._types = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def _get(self, kind, factory, name, help_text, labels):
+        key = (name, tuple(sorted(labels.items())) if labels else ())
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    metric = factory()
+                    self._metrics[key] = metric
+                    self._types.setdefault(name, kind)
+                    if help_text:
+                        self._help.setdefault(name, help_text)
+        return metric
+
+    def histogram(self, name, help_text="", labels=None, buckets=DEFAULT_BUCKETS):
+        return self._get("histogram", lambda: Histogram(buckets), name, help_text, labels)
+
+    def counter(self, name, help_text="", labels=None):
+        return self._get("counter", Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text="", labels=None):
+        return self._get("gauge", Gauge, name, help_text, labels)
+
+    def collect(self, name):
+        """Tất cả (labels, metric) của một tên metric"""
+        with self._lock:
+            items = list(self._metrics.items())
+        return [(dict(labels), metric) for (metric_name, labels), metric in items if metric_name == name]
+
+    def uptime_seconds(self):
+        return time.time() - self.started_at
+
+    def render_prometheus(self):
+        """Xuất toàn bộ metrics theo Prometheus text exposition format (version 0.0.4)"""
+        with self._lock:
+            items = sorted(self._metrics.items(), key=lambda item: item[0])
+            types = dict(self._types)
+            help_texts = dict(self._help)
+
+        lines = []
+        current_name = None
+        for (name, labels), metric in items:
+            if name != current_name:
+                current_name = name
+                if name in help_texts:
+                    lines.append(f"# HELP {name} {help_texts[name]}")
+                lines.append(f"# TYPE {name} {types[name]}")
+
+            if isinstance(metric, Histogram):
+                snapshot = metric.snapshot()
+                for bound, cumulative in snapshot["buckets"]:
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {snapshot['sum']}")
+                lines.append(f"{name}_count{_format_labels(labels)} {snapshot['count']}")
+            else:
+                lines.append(f"{name}{_format_labels(labels)} {metric.value}")
+
+        lines.append("# TYPE nutribot_process_uptime_seconds gauge")
+        lines.append(f"nutribot_process_uptime_seconds {self.uptime_seconds():.3f}")
+        return "\n".join(lines) + "\n"
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        escaped.append(f'{key}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+# Global instance để implement singleton pattern
+_metrics_instance = MetricsRegistry()
+
+def get_metrics():
+    """Registry metrics dùng chung trong process"""
+    return _metrics_instance
+
+def record_stage(stage, seconds, error=False, **attrs):
+    """Ghi nhận thời gian của một bước trong hot path (đồng thời thêm span vào trace của request hiện tại)"""
+    _observe_stage(stage, seconds, error)
+    add_span(stage, seconds, error=error, **attrs)
+
+def _observe_stage(stage, seconds, error=False):
+    _metrics_instance.histogram(STAGE_SECONDS, "Thoi gian tung buoc xu ly", {"stage": stage}).observe(seconds)
+    if error:
+        _metrics_instance.counter(STAGE_ERRORS_TOTAL, "So lan loi theo buoc xu ly", {"stage": stage}).inc()
+
+class StageTimer:
+    """Context manager/decorator đo thời gian một bước, đồng thời tăng/giảm gauge số bước đang chạy"""
+
+    __slots__ = ("stage", "_start", "_in_flight", "_span")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self._in_flight = _metrics_instance.gauge(STAGE_IN_FLIGHT, "So buoc xu ly dang chay", {"stage": self.stage})
+        self._in_flight.inc()
+        self._span = SpanContext(self.stage)
+        self._span.__enter__()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _observe_stage(self.stage, time.perf_counter() - self._start, error=exc_type is not None)
+        self._span.__exit__(exc_type, exc, tb)
+        self._in_flight.dec()
+        return False
+
+    def __call__(self, fn):
+        stage = self.stage
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with StageTimer(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+
+def timed(stage):
+    """Đo thời gian một bước: `with timed("llm_generate"):` hoặc `@timed("prompt_build")`"""
+    return StageTimer(stage)
+
+def stage_summary(stage):
+    """Thống kê (ms) của một bước: số lần, trung bình, p50, p95, p99, số lỗi"""
+    histogram = _metrics_instance.histogram(STAGE_SECONDS, "Thoi gian tung buoc xu ly", {"stage": stage})
+    errors = _metrics_instance.counter(STAGE_ERRORS_TOTAL, "So lan loi theo buoc xu ly", {"stage": stage})
+    return summarize_histogram(histogram.snapshot(), errors.value)
+
+def summarize_histogram(snapshot, errors=0):
+    count = snapshot["count"]
+    return {
+        "count": count,
+        "errors": errors,
+        "mean_ms": round(snapshot["sum"] / count * 1000, 2) if count else 0.0,
+        "p50_ms": round(Histogram.quantile(snapshot, 0.50) * 1000, 2),
+        "p95_ms": round(Histogram.quantile(snapshot, 0.95) * 1000, 2),
+        "p99_ms": round(Histogram.quantile(snapshot, 0.99) * 1000, 2)
+    }
+
+def http_summary():
+    """Thống kê request HTTP theo route: số request, số lỗi 5xx, độ trễ"""
+    routes = {}
+    for labels, histogram in _metrics_instance.collect(HTTP_REQUEST_SECONDS):
+        key = f"{labels.get('method')} {labels.get('endpoint')}"
+        snapshot = histogram.snapshot()
+        route = routes.setdefault(key, {"snapshots": [], "errors": 0})
+        route["snapshots"].append(snapshot)
+        if str(labels.get("status", "")).startswith("5"):
+            route["errors"] += snapshot["count"]
+
+    result = {}
+    for key, route in routes.items():
+        merged = _merge_snapshots(route["snapshots"])
+        result[key] = summarize_histogram(merged, route["errors"])
+    return result
+
+def _merge_snapshots(snapshots):
+    buckets = [[bound, 0] for bound, _ in snapshots[0]["buckets"]]
+    total = 0.0
+    count = 0
+    for snapshot in snapshots:
+        for bucket, (_, cumulative) in zip(buckets, snapshot["buckets"]):
+            bucket[1] += cumulative
+        total += snapshot["sum"]
+        count += snapshot["count"]
+    return {"buckets": [tuple(bucket) for bucket in buckets], "sum": total, "count": count}
+
+def init_app(app):
+    """
+    Đo mọi request Flask: histogram độ trễ theo (method, route, status), counter và gauge request đang xử lý
+
+    Thời gian được ghi ở teardown_request nên response streaming (stream_with_context)
+    được tính tới khi stream kết thúc.
+    """
+    from flask import g, request
+
+    in_flight = _metrics_instance.gauge(HTTP_IN_FLIGHT, "So request dang xu ly")
+
+    @app.before_request
+    def _metrics_start_request():
+        g._metrics_start = time.perf_counter()
+        in_flight.inc()
+
+    @app.after_request
+    def _metrics_record_status(response):
+        g._metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def _metrics_end_request(exc):
+        start = g.pop("_metrics_start", None)
+        if start is None:
+            return
+        in_flight.dec()
+
+        status = 500 if exc is not None else g.pop("_metrics_status", 500)
+        labels = {
+            "method": request.method,
+            # Dùng rule của route (vd: /api/conversations/<conversation_id>) để số label không tăng theo ID
+            "endpoint": request.url_rule.rule if request.url_rule is not None else "unmatched",
+            "status": str(status)
+        }
+        _metrics_instance.histogram(HTTP_REQUEST_SECONDS, "Thoi gian xu ly request HTTP", labels).observe(
+            time.perf_counter() - start
+        )
+        _metrics_instance.counter(HTTP_REQUESTS_TOTAL, "So request HTTP", labels).inc()
+
+def jwt_required(*jwt_args, **jwt_kwargs):
+    """jwt_required của flask_jwt_extended, có đo thời gian xác thực token (bước jwt_verify)"""
+    from flask import current_app
+    from flask_jwt_extended import verify_jwt_in_request
+
+    def wrapper(fn):
+        @wraps(fn)
+        def decorator(*args, **kwargs):
+            with timed("jwt_verify"):
+                verify_jwt_in_request(*jwt_args, **jwt_kwargs)
+            return current_app.ensure_sync(fn)(*args, **kwargs)
+        return decorator
+    return wrapper
+
+def mongo_event_listeners():
+    """Listener đo thời gian các lệnh MongoDB (truyền vào MongoClient(event_listeners=...))"""
+    return [_mongo_listener]
+
+def _create_mongo_listener():
+    from pymongo import monitoring
+
+    class MongoCommandMetrics(monitoring.CommandListener):
+        """Ghi thời gian mỗi lệnh MongoDB vào bước mongo_read / mongo_write"""
+
+        def started(self, event):
+            pass
+
+        def _record(self, event, status):
+            if event.command_name in MONGO_IGNORED_COMMANDS:
+                return
+            stage = "mongo_read" if event.command_name in MONGO_READ_COMMANDS else "mongo_write"
+            record_stage(stage, event.duration_micros / 1e6, error=status == "failed", command=event.command_name)
+            _metrics_instance.counter(
+                MONGO_COMMANDS_TOTAL, "So lenh MongoDB",
+                {"command": event.command_name, "status": status}
+            ).inc()
+
+        def succeeded(self, event):
+            self._record(event, "succeeded")
+
+        def failed(self, event):
+            self._record(event, "failed")
+
+    return MongoCommandMetrics()
+
+_mongo_listener = _create_mongo_listener()
@@ -0,0 +1,225 @@
+import time
+import logging
+import datetime
+import threading
+from config import ADMIN_SNAPSHOT_REFRESH_SECONDS, ADMIN_SNAPSHOT_IDLE_SECONDS
+
+# Cấu hình logging
+logger = logging.getLogger(__name__)
+
+# Khi refresh lỗi liên tiếp, lần thử tiếp theo cách lần trước refresh_interval * 2^(số lần lỗi - 1), tối đa bằng giá trị này (giây)
+MAX_REFRESH_BACKOFF_SECONDS = 600
+
+# Global instance để implement singleton pattern
+_snapshot_cache_instance = None
+_snapshot_cache_lock = threading.Lock()
+
+def get_snapshot_cache():
+    """
+    Singleton pattern để các endpoint admin dùng chung một snapshot cache (một thread refresh mỗi process)
+    """
+    global _snapshot_cache_instance
+    if _snapshot_cache_instance is None:
+        with _snapshot_cache_lock:
+            if _snapshot_cache_instance is None:
+                _snapshot_cache_instance = SnapshotCache(
+                    refresh_interval=ADMIN_SNAPSHOT_REFRESH_SECONDS,
+                    idle_timeout=ADMIN_SNAPSHOT_IDLE_SECONDS
+                )
+    return _snapshot_cache_instance
+
+class SnapshotCache:
+    """
+    Cache snapshot theo kiểu stale-while-revalidate
+
+    Mỗi snapshot có tên và một hàm loader. Request chỉ đọc snapshot gần nhất (kèm tuổi của nó),
+    một thread nền duy nhất gọi lại loader sau mỗi `refresh_interval` giây. Snapshot không được
+    đọc trong `idle_timeout` giây sẽ không được refresh nữa cho tới lần đọc tiếp theo
+    (lần đọc đó vẫn trả về snapshot cũ ngay và đánh thức thread refresh).
+    Chỉ lần đọc đầu tiên của mỗi snapshot phải chờ loader, các request đồng thời chờ chung một lần load.
+    Lần refresh tiếp theo được tính từ lần thử gần nhất (dù thành công hay lỗi), khi lỗi liên tiếp
+    thì khoảng cách tăng dần để loader hỏng (vd: Mongo không kết nối được) không bị gọi liên tục.
+    """
+
+    def __init__(self, refresh_interval=30, idle_timeout=600):
+        """
+        Args:
+            refresh_interval (float): Khoảng thời gian giữa hai lần refresh (giây)
+            idle_timeout (float): Ngừng refresh snapshot không được đọc sau khoảng thời gian này (giây)
+        """
+        self.refresh_interval = max(1.0, float(refresh_interval))
+        self.idle_timeout = max(self.refresh_interval, float(idle_timeout))
+
+        self._loaders = {}
+        self._snapshots = {}
+        self._last_access = {}
+        self._next_attempt = {}
+        self._failures = {}
+        self._load_locks = {}
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.refreshes = 0
+        self.errors = 0
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            # Sau khi fork (gunicorn worker) thread của process cha không còn, mỗi process tự khởi động lại
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="snapshot-refresher", daemon=True)
+                self._thread.start()
+                logger.info(f"Đã khởi động SnapshotCache (refresh={self.refresh_interval:.0f}s, idle={self.idle_timeout:.0f}s)")
+
+    def get(self, name, loader, force=False):
+        """
+        Lấy snapshot theo tên, lần đầu tiên (hoặc khi force) sẽ gọi loader và chờ kết quả
+
+        Args:
+            name (str): Tên snapshot
+            loader (callable): Hàm không tham số trả về dữ liệu của snapshot
+            force (bool): Bỏ qua snapshot hiện có và load lại ngay
+
+        Returns:
+            tuple: (dữ liệu, thông tin snapshot gồm age_seconds, refreshed_at, refresh_interval)
+        """
+        self._ensure_started()
+        with self._lock:
+            self._loaders[name] = loader
+            self._last_access[name] = time.monotonic()
+            snapshot = self._snapshots.get(name)
+
+        if snapshot is not None and not force:
+            age = time.monotonic() - snapshot["loaded_at"]
+            with self._lock:
+                self.hits += 1
+                if age > self.refresh_interval:
+                    self.stale_hits += 1
+            if age > self.refresh_interval:
+                self._wakeup.set()
+            return snapshot["value"], self._describe(snapshot)
+
+        with self._lock:
+            self.misses += 1
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+
+        with load_lock:
+            # Request khác có thể đã load xong trong lúc chờ lock
+            current = self._snapshots.get(name)
+            if current is None or (force and current is snapshot):
+                current = self._load(name, loader, raise_errors=True)
+                # Để thread refresh tính lại thời điểm refresh tiếp theo
+                self._wakeup.set()
+        return current["value"], self._describe(current)
+
+    def _load(self, name, loader, raise_errors=False):
+        """Gọi loader và lưu snapshot mới, lỗi khi refresh nền chỉ được ghi log (giữ snapshot cũ)"""
+        started = time.perf_counter()
+        try:
+            value = loader()
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+                failures = self._failures.get(name, 0) + 1
+                self._failures[name] = failures
+                backoff = min(self.refresh_interval * 2 ** (failures - 1), max(self.refresh_interval, MAX_REFRESH_BACKOFF_SECONDS))
+                self._next_attempt[name] = time.monotonic() + backoff
+            if raise_errors:
+                raise
+            logger.error(f"Lỗi refresh snapshot {name} (lần {failures}, thử lại sau {backoff:.0f}s): {e}")
+            return None
+
+        snapshot = {
+            "value": value,
+            "loaded_at": time.monotonic(),
+            "refreshed_at": datetime.datetime.now().isoformat(),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 2)
+        }
+        with self._lock:
+            self._snapshots[name] = snapshot
+            self._failures.pop(name, None)
+            self._next_attempt[name] = snapshot["loaded_at"] + self.refresh_interval
+            self.refreshes += 1
+        return snapshot
+
+    def _describe(self, snapshot):
+        return {
+            "age_seconds": round(time.monotonic() - snapshot["loaded_at"], 2),
+            "refreshed_at": snapshot["refreshed_at"],
+            "refresh_interval": self.refresh_interval,
+            "load_ms": snapshot["duration_ms"]
+        }
+
+    def _due(self):
+        """Các snapshot đã đến hạn refresh và vẫn còn được đọc gần đây"""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                (name, loader) for name, loader in self._loaders.items()
+                if name in self._snapshots
+                and now - self._last_access.get(name, 0) <= self.idle_timeout
+                and now >= self._next_attempt.get(name, 0)
+            ]
+
+    def _next_wait(self):
+        """Thời gian chờ tới lần thử refresh sớm nhất, None nếu không còn snapshot nào được đọc"""
+        now = time.monotonic()
+        with self._lock:
+            attempts = [
+                self._next_attempt.get(name, 0) for name in self._snapshots
+                if now - self._last_access.get(name, 0) <= self.idle_timeout
+            ]
+        if not attempts:
+            return None
+        return max(0.1, min(attempts) - now)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self._next_wait())
+            self._wakeup.clear()
+
+            for name, loader in self._due():
+                with self._load_locks.setdefault(name, threading.Lock()):
+                    self._load(name, loader)
+
+    def invalidate(self, name=None):
+        """Xóa một snapshot (hoặc tất cả), lần đọc tiếp theo sẽ load lại"""
+        with self._lock:
+            if name is None:
+                self._snapshots.clear()
+                self._next_attempt.clear()
+                self._failures.clear()
+            else:
+                self._snapshots.pop(name, None)
+                self._next_attempt.pop(name, None)
+                self._failures.pop(name, None)
+
+    def get_stats(self):
+        """Lấy thống kê snapshot cache"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "refresh_interval": self.refresh_interval,
+                "idle_timeout": self.idle_timeout,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale_hits": self.stale_hits,
+                "refreshes": self.refreshes,
+                "errors": self.errors,
+                "snapshots": {
+                    name: {
+                        "age_seconds": round(now - snapshot["loaded_at"], 2),
+                        "load_ms": snapshot["duration_ms"],
+                        "failures": self._failures.get(name, 0),
+                        "idle": now - self._last_access.get(name, 0) > self.idle_timeout
+                    }
+                    for name, snapshot in self._snapshots.items()
+                }
+            }
@@ -0,0 +1,61 @@
+import math
+import threading
+from collections import deque
+
+
+def percentile(sorted_values, pct):
+    """
+    Tính percentile (nội suy tuyến tính) trên danh sách đã sắp xếp
+
+    Args:
+        sorted_values (list): Danh sách giá trị đã sắp xếp tăng dần
+        pct (float): Percentile cần tính (0-100)
+    """
+    if not sorted_values:
+        return 0.0
+    if len(sorted_values) == 1:
+        return float(sorted_values[0])
+
+    rank = (len(sorted_values) - 1) * pct / 100.0
+    lower = math.floor(rank)
+    upper = math.ceil(rank)
+    if lower == upper:
+        return float(sorted_values[int(rank)])
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (rank - lower)
+
+
+class LatencyStats:
+    """
+    Thống kê độ trễ trên cửa sổ các lần đo gần nhất
+
+    Giữ tối đa `window` giá trị (ms) để tính percentile, cùng tổng số lần đo từ khi khởi động.
+    """
+
+    def __init__(self, window=1000):
+        self._values = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total_ms = 0.0
+
+    def record(self, elapsed_ms):
+        """Ghi nhận một lần đo (ms)"""
+        with self._lock:
+            self._values.append(elapsed_ms)
+            self.count += 1
+            self.total_ms += elapsed_ms
+
+    def get_stats(self):
+        """Lấy thống kê độ trễ (ms)"""
+        with self._lock:
+            values = sorted(self._values)
+            count = self.count
+            total_ms = self.total_ms
+
+        return {
+            "count": count,
+            "mean_ms": round(total_ms / count, 3) if count else 0.0,
+            "p50_ms": round(percentile(values, 50), 3),
+            "p95_ms": round(percentile(values, 95), 3),
+            "p99_ms": round(percentile(values, 99), 3),
+            "max_ms": round(values[-1], 3) if values else 0.0
+        }
@@ -0,0 +1,84 @@
+import re
+import unicodedata
+
+# Một từ (âm tiết) sau khi bỏ dấu
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def normalize_query(text):
+    """
+    Chuẩn hóa câu hỏi để dùng làm khóa cache
+
+    - Chuẩn hóa Unicode về dạng NFC (tránh khác biệt giữa dấu tổ hợp và dấu dựng sẵn)
+    - Gộp khoảng trắng thừa
+    - Chuyển về chữ thường
+    """
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFC", text)
+    return " ".join(text.split()).casefold()
+
+
+def fold_vietnamese(text):
+    """
+    Bỏ dấu tiếng Việt và chuyển về chữ thường
+
+    "Rau Xanh", "RAU XANH" và "rau xanh" (không dấu) đều thành "rau xanh"
+    """
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFD", text)
+    text = "".join(char for char in text if unicodedata.category(char) != "Mn")
+    return text.replace("đ", "d").replace("Đ", "D").casefold()
+
+
+def tokenize(text):
+    """Tách văn bản thành các từ đã bỏ dấu (dùng cho search index)"""
+    return WORD_PATTERN.findall(fold_vietnamese(text))
+
+
+def find_token_spans(text, tokens):
+    """
+    Tìm vị trí các từ trong văn bản gốc có dạng bỏ dấu nằm trong tokens
+
+    Returns:
+        tuple: (văn bản dạng NFC, danh sách (start, end) trong văn bản đó)
+    """
+    text = unicodedata.normalize("NFC", text or "")
+
+    # Bỏ dấu từng ký tự và giữ vị trí ký tự gốc tương ứng
+    folded_chars = []
+    positions = []
+    for index, char in enumerate(text):
+        for folded_char in fold_vietnamese(char):
+            folded_chars.append(folded_char)
+            positions.append(index)
+    folded = "".join(folded_chars)
+
+    spans = []
+    for match in WORD_PATTERN.finditer(folded):
+        if match.group() in tokens:
+            spans.append((positions[match.start()], positions[match.end() - 1] + 1))
+    return text, spans
+
+
+def build_highlighted_preview(text, tokens, max_length=100, context=30):
+    """
+    Đoạn xem trước quanh từ khóa đầu tiên tìm thấy
+
+    Returns:
+        tuple: (preview, highlights) với highlights là các cặp [start, end] trong preview
+    """
+    text, spans = find_token_spans(text, tokens)
+
+    first = spans[0][0] if spans else 0
+    start = max(0, min(first - context, len(text) - max_length))
+    end = min(len(text), start + max_length)
+
+    prefix = "..." if start > 0 else ""
+    suffix = "..." if end < len(text) else ""
+    offset = len(prefix) - start
+
+    preview = prefix + text[start:end] + suffix
+    highlights = [[s + offset, e + offset] for s, e in spans if s >= start and e <= end]
+    return preview, highlights
@@ -0,0 +1,358 @@
+import time
+import uuid
+import logging
+import datetime
+import threading
+import contextvars
+from collections import deque
+from functools import wraps
+from config import (
+    TRACING_ENABLED, TRACE_SLOW_REQUEST_MS, TRACE_STORE, TRACE_BUFFER_SIZE,
+    TRACE_MAX_SPANS, SERVER_TIMING_ENABLED
+)
+
+# Cấu hình logging
+logger = logging.getLogger(__name__)
+
+# Trace và span đang active của request hiện tại (mỗi thread / context có giá trị riêng)
+_current_trace = contextvars.ContextVar("nutribot_trace", default=None)
+_current_span = contextvars.ContextVar("nutribot_span", default=None)
+
+# Header nhận trace ID từ client/proxy (nếu hợp lệ) và trả trace ID về cho client
+TRACE_ID_HEADER = "X-Trace-Id"
+SLOW_TRACES_COLLECTION = "slow_traces"
+
+class Span:
+    """Một bước trong trace, thời gian tính bằng giây kể từ lúc bắt đầu trace"""
+
+    __slots__ = ("span_id", "parent_id", "name", "start", "duration", "error", "attrs")
+
+    def __init__(self, span_id, parent_id, name, start, attrs=None):
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.start = start
+        self.duration = None
+        self.error = False
+        self.attrs = attrs or {}
+
+    def to_dict(self):
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ms": round(self.start * 1000, 2),
+            "duration_ms": round((self.duration or 0.0) * 1000, 2),
+            "error": self.error,
+            "attrs": self.attrs
+        }
+
+class Trace:
+    """
+    Cây span của một request
+
+    Số span được giới hạn bởi `max_spans` (các lệnh MongoDB cũng là span), span vượt giới hạn
+    vẫn được đo cho các span cha nhưng không được lưu lại.
+    """
+
+    def __init__(self, name, trace_id=None, max_spans=TRACE_MAX_SPANS):
+        self.trace_id = trace_id or uuid.uuid4().hex[:16]
+        self.name = name
+        self.started_at = datetime.datetime.now()
+        self.attrs = {}
+        self.spans = []
+        self.dropped = 0
+        self.duration = None
+        self.max_spans = max_spans
+        self._start = time.perf_counter()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def elapsed(self):
+        return time.perf_counter() - self._start
+
+    def start_span(self, name, parent_id=None, attrs=None):
+        with self._lock:
+            self._next_id += 1
+            span = Span(self._next_id, parent_id, name, self.elapsed(), attrs)
+            if len(self.spans) < self.max_spans:
+                self.spans.append(span)
+            else:
+                self.dropped += 1
+        return span
+
+    def end_span(self, span, error=False):
+        span.duration = self.elapsed() - span.start
+        span.error = span.error or error
+
+    def finish(self):
+        self.duration = self.elapsed()
+        return self
+
+    def server_timing(self):
+        """
+        Giá trị header Server-Timing: tổng thời gian theo tên span (span lồng nhau được tính riêng)
+
+        Vd: `rag.generate_response;dur=2310.5, vector_search;dur=41.2, total;dur=2402.7`
+        """
+        totals = {}
+        for span in self.spans:
+            if span.duration is not None:
+                totals[span.name] = totals.get(span.name, 0.0) + span.duration
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items()]
+        parts.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(parts)
+
+    def to_dict(self, include_spans=True):
+        data = {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": round((self.duration if self.duration is not None else self.elapsed()) * 1000, 2),
+            "attrs": self.attrs,
+            "span_count": len(self.spans),
+            "dropped_spans": self.dropped
+        }
+        if include_spans:
+            data["spans"] = [span.to_dict() for span in self.spans]
+        return data
+
+class SpanContext:
+    """Context manager/decorator mở một span con của span hiện tại, không làm gì nếu không có trace"""
+
+    __slots__ = ("name", "attrs", "_trace", "_span", "_token")
+
+    def __init__(self, name, attrs=None):
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self._trace = _current_trace.get()
+        if self._trace is None:
+            return self
+        parent = _current_span.get()
+        self._span = self._trace.start_span(self.name, parent.span_id if parent else None, dict(self.attrs or {}))
+        self._token = _current_span.set(self._span)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._trace is None:
+            return False
+        _current_span.reset(self._token)
+        self._trace.end_span(self._span, error=exc_type is not None)
+        return False
+
+    def set_attr(self, key, value):
+        if self._trace is not None:
+            self._span.attrs[key] = value
+
+    def __call__(self, fn):
+        name, attrs = self.name, self.attrs
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with SpanContext(name, attrs):
+                return fn(*args, **kwargs)
+        return wrapper
+
+def span(name, **attrs):
+    """Mở một span: `with span("conversation.save"):` hoặc `@span("rag.generate_response")`"""
+    return SpanContext(name, attrs)
+
+def add_span(name, seconds, error=False, **attrs):
+    """Thêm một span đã kết thúc (kéo dài `seconds` giây tính tới hiện tại) vào trace hiện tại"""
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    parent = _current_span.get()
+    end = trace.elapsed()
+    span_obj = trace.start_span(name, parent.span_id if parent else None, attrs)
+    span_obj.start = max(0.0, end - seconds)
+    span_obj.duration = seconds
+    span_obj.error = error
+
+def start_trace(name, trace_id=None):
+    """Bắt đầu trace mới cho context hiện tại, trả về token để truyền vào finish_trace"""
+    trace = Trace(name, trace_id=trace_id)
+    return trace, (_current_trace.set(trace), _current_span.set(None))
+
+def finish_trace(trace, tokens):
+    """Kết thúc trace và khôi phục context trước đó"""
+    trace_token, span_token = tokens
+    _current_span.reset(span_token)
+    _current_trace.reset(trace_token)
+    return trace.finish()
+
+def get_current_trace():
+    return _current_trace.get()
+
+def current_trace_id():
+    trace = _current_trace.get()
+    return trace.trace_id if trace is not None else None
+
+def install_log_record_factory():
+    """Thêm thuộc tính `trace_id` vào mọi log record ("-" khi không nằm trong request)"""
+    previous_factory = logging.getLogRecordFactory()
+    if getattr(previous_factory, "_adds_trace_id", False):
+        return
+
+    def record_factory(*args, **kwargs):
+        record = previous_factory(*args, **kwargs)
+        trace = _current_trace.get()
+        record.trace_id = trace.trace_id if trace is not None else "-"
+        return record
+
+    record_factory._adds_trace_id = True
+    logging.setLogRecordFactory(record_factory)
+
+class MemoryTraceStore:
+    """Ring buffer các trace chậm trong process hiện tại"""
+
+    def __init__(self, max_size=200):
+        self._traces = deque(maxlen=max_size)
+        self._lock = threading.Lock()
+
+    def add(self, trace_data):
+        with self._lock:
+            self._traces.append(trace_data)
+
+    def list(self, limit=50, min_duration_ms=0, path=None):
+        with self._lock:
+            traces = list(self._traces)
+        traces.reverse()
+        result = []
+        for trace_data in traces:
+            if trace_data["duration_ms"] < min_duration_ms:
+                continue
+            if path and path not in trace_data["name"]:
+                continue
+            result.append({key: value for key, value in trace_data.items() if key != "spans"})
+            if len(result) >= limit:
+                break
+        return result
+
+    def get(self, trace_id):
+        with self._lock:
+            for trace_data in self._traces:
+                if trace_data["trace_id"] == trace_id:
+                    return trace_data
+        return None
+
+class MongoTraceStore:
+    """Lưu trace chậm vào capped collection, dùng chung giữa các worker"""
+
+    def __init__(self, max_size=200, size_bytes=32 * 1024 * 1024):
+        self.max_size = max_size
+        self.size_bytes = size_bytes
+        self._ready = False
+
+    def _collection(self):
+        from models.conversation_model import get_db
+        db = get_db()
+        if not self._ready:
+            if SLOW_TRACES_COLLECTION not in db.list_collection_names():
+                try:
+                    db.create_collection(SLOW_TRACES_COLLECTION, capped=True, size=self.size_bytes, max=self.max_size)
+                except Exception as e:
+                    # Worker khác có thể đã tạo collection
+                    logger.debug(f"Không tạo được collection {SLOW_TRACES_COLLECTION}: {e}")
+            self._ready = True
+        return db[SLOW_TRACES_COLLECTION]
+
+    def add(self, trace_data):
+        self._collection().insert_one(dict(trace_data, _id=trace_data["trace_id"]))
+
+    def list(self, limit=50, min_duration_ms=0, path=None):
+        query = {"duration_ms": {"$gte": min_duration_ms}}
+        if path:
+            query["name"] = {"$regex": path.replace(".", r"\.")}
+        cursor = self._collection().find(query, {"_id": 0, "spans": 0}).sort("$natural", -1).limit(limit)
+        return list(cursor)
+
+    def get(self, trace_id):
+        return self._collection().find_one({"_id": trace_id}, {"_id": 0})
+
+# Global instance để implement singleton pattern
+_trace_store_instance = None
+_trace_store_lock = threading.Lock()
+
+def get_trace_store():
+    """Singleton pattern cho nơi lưu các trace chậm (memory hoặc mongo theo TRACE_STORE)"""
+    global _trace_store_instance
+    if _trace_store_instance is None:
+        with _trace_store_lock:
+            if _trace_store_instance is None:
+                if TRACE_STORE == "mongo":
+                    _trace_store_instance = MongoTraceStore(max_size=TRACE_BUFFER_SIZE)
+                else:
+                    _trace_store_instance = MemoryTraceStore(max_size=TRACE_BUFFER_SIZE)
+    return _trace_store_instance
+
+def record_slow_trace(trace):
+    """Lưu cây span của trace nếu vượt ngưỡng TRACE_SLOW_REQUEST_MS"""
+    duration_ms = trace.duration * 1000
+    if duration_ms < TRACE_SLOW_REQUEST_MS:
+        return False
+    logger.warning(f"Request chậm: {trace.name} mất {duration_ms:.0f}ms (trace {trace.trace_id})")
+    try:
+        get_trace_store().add(trace.to_dict())
+        return True
+    except Exception as e:
+        logger.error(f"Lỗi lưu trace chậm {trace.trace_id}: {e}")
+        return False
+
+def _valid_trace_id(value):
+    return bool(value) and len(value) <= 64 and all(c.isalnum() or c in "-_" for c in value)
+
+def init_app(app):
+    """
+    Mỗi request có một trace: trace ID trong log và header X-Trace-Id, header Server-Timing,
+    request chậm được lưu lại toàn bộ cây span
+
+    Trace được kết thúc ở teardown_request nên response streaming được tính tới khi stream xong
+    (header Server-Timing của response streaming chỉ gồm các bước trước khi bắt đầu stream).
+    """
+    if not TRACING_ENABLED:
+        return
+
+    from flask import g, request
+
+    @app.before_request
+    def _tracing_start_request():
+        incoming_id = request.headers.get(TRACE_ID_HEADER)
+        trace, tokens = start_trace(
+            f"{request.method} {request.path}",
+            trace_id=incoming_id if _valid_trace_id(incoming_id) else None
+        )
+        g._trace = trace
+        g._trace_tokens = tokens
+
+    @app.after_request
+    def _tracing_add_headers(response):
+        trace = g.get("_trace")
+        if trace is not None:
+            response.headers[TRACE_ID_HEADER] = trace.trace_id
+            if SERVER_TIMING_ENABLED:
+                response.headers["Server-Timing"] = trace.server_timing()
+            trace.attrs["status"] = response.status_code
+        return response
+
+    @app.teardown_request
+    def _tracing_end_request(exc):
+        trace = g.pop("_trace", None)
+        tokens = g.pop("_trace_tokens", None)
+        if trace is None:
+            return
+        if request.url_rule is not None:
+            trace.attrs["endpoint"] = request.url_rule.rule
+        if exc is not None:
+            trace.attrs["status"] = 500
+            trace.attrs["error"] = str(exc)
+        try:
+            finish_trace(trace, tokens)
+        except ValueError:
+            # Teardown chạy ở context khác với before_request (token không còn hợp lệ)
+            _current_trace.set(None)
+            _current_span.set(None)
+            trace.finish()
+        record_slow_trace(trace)